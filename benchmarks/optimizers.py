@@ -0,0 +1,433 @@
+"""
+Benchmark the optimizers of :mod:`madgui.util.fit` on synthetic problems.
+
+The problems are modeled on the fits that madgui performs in practice, and
+are computed on FODO transfer lines of varying size that are generated
+locally, i.e. no model files or machine connection are required:
+
+- ``orbit``: fit the initial orbit to the orbit at all monitors
+- ``orm``: fit relative quadrupole errors to an orbit response matrix
+- ``offsets``: fit monitor offsets and the initial orbit to the orbit
+  measured for several optics
+- ``match``: fit quadrupole strengths to the optics at all monitors
+
+For each problem, size and optimizer, a number of trials with random true
+parameters is performed. The wall time, the number of model evaluations,
+the final χ² and the convergence rate are reported and appended to a JSON
+history file, so that results can be tracked between releases.
+
+Residuals are normalized by the assumed measurement accuracy. A fit is
+considered converged if it reaches a reduced χ² below 1.
+
+Run as ``python benchmarks/optimizers.py`` (requires madgui to be
+installed).
+
+Usage:
+    optimizers.py [options]
+
+Options:
+    -o FILE, --output FILE      Append results to this JSON file
+                                [default: benchmark.json]
+    -p LIST, --problems LIST    Comma separated problems
+                                [default: orbit,orm,offsets,match]
+    -s LIST, --sizes LIST       Comma separated numbers of FODO cells
+                                [default: 2,4,8]
+    -m LIST, --methods LIST     Comma separated optimizers, or "all" for
+                                all supported optimizers [default: all]
+    -t N, --trials N            Number of trials per case [default: 3]
+    -b N, --budget N            Max model evaluations per fit [default: 1000]
+    --seed N                    Random seed [default: 0]
+    -h, --help                  Show this help
+"""
+
+__all__ = [
+    'synthetic_lattice',
+    'load_lattice',
+    'Problem',
+    'OrbitFit',
+    'ErrorFit',
+    'OffsetCalibration',
+    'QuadMatch',
+    'problems',
+    'run_case',
+    'run_benchmark',
+    'main',
+]
+
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from madgui import __version__
+from madgui.model.errors import apply_errors, parse_error
+from madgui.model.madx import Model
+from madgui.util.fit import fit, reduced_chisq, supported_optimizers
+
+
+def synthetic_lattice(cells, kl=0.35, length=4.0):
+    """Return the MAD-X source of a FODO transfer line with the given number
+    of cells. Each cell contains a focusing and a defocusing quadrupole
+    (knobs ``kL_qf<i>``, ``kL_qd<i>``), a horizontal and a vertical kicker
+    (``ax_hk<i>``, ``ay_vk<i>``) and a monitor behind each quadrupole
+    (``mf<i>``, ``md<i>``)."""
+    lines = []
+    for i in range(cells):
+        lines += [
+            "kL_qf{0} = {1}; kL_qd{0} = {2};".format(i, kl, -kl),
+            "ax_hk{0} = 0; ay_vk{0} = 0;".format(i),
+            "qf{0}: quadrupole, l=0.3, k1:=kL_qf{0}/0.3;".format(i),
+            "qd{0}: quadrupole, l=0.3, k1:=kL_qd{0}/0.3;".format(i),
+            "hk{0}: hkicker, kick:=ax_hk{0};".format(i),
+            "vk{0}: vkicker, kick:=ay_vk{0};".format(i),
+            "mf{0}: monitor; md{0}: monitor;".format(i),
+        ]
+    lines += [
+        "begin: marker;",
+        "fodo: sequence, l={}, refer=entry;".format(cells * length),
+        "begin, at=0;",
+    ]
+    for i in range(cells):
+        s = i * length
+        lines += [
+            "qf{}, at={};".format(i, s + 0.1),
+            "hk{}, at={};".format(i, s + 0.6),
+            "mf{}, at={};".format(i, s + 0.9),
+            "qd{}, at={};".format(i, s + 0.5 * length + 0.1),
+            "vk{}, at={};".format(i, s + 0.5 * length + 0.6),
+            "md{}, at={};".format(i, s + 0.5 * length + 0.9),
+        ]
+    lines += [
+        "endsequence;",
+        "beam, particle=proton, energy=2;",
+        "use, sequence=fodo;",
+        "twiss, sequence=fodo, betx=5, bety=5;",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def load_lattice(cells, folder, **madx_kwargs):
+    """Write the lattice with the given number of cells to a file in
+    ``folder`` and return the loaded :class:`~madgui.model.madx.Model`."""
+    filename = os.path.join(folder, 'fodo{}.madx'.format(cells))
+    with open(filename, 'w') as f:
+        f.write(synthetic_lattice(cells))
+    model = Model.load_file(filename, **madx_kwargs)
+    model.cells = cells
+    return model
+
+
+class Problem:
+
+    """
+    Base class for benchmark problems. Subclasses define the parameters via
+    :meth:`parameters` and the observed quantities via :meth:`observe`.
+
+    On construction, true parameters are drawn uniformly from ``±scale``
+    around ``x0 = 0`` and the corresponding measurement is computed.
+
+    :ivar Model model: the model of the lattice
+    :ivar np.ndarray x0: start parameters
+    :ivar np.ndarray x_true: parameters used to compute the measurement
+    :ivar float scale: magnitude of the parameters
+    :ivar float sigma: measurement accuracy, used to normalize residuals
+    """
+
+    name = None
+    scale = 1e-3
+    sigma = 1e-5
+
+    def __init__(self, model, rng):
+        self.model = model
+        self.monitors = ['{}{}'.format(m, i)
+                         for i in range(model.cells) for m in ('mf', 'md')]
+        self.quads = ['kL_{}{}'.format(q, i)
+                      for i in range(model.cells) for q in ('qf', 'qd')]
+        self.kickers = ['{}{}'.format(k, i)
+                        for i in range(model.cells)
+                        for k in ('ax_hk', 'ay_vk')]
+        self.nparams = len(self.parameters())
+        self.x0 = np.zeros(self.nparams)
+        self.x_true = self.scale * rng.uniform(-1, 1, self.nparams)
+        self.measured = self.observe(self.x_true)
+        self.delta = self.scale / 10
+
+    def parameters(self):
+        """Return the list of parameter names. Parameters that are model
+        errors are named as understood by
+        :func:`~madgui.model.errors.parse_error`."""
+        raise NotImplementedError
+
+    def observe(self, x):
+        """Return the observed quantities for the given parameters."""
+        raise NotImplementedError
+
+    def residuals(self, x):
+        """Objective function, normalized by :attr:`sigma`."""
+        return (self.observe(x) - self.measured) / self.sigma
+
+    def twiss(self, columns, errors, values):
+        """Return the given columns at the monitors for a TWISS with the
+        given errors applied."""
+        model = self.model
+        rows = [model.elements.index(m) - model.start.index
+                for m in self.monitors]
+        errors = [parse_error(name) for name in errors]
+        with apply_errors(model, errors, values):
+            twiss = model.madx.twiss(
+                **model._get_twiss_args(table='benchmark'))
+            return np.hstack([twiss[col][rows] for col in columns])
+
+
+class OrbitFit(Problem):
+
+    """Fit the initial orbit to the orbit measured at all monitors."""
+
+    name = 'orbit'
+    scale = 1e-3
+    sigma = 1e-5
+
+    def parameters(self):
+        return ['x', 'px', 'y', 'py']
+
+    def observe(self, x):
+        return self.twiss(('x', 'y'), self.parameters(), x)
+
+
+class ErrorFit(Problem):
+
+    """Fit relative errors of all quadrupoles to the orbit response matrix
+    of all kickers at all monitors."""
+
+    name = 'orm'
+    scale = 1e-2
+    sigma = 1e-3
+
+    def parameters(self):
+        return ['δ' + name for name in self.quads]
+
+    def observe(self, x):
+        errors = [parse_error(name) for name in self.parameters()]
+        return self.model.get_orbit_response_matrix(
+            self.monitors, self.kickers, errors, x,
+            method='analytic').flatten()
+
+
+class OffsetCalibration(Problem):
+
+    """Fit the monitor offsets and the initial orbit to the orbit measured
+    for three optics, that differ in the strengths of the focusing and
+    defocusing quadrupoles respectively."""
+
+    name = 'offsets'
+    scale = 1e-3
+    sigma = 1e-5
+
+    def parameters(self):
+        return ['x', 'px', 'y', 'py'] + [
+            '{}.{}'.format(monitor, axis)
+            for axis in 'xy' for monitor in self.monitors]
+
+    def observe(self, x):
+        errors = ['x', 'px', 'y', 'py'] + ['δ' + q for q in self.quads]
+        return np.hstack([
+            self.twiss(('x', 'y'), errors, list(x[:4]) + optic) + x[4:]
+            for optic in self.optics()
+        ])
+
+    def optics(self):
+        """Return the relative quadrupole errors of the three optics."""
+        n = len(self.quads)
+        return [
+            [0.0] * n,
+            [0.3 if q.startswith('kL_qf') else 0.0 for q in self.quads],
+            [0.3 if q.startswith('kL_qd') else 0.0 for q in self.quads],
+        ]
+
+
+class QuadMatch(Problem):
+
+    """Fit the strengths of all quadrupoles to the beta and alpha functions
+    at all monitors."""
+
+    name = 'match'
+    scale = 2e-2
+    sigma = 1e-2
+
+    def parameters(self):
+        return ['Δ' + name for name in self.quads]
+
+    def observe(self, x):
+        return self.twiss(
+            ('betx', 'bety', 'alfx', 'alfy'), self.parameters(), x)
+
+
+problems = {
+    cls.name: cls
+    for cls in (OrbitFit, ErrorFit, OffsetCalibration, QuadMatch)
+}
+
+
+class BudgetExceeded(Exception):
+    """Raised when a fit exceeds its number of model evaluations."""
+
+
+def run_case(problem, method, budget=1000):
+    """Fit a problem using the given optimizer and return a dict with the
+    wall time, number of model evaluations and final χ². Fits that exceed
+    ``budget`` model evaluations or fail in the model are aborted and report
+    the best χ² so far."""
+    state = {'nfev': 0, 'chisq': np.inf, 'x': problem.x0}
+
+    def objective(x):
+        if state['nfev'] >= budget:
+            raise BudgetExceeded
+        state['nfev'] += 1
+        y = problem.residuals(x)
+        chisq = reduced_chisq(y)
+        if chisq < state['chisq']:
+            state.update(chisq=chisq, x=x)
+        return y
+
+    options = {'delta': problem.delta}
+    if method == 'basinhopping':
+        options['stepsize'] = problem.scale
+    start = time.perf_counter()
+    try:
+        result = fit(objective, problem.x0, algorithm=method, **options)
+        message = str(result.message)
+    except BudgetExceeded:
+        message = "Exceeded budget"
+    except Exception as e:
+        # e.g. TWISS failed for an unstable optics:
+        message = "Failed: {}".format(type(e).__name__)
+    wall_time = time.perf_counter() - start
+    chisq = float(state['chisq'])
+    return {
+        'wall_time': wall_time,
+        'nfev': state['nfev'],
+        'chisq': chisq,
+        'converged': chisq < 1,
+        'x_error': float(np.abs(state['x'] - problem.x_true).max()),
+        'message': message,
+    }
+
+
+def run_benchmark(problem_names, sizes, methods, trials=3, budget=1000,
+                  seed=0, callback=None, **madx_kwargs):
+    """Run all combinations of problems, sizes and methods, and return the
+    list of results. ``callback`` is called with each result as soon as it
+    is available."""
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for cells in sizes:
+            model = load_lattice(cells, folder, **madx_kwargs)
+            try:
+                for name in problem_names:
+                    rng = np.random.default_rng(
+                        np.random.SeedSequence(seed, spawn_key=(cells,)))
+                    instances = [
+                        problems[name](model, rng) for _ in range(trials)]
+                    for method in methods:
+                        runs = [run_case(p, method, budget)
+                                for p in instances]
+                        result = _summarize(
+                            name, cells, method, instances[0], runs)
+                        results.append(result)
+                        if callback is not None:
+                            callback(result)
+            finally:
+                model.destroy()
+    return results
+
+
+def _summarize(name, cells, method, problem, runs):
+    return {
+        'problem': name,
+        'cells': cells,
+        'method': method,
+        'nparams': problem.nparams,
+        'nresiduals': len(problem.measured),
+        'trials': len(runs),
+        'convergence_rate': np.mean([r['converged'] for r in runs]),
+        'wall_time': np.mean([r['wall_time'] for r in runs]),
+        'nfev': np.mean([r['nfev'] for r in runs]),
+        'chisq': np.median([r['chisq'] for r in runs]),
+        'runs': runs,
+    }
+
+
+def _versions():
+    import cpymad
+    import scipy
+    return {
+        'madgui': __version__,
+        'cpymad': cpymad.__version__,
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+    }
+
+
+def _jsonify(value):
+    if isinstance(value, dict):
+        return {k: _jsonify(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonify(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def main(argv=None):
+    """Run the benchmark from the command line."""
+    from docopt import docopt
+    opts = docopt(__doc__, argv)
+    split = lambda arg: [item.strip() for item in arg.split(',')]
+    print("{:<8} {:>5} {:<13} {:>6} {:>9} {:>7} {:>10} {:>5}".format(
+        'problem', 'cells', 'method', 'params', 'time/s', 'nfev',
+        'chisq', 'conv'))
+
+    def report(r):
+        print("{:<8} {:>5} {:<13} {:>6} {:>9.3f} {:>7.0f} {:>10.3g} {:>5.0%}"
+              .format(r['problem'], r['cells'], r['method'], r['nparams'],
+                      r['wall_time'], r['nfev'], r['chisq'],
+                      r['convergence_rate']), flush=True)
+
+    methods = split(opts['--methods'])
+    if methods == ['all']:
+        methods = list(supported_optimizers)
+
+    results = run_benchmark(
+        split(opts['--problems']),
+        [int(n) for n in split(opts['--sizes'])],
+        methods,
+        trials=int(opts['--trials']),
+        budget=int(opts['--budget']),
+        seed=int(opts['--seed']),
+        callback=report,
+        stdout=False)
+
+    filename = opts['--output']
+    history = []
+    if os.path.exists(filename):
+        with open(filename) as f:
+            history = json.load(f)
+    history.append(_jsonify({
+        'date': datetime.now(timezone.utc).isoformat(),
+        'versions': _versions(),
+        'options': {
+            'trials': int(opts['--trials']),
+            'budget': int(opts['--budget']),
+            'seed': int(opts['--seed']),
+        },
+        'results': results,
+    }))
+    with open(filename, 'w') as f:
+        json.dump(history, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
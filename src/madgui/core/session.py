@@ -65,8 +65,7 @@ class Session:
         self.config.interpolate = points_per_meter
         model = self.model()
         if model:
-            model.interpolate = points_per_meter
-            model.invalidate()
+            model.set_interpolate(points_per_meter)
 
     def configure(self):
         paths = self.config.get('run_path', [])
@@ -124,7 +123,10 @@ class Session:
 
     def model_args(self, filename):
         """Please OVERRIDE to provide custom model arguments."""
-        return {'interpolate': self.config.interpolate}
+        return {
+            'interpolate': self.config.interpolate,
+            'snapshot_dir': self.config.snapshot_dir,
+        }
 
     def save(self, filename):
         """Save session state to file."""
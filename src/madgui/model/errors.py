@@ -13,6 +13,7 @@ Errors are represented as strings such as::
 __all__ = [
     'import_errors',
     'apply_errors',
+    'vary_errors',
     'parse_error',
     'Param',
     'Ealign',
@@ -28,8 +29,11 @@ __all__ = [
 import re
 from contextlib import ExitStack
 
+from cpymad.types import AlignError, FieldError
 from cpymad.util import is_identifier
 
+from madgui.util.misc import freeze
+
 
 def import_errors(model, spec: dict):
     """
@@ -42,12 +46,128 @@ def import_errors(model, spec: dict):
 
 def apply_errors(model, errors, values):
     """Apply list of errors and list of corresponding values to a given model."""
+    errors, values = list(errors), list(values)
     with ExitStack() as stack:
-        for error, value in zip(errors, values):
-            stack.enter_context(error.vary(model, value))
+        stack.enter_context(model.temporary_state(
+            (tuple(map(repr, errors)), tuple(values))))
+        stack.enter_context(vary_errors(model, errors, values))
         return stack.pop_all()
 
 
+def vary_errors(model, errors, values):
+    """
+    Apply multiple errors like :meth:`BaseError.vary` and return a context
+    manager that restores the original values on exit.
+
+    Errors are grouped by type and passed to :meth:`BaseError.set_many`, so
+    that applying and restoring requires only a single batch of MAD-X
+    commands each. If several errors refer to the same quantity, they are
+    applied one after another instead.
+    """
+    errors, values = list(errors), list(values)
+    with ExitStack() as stack:
+        if len({error.name for error in errors}) < len(errors):
+            for error, value in zip(errors, values):
+                stack.enter_context(error.vary(model, value))
+            return stack.pop_all()
+        old = [e.get(model, v) for e, v in zip(errors, values)]
+        new = [e.tinker(o, v) for e, o, v in zip(errors, old, values)]
+        changed = [(e, o, n) for e, o, n in zip(errors, old, new) if n != o]
+        _set_errors(model, [(e, n) for e, o, n in changed])
+        stack.callback(_set_errors, model, [(e, o) for e, o, n in changed])
+        return stack.pop_all()
+
+
+def _set_errors(model, items):
+    """Set the values of a list of ``(error, value)`` pairs using a single
+    batch of MAD-X commands."""
+    groups = {}
+    for error, value in items:
+        groups.setdefault(type(error), []).append((error, value))
+    with model.madx.batch():
+        for cls, group in groups.items():
+            if cls.batched:
+                cls.set_many(model, group)
+    for cls, group in groups.items():
+        if not cls.batched:
+            cls.set_many(model, group)
+
+
+def _select_many(model, selections, commands):
+    """Issue commands (such as EALIGN) for multiple selections at once. The
+    commands are given as list of ``(name, kwargs)`` pairs."""
+    cmd = model.madx.command
+    cmd.select(flag='error', clear=True)
+    for select in selections:
+        cmd.select(flag='error', **select)
+    for name, kwargs in commands:
+        cmd[name](**kwargs)
+
+
+def _set_records(model, command, get_record, items):
+    """Merge the values of a list of ``(error, value)`` pairs into the
+    current error records of the selected elements, and assign them."""
+    attrs = {}
+    for error, value in items:
+        elem = model.elements[error.select['range']]
+        attrs.setdefault(elem.node_name, (elem, {}))[1][error.attr] = value
+    records = []
+    for name, (elem, values) in attrs.items():
+        old = get_record(elem)
+        records.append((name, old, dict(old, **values)))
+    _assign_errors(model, command, records)
+
+
+def _assign_errors(model, command, records):
+    """
+    Set the complete alignment or field error record (``command`` is
+    ``'ealign'`` or ``'efcomp'``) of elements to absolute values. The
+    ``records`` are given as list of ``(node_name, old, new)`` where ``old``
+    is the current record.
+
+    The result must not depend on the EOPTION ADD setting, which can not be
+    queried from MAD-X. Therefore ``-old`` is applied first, which either
+    cancels the current errors, or is replaced anyway by applying ``new``.
+    Elements with equal records share the same commands.
+    """
+    groups = {}
+    for name, old, new in records:
+        groups.setdefault(freeze((old, new)), (old, new, []))[2].append(
+            {'range': name})
+    for old, new, selections in groups.values():
+        reset = {k: _negate(v) for k, v in old.items()}
+        # `reset == old` if there are no errors yet (since -0.0 == 0.0):
+        commands = [(command, new)] if reset == old else [
+            (command, reset), (command, new)]
+        _select_many(model, selections, commands)
+
+
+def _negate(value):
+    if isinstance(value, tuple):
+        return tuple(-v for v in value)
+    return -value
+
+
+def _align_errors(elem):
+    """Return the alignment errors of an element as dict."""
+    errors = elem.align_errors
+    if errors is None:
+        return dict.fromkeys(AlignError._fields, 0.0)
+    return {k: float(v) for k, v in errors._asdict().items()}
+
+
+# Number of multipole orders for which MAD-X stores field errors:
+FIELD_ORDERS = 21
+
+
+def _field_errors(elem):
+    """Return the field errors of an element as dict of tuples."""
+    errors = elem.field_errors
+    if errors is None:
+        return dict.fromkeys(FieldError._fields, (0.0,) * FIELD_ORDERS)
+    return {k: tuple(map(float, v)) for k, v in errors._asdict().items()}
+
+
 def parse_error(name):
     """
     Instanciate a subtype of :class:`BaseError`, depending on the format of
@@ -127,9 +247,28 @@ class BaseError:
         """Update the error value."""
         raise NotImplementedError
 
+    # Whether `set_many` only issues MAD-X commands that can be batched:
+    batched = True
+
+    @classmethod
+    def set_many(cls, model, items):
+        """Update the values for a list of ``(error, value)`` pairs of this
+        type. Subclasses can override this to merge the MAD-X commands."""
+        for error, value in items:
+            error.set(model, value)
+
     def __repr__(self):
         return "{}{}".format(self.leader, self.name)
 
+    # Compare by value, so that equal errors can be used as cache keys, see
+    # :meth:`~madgui.model.madx.Model.get_orbit_response_matrix`:
+
+    def __eq__(self, other):
+        return type(self) is type(other) and vars(self) == vars(other)
+
+    def __hash__(self):
+        return hash((type(self), freeze(vars(self))))
+
     def tinker(self, value, step):
         """Return the value that should be passed to :meth:`set` in order to
         increment the error by ``step``. ``value`` is provided as the return
@@ -156,67 +295,89 @@ class Param(BaseError):
     def set(self, model, value):
         model.globals[self.name] = value
 
+    @classmethod
+    def set_many(cls, model, items):
+        # Bypass `model.globals` to avoid an update per variable:
+        for error, value in items:
+            model.madx.globals[error.name] = value
+
     def is_defined_for(self, model):
         return self.name in model.globals
 
 
 class Ealign(BaseError):
 
-    """Alignment error."""
+    """
+    Alignment error of a single element, selected by ``range``. The value is
+    the absolute value of the attribute (e.g. ``dx``) in the error record of
+    the element. Other attributes of the record are left unchanged.
+    """
 
     def __init__(self, select, attr):
+        if set(select) != {'range'}:
+            raise ValueError(
+                "Ealign only supports selection by range: {!r}"
+                .format(select))
         self.select = select
         self.attr = attr
         self.name = '{}<{}>'.format(select.get('range'), attr)
 
-    def set(self, model, value):
-        cmd = model.madx.command
-        cmd.select(flag='error', clear=True)
-        cmd.select(flag='error', **self.select)
-        cmd.ealign(**{self.attr: value})
-
     def get(self, model, step):
-        return -step
+        elem = model.elements[self.select['range']]
+        return _align_errors(elem)[self.attr]
 
-    def tinker(self, value, step):
-        return -value
+    def set(self, model, value):
+        self.set_many(model, [(self, value)])
+
+    @classmethod
+    def set_many(cls, model, items):
+        _set_records(model, 'ealign', _align_errors, items)
 
     def is_defined_for(self, model):
-        elem = self.select.get('range')
-        return elem and elem in model.elements
+        return self.select['range'] in model.elements
 
 
 class Efcomp(BaseError):
 
-    """Field error."""
+    """
+    Field error of a single element, selected by ``range``. The coefficients
+    in ``value`` multiplied by the error value are added to the absolute
+    field errors ``attr`` (``dkn`` or ``dks``) of the element. Relative field
+    errors (``dknr``, ``dksr``) are not supported.
+    """
 
-    def __init__(self, select, attr, value, order=0, radius=1):
+    def __init__(self, select, attr, value):
+        if attr not in FieldError._fields:
+            raise ValueError(
+                "Efcomp only supports absolute field errors: {!r}"
+                .format(attr))
+        if set(select) != {'range'}:
+            raise ValueError(
+                "Efcomp only supports selection by range: {!r}"
+                .format(select))
         self.select = select
         self.attr = attr
         self.value = value
-        self.order = order
-        self.radius = radius
         self.name = '{}+{}'.format(select['range'], attr)
 
-    def set(self, model, value):
-        cmd = model.madx.command
-        cmd.select(flag='error', clear=True)
-        cmd.select(flag='error', **self.select)
-        cmd.efcomp(**{
-            'order': self.order,
-            'radius': self.radius,
-            self.attr: [v * value for v in self.value],
-        })
-
     def get(self, model, step):
-        return -step
+        elem = model.elements[self.select['range']]
+        return _field_errors(elem)[self.attr]
+
+    def set(self, model, value):
+        self.set_many(model, [(self, value)])
 
     def tinker(self, value, step):
-        return -value
+        coeffs = list(self.value[:len(value)])
+        coeffs += [0] * (len(value) - len(coeffs))
+        return tuple(v + c * step for v, c in zip(value, coeffs))
+
+    @classmethod
+    def set_many(cls, model, items):
+        _set_records(model, 'efcomp', _field_errors, items)
 
     def is_defined_for(self, model):
-        elem = self.select.get('range')
-        return elem and elem in model.elements
+        return self.select['range'] in model.elements
 
 
 class ElemAttr(BaseError):
@@ -234,6 +395,14 @@ class ElemAttr(BaseError):
     def set(self, model, value):
         model.elements[self.elem][self.attr] = value
 
+    @classmethod
+    def set_many(cls, model, items):
+        attrs = {}
+        for error, value in items:
+            attrs.setdefault(error.elem, {})[error.attr] = value
+        for elem, values in attrs.items():
+            model.elements[elem](**values)
+
     def is_defined_for(self, model):
         return self.elem in model.elements
 
@@ -248,6 +417,14 @@ class InitTwiss(BaseError):
     def set(self, model, value):
         model.update_twiss_args({self.name: value})
 
+    # `update_twiss_args` notifies listeners that may access MAD-X:
+    batched = False
+
+    @classmethod
+    def set_many(cls, model, items):
+        model.update_twiss_args({
+            error.name: value for error, value in items})
+
 
 class RelativeError(BaseError):
 
@@ -0,0 +1,318 @@
+"""
+Linear optics engine that computes orbit and beam envelopes in NumPy by
+propagating through the element transfer maps.
+"""
+
+__all__ = [
+    'LinearOptics',
+    'LinearMatch',
+    'element_map',
+    'MAP_ATTRS',
+    'focusing_map',
+    'quadrupole_map',
+    'kick_vector',
+    'dipole_edge_map',
+]
+
+from types import SimpleNamespace
+
+import numpy as np
+from scipy.linalg import expm, logm
+
+from .transfer import TransferMapCache
+
+
+def focusing_map(k, length):
+    """Return the 2×2 transfer map of a thick lens with focusing strength
+    ``k`` (positive means focusing) in one transverse plane."""
+    if k > 0:
+        w = np.sqrt(k)
+        c, s = np.cos(w*length), np.sin(w*length)
+        return np.array([[c, s/w], [-w*s, c]])
+    if k < 0:
+        w = np.sqrt(-k)
+        c, s = np.cosh(w*length), np.sinh(w*length)
+        return np.array([[c, s/w], [w*s, c]])
+    return np.array([[1, length], [0, 1]])
+
+
+def quadrupole_map(k1, length):
+    """Return the transverse 4×4 transfer map of an upright quadrupole."""
+    tm = np.zeros((4, 4))
+    tm[:2, :2] = focusing_map(k1, length)
+    tm[2:, 2:] = focusing_map(-k1, length)
+    return tm
+
+
+def kick_vector(hkick, vkick, length):
+    """Return the transverse kick vector ``(x, px, y, py)`` of a (thick)
+    kicker, i.e. the 7th column of its transfer map."""
+    return np.array([hkick*length/2, hkick, vkick*length/2, vkick])
+
+
+def dipole_edge_map(h, edge, fint=0, hgap=0):
+    """
+    Return the 7×7 first order transfer map of a dipole edge with the given
+    curvature ``h`` of the dipole, pole face angle ``edge``, and fringe
+    field integral ``fint`` over the half gap ``hgap``, as in MAD-X.
+    """
+    corr = 2 * h * hgap * fint
+    psi = edge - corr / np.cos(edge) * (1 + np.sin(edge)**2)
+    tm = np.eye(7)
+    tm[1, 0] = h * np.tan(edge)
+    tm[3, 2] = -h * np.tan(psi)
+    return tm
+
+
+# Attributes from which `element_map` re-derives the map, by element type:
+MAP_ATTRS = {
+    'quadrupole': ('k1',),
+    'hkicker': ('kick',),
+    'vkicker': ('kick',),
+    'kicker': ('hkick', 'vkick'),
+}
+
+
+def element_map(tm, elem):
+    """
+    Return a copy of the 7×7 element map ``tm`` with the linear part (or
+    kick) re-derived from the attributes of ``elem`` (a MAD-X element or any
+    object with attributes ``base_name``, ``length``, ``k1``, etc). Returns
+    ``None`` if the element type is not supported. Only the attributes in
+    :data:`MAP_ATTRS` may change between calls for the same element.
+    """
+    tm = tm.copy()
+    base_name = elem.base_name.lower()
+    length = float(elem.length)
+    if base_name == 'quadrupole' and not (elem.k1s or elem.tilt):
+        tm[:4, :4] = quadrupole_map(float(elem.k1), length)
+    elif base_name == 'hkicker':
+        tm[:4, 6] = kick_vector(float(elem.kick), 0, length)
+    elif base_name == 'vkicker':
+        tm[:4, 6] = kick_vector(0, float(elem.kick), length)
+    elif base_name == 'kicker':
+        tm[:4, 6] = kick_vector(float(elem.hkick), float(elem.vkick), length)
+    else:
+        return None
+    return tm
+
+
+class LinearOptics:
+
+    """
+    Computes orbit and sigma matrix at the exit of all elements from the
+    initial conditions and the 7×7 element maps (including kicks).
+
+    The element maps and initial conditions are usually obtained from MAD-X
+    which serves as the reference. When element strengths change, only the
+    maps of the affected elements are re-derived in NumPy, see
+    :meth:`update_element`. Changes that can not be handled this way mark the
+    engine as out of sync, meaning it must be recreated from MAD-X. The
+    engine is used for matching, see :class:`LinearMatch`.
+
+    Note that MAD-X expands the transfer maps around the orbit, whereas the
+    re-derived maps are purely linear. Results can therefore deviate in
+    higher order from a full MAD-X TWISS.
+
+    :ivar bool synced: whether the maps still represent the model
+    """
+
+    def __init__(self, maps, orbit, sigma, columns=None):
+        """
+        :param maps: `N×7×7` element maps
+        :param orbit: 6D orbit at the exit of the first element
+        :param sigma: 6×6 sigma matrix at the exit of the first element
+        :param dict columns: constant columns to include in the results
+        """
+        self.cache = TransferMapCache(maps)
+        self.columns = columns or {}
+        self.synced = True
+        # Transform initial conditions back to the entry of the sequence, so
+        # that all states can be obtained from the prefix products:
+        inv = np.linalg.inv(self.cache.prefix[1])
+        self.orbit = np.dot(inv, np.append(orbit, 1))
+        self.sigma = np.dot(np.dot(inv[:6, :6], sigma), inv[:6, :6].T)
+        self._result = None
+
+    def update_element(self, index, elem):
+        """
+        Re-derive the transfer map of the element at ``index`` from its
+        current attributes (as obtained from the MAD-X element ``elem``).
+        Returns ``False`` and marks the engine as out of sync if the element
+        type is not supported.
+        """
+        tm = element_map(self.cache.maps[index], elem)
+        if tm is None:
+            self.synced = False
+            return False
+        self.cache.update(index, [tm])
+        self._result = None
+        return True
+
+    def twiss(self):
+        """
+        Return a dict of columns with values at the exit of each element:
+
+        - ``x``, ``px``, ``y``, ``py``, ``t``, ``pt``: orbit
+        - ``sigIJ``: sigma matrix elements
+        """
+        if self._result is None:
+            prefix = self.cache.prefix[1:]
+            orbit = np.dot(prefix, self.orbit)
+            tm = prefix[:, :6, :6]
+            sigma = np.einsum('nij,jk,nlk->nil', tm, self.sigma, tm)
+            result = dict(self.columns)
+            result.update({
+                name: orbit[:, i]
+                for i, name in enumerate(['x', 'px', 'y', 'py', 't', 'pt'])
+            })
+            result.update({
+                'sig{}{}'.format(i+1, j+1): sigma[:, i, j]
+                for i in range(6)
+                for j in range(6)
+            })
+            self._result = result
+        return self._result
+
+
+class LinearMatch:
+
+    """
+    Finds the variable values that satisfy constraints on the orbit and the
+    sigma matrix at given positions, using a damped Gauss-Newton method
+    (Levenberg-Marquardt) on the element maps of a :class:`LinearOptics`
+    engine.
+
+    Element attributes are assumed to depend linearly on the variables, i.e.
+    ``attr = attr₀ + Σ slope·Δvar``. Per evaluation, only the maps of the
+    affected elements are re-derived, the maps between them are taken from
+    the cached products.
+
+    :cvar list columns: supported constraint columns
+    """
+
+    columns = ['x', 'px', 'y', 'py', 't', 'pt'] + [
+        'sig{}{}'.format(i+1, j+1) for i in range(6) for j in range(6)]
+
+    def __init__(self, optics, elements, slopes, constraints, step=1e-6):
+        """
+        :param LinearOptics optics: engine for the current state
+        :param dict elements: current attributes of the affected elements by
+            row index, see :func:`element_map`
+        :param list slopes: list ``[(row, attr, slope)]`` for each variable
+        :param list constraints: list of ``(row, frac, column, value,
+            weight)``, where ``frac`` is the position inside the element as
+            fraction of its length, or ``None`` for the exit
+        :param float step: relative step for the finite difference jacobian
+        :raises ValueError: if a constraint is inside an affected element or
+            an element type is not supported
+        """
+        self.optics = optics
+        self.elements = elements
+        self.slopes = slopes
+        self.step = step
+        maps = optics.cache.maps
+        if any(element_map(maps[i], e) is None for i, e in elements.items()):
+            raise ValueError("Unsupported element type!")
+        self._partial = {}
+        for row, frac, column, value, weight in constraints:
+            if frac is not None:
+                if row in elements:
+                    raise ValueError("Constraint inside a varied element!")
+                self._partial[row, frac] = expm(frac * logm(maps[row])).real
+        self.constraints = constraints
+        self._rows = sorted(set(elements) | {c[0] for c in constraints})
+        self._targets = np.array([c[3] for c in constraints], dtype=float)
+        self._weights = np.array([c[4] for c in constraints], dtype=float)
+
+    def evaluate(self, delta):
+        """Return the constrained quantities after changing the variables by
+        ``delta``."""
+        attrs = {i: dict(elem) for i, elem in self.elements.items()}
+        for d, terms in zip(delta, self.slopes):
+            for i, attr, slope in terms:
+                attrs[i][attr] += slope * d
+        cache = self.optics.cache
+        maps = {
+            i: element_map(cache.maps[i], SimpleNamespace(**a))
+            for i, a in attrs.items()
+        }
+        entry, exit = {}, {}
+        tm = np.eye(7)
+        start = 0
+        for i in self._rows:
+            tm = np.dot(cache.product(start, i), tm)
+            entry[i] = tm
+            tm = np.dot(maps.get(i, cache.maps[i]), tm)
+            exit[i] = tm
+            start = i + 1
+        values = np.empty(len(self.constraints))
+        for n, (row, frac, column, _, _) in enumerate(self.constraints):
+            tm = exit[row] if frac is None else np.dot(
+                self._partial[row, frac], entry[row])
+            if column.startswith('sig'):
+                i, j = int(column[3]) - 1, int(column[4]) - 1
+                values[n] = tm[i, :6] @ self.optics.sigma @ tm[j, :6]
+            else:
+                values[n] = tm[self.columns.index(column)] @ self.optics.orbit
+        return values
+
+    def correct(self, values):
+        """Shift the targets such that the constrained quantities take the
+        given ``values`` (e.g. from a MAD-X TWISS) at ``delta=0``, i.e. only
+        their changes are taken from the linear model. Constraints with a
+        value of ``None`` are left unchanged."""
+        current = self.evaluate(np.zeros(len(self.slopes)))
+        for n, value in enumerate(values):
+            if value is not None:
+                self._targets[n] += current[n] - value
+
+    def residuals(self, delta):
+        """Return the weighted deviations from the constraint values."""
+        return self._weights * (self.evaluate(delta) - self._targets)
+
+    def chisq(self, delta):
+        """Return the weighted sum of squared deviations."""
+        residuals = self.residuals(delta)
+        return residuals @ residuals
+
+    def jacobian(self, delta, scale):
+        """Return the jacobian of the residuals by central differences with
+        steps relative to ``scale``."""
+        steps = self.step * np.maximum(np.abs(scale), 1)
+        columns = []
+        for i, step in enumerate(steps):
+            dx = np.zeros(len(delta))
+            dx[i] = step
+            columns.append((self.residuals(delta + dx) -
+                            self.residuals(delta - dx)) / (2 * step))
+        return np.array(columns).T
+
+    def solve(self, scale, tolerance=1e-8, max_iter=50):
+        """
+        Return the variable changes that minimize :meth:`chisq`.
+
+        :param scale: typical magnitude of the variables (current values)
+        :param float tolerance: stop when ``chisq`` is below this value
+        :param int max_iter: maximum number of iterations
+        """
+        delta = np.zeros(len(self.slopes))
+        residuals = self.residuals(delta)
+        chisq = residuals @ residuals
+        damping = 1e-3
+        for _ in range(max_iter):
+            if chisq < tolerance or damping > 1e10:
+                break
+            jac = self.jacobian(delta, scale)
+            jtj = jac.T @ jac
+            step = -np.linalg.lstsq(
+                jtj + damping * np.diag(np.diag(jtj)),
+                jac.T @ residuals, rcond=None)[0]
+            trial = self.residuals(delta + step)
+            if trial @ trial < chisq:
+                delta = delta + step
+                residuals, chisq = trial, trial @ trial
+                damping /= 10
+            else:
+                damping *= 10
+        return delta
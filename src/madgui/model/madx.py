@@ -6,7 +6,11 @@ __all__ = [
     'Model',
     'reverse_sequence',
     'reverse_sequence_inplace',
+    'reverse_element_attrs',
     'TwissTable',
+    'ArrayTwissTable',
+    'InterpolatedTwissTable',
+    'ElementTable',
     '_guess_main_sequence',
     '_get_seq_model',
     '_get_twiss',
@@ -15,14 +19,15 @@ __all__ = [
 import os
 from collections import defaultdict
 from collections.abc import Mapping
-from functools import partial, reduce
-import itertools
+from functools import partial
 from bisect import bisect_right
-from contextlib import suppress
+import itertools
+from contextlib import suppress, contextmanager
 import logging
-from numbers import Number
+from numbers import Number, Integral
 
 import numpy as np
+from scipy.linalg import expm, logm
 
 from cpymad.madx import (
     Madx, AttrDict, ArrayAttribute, Command, Table, ExpandedElementList)
@@ -32,9 +37,13 @@ from cpymad.types import VAR_TYPE_DIRECT, VAR_TYPE_DEFERRED
 from madgui.util.undo import UndoCommand
 from madgui.util import yaml
 from madgui.util.export import read_str_file, import_params
-from madgui.util.misc import memoize, invalidate
+from madgui.util.misc import memoize, memoize_lru, invalidate, freeze
 from madgui.util.signal import Signal
 
+from .transfer import TransferMapCache
+from .linear import (
+    LinearOptics, LinearMatch, MAP_ATTRS, element_map, dipole_edge_map)
+
 
 class Model:
 
@@ -50,7 +59,7 @@ class Model:
     updated = Signal()
 
     def __init__(self, madx, data, *, filename=None, undo_stack=None,
-                 interpolate=0):
+                 interpolate=0, elements=None):
         super().__init__()
         self.madx = madx
         self.data = data
@@ -59,28 +68,93 @@ class Model:
         self.undo_stack = undo_stack
         if undo_stack:
             self.undo_stack.model = self
+        self._knob_state = {}
+        self._calls = []
+        self._table_ids = itertools.count()
         self._init_segment(
             sequence=data['sequence'],
             range=data['range'],
             beam=data['beam'],
             twiss_args=data['twiss'],
+            elements=elements,
         )
         self.interpolate = interpolate
-        self.invalidate()
+        self.interpolate_ranges = {}
+        self.prefetch_columns = set()
+        self._reset()
+        if elements is not None:
+            self._element_table = ElementTable(self.elements, elements)
 
     def invalidate(self):
         """Invalidate twiss and sectormap computations. Initiate
-        recomputation."""
+        recomputation.
+
+        This must also be called after modifying the MAD-X state by other
+        means than the ``update_*`` methods, since it discards the cached
+        results for previous states, see :meth:`cache_key`.
+
+        Such modifications can not be replicated to other MAD-X processes.
+        Therefore, the :attr:`twiss_worker` and the :attr:`pool` are no
+        longer used for this model afterwards."""
+        self._replicable = False
+        self._reset()
+
+    def _reset(self):
+        """Discard all results and cached data for the current lattice."""
+        self._generation += 1
+        for cache in self._result_caches().values():
+            cache.clear()
+        invalidate(self, 'element_table')
+        self._invalidate()
+
+    def _invalidate(self):
+        """Invalidate all computations for the current state."""
         invalidate(self, 'twiss')
         invalidate(self, 'sector')
         invalidate(self, 'survey')
-        self.updated.emit()
+        self._linear_optics = None
+        self._emit_updated()
+
+    def _emit_updated(self):
+        """Emit ``updated`` after a change, or, if a :attr:`twiss_worker` is
+        active, once the new twiss table has been computed."""
+        if self._held is not None:
+            self._held = True
+            return
+        if self.twiss_worker is None or not self._replicable:
+            self.updated.emit()
+        else:
+            self.twiss_worker.request()
+
+    _held = None
+
+    @contextmanager
+    def _hold_updates(self):
+        """Merge all ``updated`` notifications within the context into one
+        that is emitted on exit."""
+        if self._held is not None:
+            yield
+            return
+        self._held = False
+        try:
+            yield
+        finally:
+            pending, self._held = self._held, None
+            if pending:
+                self._emit_updated()
 
     @classmethod
     def load_file(cls, filename, madx=None, *,
-                  undo_stack=None, interpolate=0, **madx_kwargs):
+                  undo_stack=None, interpolate=0, snapshot_dir=None,
+                  **madx_kwargs):
         """Load model from .madx or .yml file and pass additional arguments
-        to the Model constructor."""
+        to the Model constructor.
+
+        If ``snapshot_dir`` is given, the MAD-X state after executing the
+        init files is cached in this folder, and restored on subsequent calls
+        as long as none of the files has changed, see
+        :class:`~madgui.model.snapshot.Snapshot`."""
+        from .snapshot import Snapshot
         madx = madx or Madx(**madx_kwargs)
         madx.option(echo=False)
         filename = os.path.abspath(filename)
@@ -91,24 +165,43 @@ class Model:
             path = os.path.join(path, data.get('path', '.'))
             _load_params(data, 'beam', path)
             _load_params(data, 'twiss', path)
-            for fname in data.get('init-files', []):
-                _call(madx, path, fname)
+            init_files = [
+                os.path.join(path, fname)
+                for fname in data.get('init-files', [])
+            ]
         else:
-            _call(madx, path, filename)
-            seqname = _guess_main_sequence(madx)
-            data = _get_seq_model(madx, seqname)
-            data['init-files'] = [filename]
-        return cls(
+            data = None
+            init_files = [filename]
+        snapshot = snapshot_dir and Snapshot(
+            snapshot_dir, madx, [filename] + init_files)
+        seq_data = snapshot.load(madx) if snapshot else None
+        restored = seq_data is not None
+        if not restored:
+            for fname in init_files:
+                _call(madx, path, fname)
+            if data is None:
+                seq_data = _get_seq_model(madx, _guess_main_sequence(madx))
+        if data is None:
+            data = dict(seq_data, **{'init-files': [filename]})
+        model = cls(
             madx, data,
             undo_stack=undo_stack,
             filename=filename,
-            interpolate=interpolate)
+            interpolate=interpolate,
+            elements=snapshot.elements if restored else None)
+        if snapshot and not restored:
+            snapshot.save(
+                madx, seq_data or {}, model.element_table().export())
+        return model
 
     def __del__(self):
         self.destroy()
 
     def destroy(self):
         """Annihilate current model. Stop interpreter."""
+        self._close_mirror()
+        self.set_twiss_worker(False)
+        self.set_pool(0)
         if self.madx is not None:
             with suppress(AttributeError, RuntimeError):
                 self.madx._libmadx.finish()
@@ -118,6 +211,40 @@ class Model:
                 self.madx._process.wait()
         self.madx = None
 
+    def set_twiss_worker(self, enable=True, **madx_kwargs):
+        """Start or stop computing the twiss table in the background after
+        changes, see :class:`~madgui.model.worker.TwissWorker`."""
+        worker = self.twiss_worker
+        if worker is not None:
+            self.twiss_worker = None
+            worker.close()
+        if enable:
+            from .worker import TwissWorker
+            self.twiss_worker = TwissWorker(
+                self, self._reversed, **madx_kwargs)
+
+    def set_pool(self, size=None, **madx_kwargs):
+        """Start ``size`` worker processes for distributing independent
+        computations, or stop them if ``size`` is ``0``, see :attr:`pool`."""
+        pool = self.pool
+        if pool is not None:
+            self.pool = None
+            pool.close()
+        if size != 0:
+            from .pool import ModelPool
+            self.pool = ModelPool(self, size, **madx_kwargs)
+
+    def _use_pool(self):
+        """Check whether computations can be distributed to the :attr:`pool`
+        in the current state."""
+        return self.pool is not None and self._replicable and not self._errors
+
+    def _close_mirror(self):
+        """Stop the MAD-X process of the reversed sequence, if any."""
+        if self._mirror is not None:
+            self._mirror.close()
+            self._mirror = None
+
     @property
     def twiss_args(self) -> dict:
         """Return the dictionary of parameters for the MAD-X TWISS command."""
@@ -195,10 +322,16 @@ class Model:
         """Get list of knobs."""
         return [
             knob
-            for elem in self.elements
-            for knob in self.get_elem_knobs(elem)
+            for i in self.element_table().select(self.ELEM_KNOBS)
+            for knob in self.get_elem_knobs(self.elements[int(i)])
         ]
 
+    @memoize
+    def element_table(self):
+        """Return an :class:`ElementTable` with the attributes of all
+        elements. The table is kept up to date on knob changes."""
+        return ElementTable(self.elements)
+
     @property
     def libmadx(self):
         """Access to the low level cpymad API."""
@@ -216,7 +349,84 @@ class Model:
             else:
                 text = "CALL {!r}".format(name)
                 self._update(old, new, self._update_globals, text)
-        self.invalidate()
+        # to be replayed by worker processes:
+        self._calls.append(name)
+        # The file may have redefined or edited the sequence or its elements,
+        # so we have to USE the sequence again and rebuild the element list:
+        self._init_segment(
+            self.seq_name, self.range, self._beam, self._twiss_args)
+        self._reset()
+
+    _generation = 0
+    _errors = ()
+
+    _replicable = True
+    """Whether the MAD-X state can be replicated to worker processes, i.e.
+    it was only modified by :meth:`call` and the ``update_*`` methods, see
+    :meth:`invalidate`."""
+
+    _reversed = False
+
+    twiss_worker = None
+    """Optional :class:`~madgui.model.worker.TwissWorker` for computing the
+    twiss table in the background, see :meth:`set_twiss_worker`."""
+
+    INTERPOLATE_TYPES = ('sbend', 'rbend', 'quadrupole', 'solenoid')
+    """Element types that get interpolation points, see
+    :meth:`set_interpolate_range`."""
+
+    pool = None
+    """Optional :class:`~madgui.model.pool.ModelPool` for distributing
+    independent computations to several MAD-X processes. Not created by
+    default, see :meth:`set_pool`."""
+
+    def cache_key(self):
+        """
+        Return a hashable representation of the model state, which is used
+        to look up the results of previous computations, see
+        :func:`~madgui.util.misc.memoize_lru`.
+
+        The state consists of all values that were set via the ``update_*``
+        methods, the beam, the twiss initial conditions and the interpolation
+        setting. Other modifications of the MAD-X state are covered by a
+        counter that is increased by :meth:`invalidate`.
+        """
+        return (self._generation, self.interpolate, self._errors,
+                freeze(self._knob_state), freeze(self._beam),
+                freeze(self._twiss_args))
+
+    @contextmanager
+    def temporary_state(self, key):
+        """Context manager for temporary modifications of the MAD-X state
+        (such as applied errors) that are described by the given hashable
+        ``key``."""
+        self._errors += (key,)
+        try:
+            yield
+        finally:
+            self._errors = self._errors[:-1]
+
+    def cache_info(self):
+        """Return a dict with the ``(hits, misses, size)`` of the result caches
+        for the expensive computations."""
+        return {
+            name: (cache.hits, cache.misses, len(cache))
+            for name, cache in self._result_caches().items()
+        }
+
+    def _result_caches(self):
+        funcs = {
+            'twiss': '_twiss_pass',
+            'survey': '_survey_pass',
+            'orbit_response_matrix': 'get_orbit_response_matrix',
+            'jacobian': '_get_jacobian',
+        }
+        return {
+            name: cache
+            for name, func in funcs.items()
+            for cache in [self.__dict__.get('_' + func + '_cache')]
+            if cache is not None
+        }
 
     def load_strengths(self, filename):
         try:
@@ -242,15 +452,22 @@ class Model:
             'twiss': self.twiss_args,
         })
 
-    def _init_segment(self, sequence, range, beam, twiss_args):
+    def _init_segment(self, sequence, range, beam, twiss_args, elements=None):
         """
         :param str sequence:
         :param tuple range:
+        :param dict elements: element table data, as returned by
+            :meth:`ElementTable.export`, to avoid fetching the element names
+            and positions from MAD-X
         """
 
         self.sequence = self.madx.sequence[sequence]
         self.seq_name = self.sequence.name
         self.continuous_matching = True
+        self._generation += 1
+        invalidate(self, 'knob_dependencies')
+        invalidate(self, '_other_dependencies')
+        invalidate(self, 'element_table')
 
         self._beam = beam = dict(beam, sequence=self.seq_name)
         self._twiss_args = twiss_args
@@ -259,8 +476,11 @@ class Model:
 
         # Use `expanded_elements` rather than `elements` to have a one-to-one
         # correspondence with the data points of TWISS/SURVEY:
-        self.elements = elems = ElementList(self.madx, self.seq_name)
-        self.positions = self.sequence.expanded_element_positions()
+        self.elements = elems = ElementList(
+            self.madx, self.seq_name, *(
+                (elements['node_name'], elements['position'])
+                if elements else ()))
+        self.positions = elems.positions
 
         self.start, self.stop = self.parse_range(range)
         self.range = (normalize_range_name(self.start.name, elems),
@@ -352,15 +572,24 @@ class Model:
             text or "Change element {}: {{}}".format(elem.name))
 
     def _update_globals(self, globals):
+        exprs = False
         with self.madx.batch():
             for k, v in globals.items():
                 if v is None:
                     v = 0
                 elif v == '':
                     v = self.madx.globals[k]
+                exprs = exprs or isinstance(v, str)
                 self.madx.globals[k] = v
-        # TODO: invalidate only elements that depend updated variables?
-        self.invalidate()
+                self._knob_state[k.lower()] = v
+        if exprs:
+            # deferred expressions may change the dependency structure:
+            invalidate(self, 'knob_dependencies')
+            invalidate(self, '_other_dependencies')
+            invalidate(self, 'element_table')
+            self._invalidate()
+        else:
+            self._invalidate_globals(globals)
 
     def _update_beam(self, beam):
         new_beam = self.beam.copy()
@@ -374,13 +603,14 @@ class Model:
         new_beam['sequence'] = self.seq_name
         self._beam = new_beam
         self.madx.command.beam(**new_beam)
-        self.invalidate()
+        self._invalidate()
 
     def _update_twiss_args(self, twiss):
         new_twiss = self.twiss_args.copy()
         new_twiss.update((k.lower(), v) for k, v in twiss.items())
-        self._twiss_args = new_twiss
-        self.invalidate()
+        self._twiss_args = {
+            k: v for k, v in new_twiss.items() if v is not None}
+        self._invalidate()
 
     def _update_element(self, data, elem_index):
         # TODO: this crashes for many parameters
@@ -389,15 +619,126 @@ class Model:
         name = elem.node_name
         d = {k.lower(): v for k, v in data.items()
              if k in elem.cmdpar}
+        uses = set()
+        other = False
         if 'kick' in d and elem.base_name == 'sbend':
             # FIXME: This assumes the definition `k0:=(angle+k0)/l` and
             # will deliver incorrect results if this is not the case!
             var, = (set(self._get_knobs(elem, 'k0')) -
                     set(self._get_knobs(elem, 'angle')))
-            self.madx.globals[var] = d.pop('kick')
+            self.madx.globals[var] = self._knob_state[var.lower()] = \
+                d.pop('kick')
+            uses.update(self.knob_dependencies().get(var.lower(), ()))
+            other = var.lower() in self._other_dependencies()
         self.madx.elements[name](**d)
+        self._knob_state.update(((elem.name, k), v) for k, v in d.items())
+
+        if any(isinstance(v, str) for v in d.values()):
+            invalidate(self, 'knob_dependencies')
+            invalidate(self, '_other_dependencies')
+        # all occurences of the element share the same definition:
+        uses.update(
+            (i, attr)
+            for i, node_name in enumerate(self.elements.names)
+            if node_name.split('[')[0] == elem.name
+            for attr in d)
+        strengths = self.ELEM_KNOBS.get(elem.base_name.lower(), ())
+        if not other and all(attr in strengths for i, attr in uses):
+            self._invalidate_elements(uses)
+        else:
+            self._update_element_table({i for i, attr in uses})
+            self._invalidate()
 
-        self.invalidate()
+    # Attributes from ELEM_KNOBS that affect the survey:
+    _GEOMETRY_ATTRS = ('angle', 'knl')
+
+    @memoize
+    def knob_dependencies(self):
+        """
+        Return a dict that maps lowercase variable names to the list of
+        ``(element index, attribute)`` whose value depends on the variable,
+        either directly or via deferred expressions. Only attributes listed
+        in :attr:`ELEM_KNOBS` are considered.
+        """
+        deps = defaultdict(list)
+        for elem in self.elements:
+            for attr in self.ELEM_KNOBS.get(elem.base_name.lower(), ()):
+                if _is_property_defined(elem, attr):
+                    for var in self._get_vars(elem, attr):
+                        deps[var.lower()].append((elem.index, attr))
+        return dict(deps)
+
+    @memoize
+    def _other_dependencies(self):
+        """
+        Return the set of lowercase names of variables that element
+        attributes other than those listed in :attr:`ELEM_KNOBS` depend on,
+        such as lengths, tilts or pole face angles. Changes of these
+        variables can not be handled by :meth:`_invalidate_elements`.
+        """
+        names = set()
+        first = {}
+        for i, node_name in enumerate(self.elements.names):
+            first.setdefault(node_name.split('[')[0], i)
+        # all occurences of an element share the same definition:
+        for i in first.values():
+            elem = self.elements[i]
+            strengths = self.ELEM_KNOBS.get(elem.base_name.lower(), ())
+            for attr, par in elem.cmdpar.items():
+                if attr not in strengths and par.expr:
+                    names.update(
+                        var.lower() for var in self._get_vars(elem, attr))
+        return names
+
+    def _invalidate_globals(self, names):
+        """Invalidate only the computations that depend on the given global
+        variables. Performs a full invalidation for variables that are not
+        known to be used by any element, or that are used by attributes other
+        than the strengths in :attr:`ELEM_KNOBS`."""
+        deps = self.knob_dependencies()
+        other = self._other_dependencies()
+        uses = set()
+        for name in names:
+            name = name.lower()
+            if name not in deps or name in other:
+                invalidate(self, 'element_table')
+                self._invalidate()
+                return
+            uses.update(deps[name])
+        self._invalidate_elements(uses)
+
+    def _invalidate_elements(self, uses):
+        """
+        Invalidate computations after changing the given ``(element index,
+        attribute)`` pairs, where all attributes must be listed in
+        :attr:`ELEM_KNOBS`.
+
+        The twiss table and sectormaps are always recomputed. The survey is
+        kept unless the geometry changed, and the element table and linear
+        optics are updated in place. Results for previous states remain
+        cached, see :meth:`cache_key`.
+        """
+        indices = sorted({i for i, attr in uses})
+        invalidate(self, 'twiss')
+        invalidate(self, 'sector')
+        if any(attr in self._GEOMETRY_ATTRS for i, attr in uses):
+            invalidate(self, 'survey')
+        self._update_element_table(indices)
+        optics = self._linear_optics
+        if optics is not None:
+            start, stop = self.start.index, self.stop.index
+            for i in indices:
+                if start <= i <= stop:
+                    optics.update_element(i - start, self.elements[i])
+        self._emit_updated()
+
+    def _update_element_table(self, indices):
+        """Refetch the attributes of the given elements in the element table
+        (if it was already created)."""
+        table = self.__dict__.get('_element_table')
+        if table is not None:
+            for i in indices:
+                table.update(i)
 
     def get_twiss(self, elem, name, pos):
         """Return beam envelope at element."""
@@ -406,17 +747,17 @@ class Model:
         twiss = self.twiss()
         s = twiss.s
         y = twiss[name]
-        x = self.indices[ix]
+        stop = self.indices[ix]
 
         # shortcut for thin elements:
-        if float(self.elements[ix].length) == 0:
-            return y[ix]
+        if self.element_table().length[ix] == 0:
+            return y[stop]
 
-        lo = x.start-1 if x.start > 0 else x.start
-        hi = x.stop+1
+        lo = self.indices[ix-1] if ix > 0 else 0
+        hi = stop+1
 
-        i0 = bisect_right(s, pos, lo, hi)
-        i1 = i0+1
+        i0 = max(bisect_right(s, pos, lo, hi) - 1, lo)
+        i1 = min(i0+1, stop)
 
         # never look outside the interpolation domain:
         if pos <= s[i0]:
@@ -436,12 +777,12 @@ class Model:
     def get_elem_twiss(self, elem):
         tw = self.twiss()
         ix = self.elements.index(elem)
-        i0 = self.indices[ix].stop
+        i0 = self.indices[ix]
         return AttrDict({col: tw[col][i0] for col in self.twiss_columns})
 
     def get_elem_sigma(self, elem):
         ix = self.elements.index(elem)
-        i0 = self.indices[ix].stop
+        i0 = int(self.indices[ix])
         tw = self.twiss().row(i0, 'all')
         return [
             [tw['sig{}{}'.format(i+1, j+1)]
@@ -497,56 +838,322 @@ class Model:
         - ``interval=(1, 0)``  retrieves ``(e0, e1)`` and ``(e1, e2)``
         - ``interval=(1, 1)``  retrieves ``(e0, e1]`` and ``(e1, e2]``
         """
-        table = self.sector()
-        maps = self.madx.sectortable(table._name)
-        indices = [self.elements.index(el) for el in elems]
+        cache = self.get_transfer_map_cache()
+        start = self.start.index
+        indices = [self.elements.index(el) - start for el in elems]
         x0, x1 = interval
         return [
-            reduce(lambda a, b: np.dot(b, a),
-                   maps[max(0, i+x0):max(0, j+x1)], np.eye(7))
+            cache.product(i+x0, j+x1)
             for i, j in zip(indices, indices[1:])
         ]
 
+    _transfer_map_cache = None
+
+    def get_transfer_map_cache(self):
+        """Return a :class:`~madgui.model.transfer.TransferMapCache` for the
+        current sectormaps. The cache is rebuilt whenever :meth:`sector` is
+        recomputed.
+
+        The maps are indexed by the rows of the (non-interpolated) twiss
+        table, i.e. the map of element ``i`` is at ``i - start.index``."""
+        cache = self._transfer_map_cache
+        maps = self.sector()
+        if cache is None or cache.table is not maps:
+            cache = self._transfer_map_cache = TransferMapCache(maps, maps)
+        return cache
+
+    _linear_optics = None
+
+    def linear_optics(self):
+        """
+        Return the :class:`~madgui.model.linear.LinearOptics` engine for the
+        current model state. It is the basis of :meth:`match_linear`.
+
+        The engine is created from the MAD-X TWISS and sectormaps and keeps
+        track of subsequent knob changes by re-deriving the affected element
+        maps in NumPy. It is recreated from MAD-X after changes that it can
+        not represent. The engine only provides orbit and sigma matrix at
+        the element exits, i.e. it does not replace :meth:`twiss`.
+        """
+        optics = self._linear_optics
+        if optics is None or not optics.synced:
+            twiss = self.twiss()
+            rows = self.indices
+            init = twiss.row(int(rows[0]), 'all')
+            optics = self._linear_optics = LinearOptics(
+                self.get_transfer_map_cache().maps,
+                [init[k] for k in ('x', 'px', 'y', 'py', 't', 'pt')],
+                [[init['sig{}{}'.format(i+1, j+1)] for j in range(6)]
+                 for i in range(6)],
+                columns={'s': twiss.s[rows], 'name': twiss.name[rows]})
+        return optics
+
     # TODO: default values for knobs/monitors
     # TODO: pass entire optic (knob + delta)
+    @memoize_lru(maxsize=16)
     def get_orbit_response_matrix(
-            self, monitors, knobs, errors=(), values=()) -> np.array:
+            self, monitors, knobs, errors=(), values=(),
+            method='numeric') -> np.array:
         """
-        Compute the orbit response matrix Δx/Δφ numerically (by varying knobs)
-        and return as `M×2×K` matrix (monitors × x|y × knobs).
+        Compute the orbit response matrix Δx/Δφ and return as `M×2×K` matrix
+        (monitors × x|y × knobs).
+
+        The ``method`` parameter selects how the matrix is computed:
+
+        - ``'numeric'``: vary each knob and perform one TWISS per knob
+        - ``'analytic'``: propagate the kicks of all knobs through the
+          transfer maps of a single SECTORMAP pass. Knobs that do not act as
+          dipole kicks are still computed numerically.
+        - ``'verify'``: compute both and log a warning if they disagree.
+          Returns the numeric result.
         """
-        from .errors import apply_errors, Param
+        if method == 'numeric':
+            return self._get_orm_numeric(monitors, knobs, errors, values)
+        if method == 'analytic':
+            return self._get_orm_analytic(monitors, knobs, errors, values)
+        if method == 'verify':
+            numeric = self._get_orm_numeric(monitors, knobs, errors, values)
+            analytic = self._get_orm_analytic(monitors, knobs, errors, values)
+            deviation = np.abs(numeric - analytic).max(initial=0)
+            if deviation > 1e-3 * np.abs(numeric).max(initial=0):
+                logging.warning(
+                    "Analytic ORM deviates from numeric ORM by up to {:.3g}"
+                    .format(deviation))
+            return numeric
+        raise ValueError("Unknown ORM method: {!r}".format(method))
+
+    def _get_orm_analytic(self, monitors, knobs, errors=(), values=()):
+        """Compute the orbit response matrix from the sectormaps of a single
+        SECTORMAP pass. See :meth:`get_orbit_response_matrix`."""
+        from .errors import apply_errors
         madx = self.madx
         madx.command.select(flag='interpolate', clear=True)
-
-        # applying errors here is a temporary measure until we figure out a
-        # better way to take into account combined error effects (e.g.
-        # relative error on top of absolute error):
         with apply_errors(self, errors, values):
-            tw0 = madx.twiss(**self._get_twiss_args(table='orm_tmp'))
-        x0, y0 = tw0.x, tw0.y
-        idx = [self.elements.index(m) for m in monitors]
+            madx.sectormap((), **self._get_twiss_args(
+                table='orm_tmp', sectortable='orm_sector'))
+            maps = madx.sectortable('orm_sector')
+            kicks, numeric = self._get_knob_kicks(knobs)
+
+        # the sectormaps are indexed by rows of the twiss range:
+        start = self.start.index
+        idx = [self.elements.index(m) - start for m in monitors]
+        kicks_at = defaultdict(list)
+        for k, elem_kicks in enumerate(kicks):
+            for i, axis, dkick in elem_kicks:
+                kicks_at[i - start].append((k, axis, dkick))
+
+        # Propagate the orbit response to all knobs simultaneously, i.e.
+        # perform only one pass over the sectormaps:
+        orbit = np.zeros((6, len(knobs)))
+        responses = {}
+        for i in range(max(idx, default=-1) + 1):
+            tm = maps[i][:6, :6]
+            orbit = np.dot(tm, orbit)
+            for k, axis, dkick in kicks_at.get(i, ()):
+                # Integrate the distributed kick of a thick element by
+                # approximating R(s→exit) by the mean of R(0→exit) and 1:
+                kick = np.zeros(6)
+                kick[1+2*axis] = dkick
+                orbit[:, k] += (kick + np.dot(tm, kick)) / 2
+            responses[i] = orbit[[0, 2]]
+        orm = np.array([responses[i] for i in idx]).reshape(
+            (len(idx), 2, len(knobs)))
+
+        if numeric:
+            cols = sorted(numeric)
+            orm[:, :, cols] = self._get_orm_numeric(
+                monitors, [knobs[k] for k in cols], errors, values)
+        return orm
+
+    def get_jacobian(self, columns, elements, params,
+                     method='analytic', step=2e-4) -> np.array:
+        """
+        Compute the derivatives of the given twiss ``columns`` at the exit
+        of ``elements`` with respect to ``params`` around the current state,
+        and return as `M×C×P` matrix (elements × columns × params).
+
+        The ``params`` can be knob names, error names as understood by
+        :func:`~madgui.model.errors.parse_error`, or error instances.
+
+        The ``method`` parameter selects how the derivatives are computed:
+
+        - ``'numeric'``: vary each parameter by ``step`` and perform one TWISS
+          per parameter
+        - ``'analytic'``: derive the orbit response to knobs that act as
+          dipole kicks and to the initial orbit from the transfer maps. Other
+          derivatives are still computed numerically.
 
-        def get_knob_response(var, step):
-            """Return `2×M` matrix with responses for specified variable."""
-            with apply_errors(self, [Param(var)], [step]):
-                with apply_errors(self, errors, values):
-                    tw1 = madx.twiss(**self._get_twiss_args(table='orm_tmp'))
-            x1, y1 = tw1.x, tw1.y
-            return np.vstack((
+        Results are cached for recently used model states.
+        """
+        params = tuple(p if isinstance(p, str) else repr(p) for p in params)
+        indices = tuple(self.elements.index(e) for e in elements)
+        return self._get_jacobian(
+            tuple(columns), indices, params, method, step)
+
+    @memoize_lru(maxsize=16)
+    def _get_jacobian(self, columns, indices, params, method, step):
+        from .errors import parse_error
+        errors = [parse_error(p) for p in params]
+        if method == 'numeric':
+            return self._get_jacobian_numeric(columns, indices, errors, step)
+        if method == 'analytic':
+            return self._get_jacobian_analytic(columns, indices, errors, step)
+        raise ValueError("Unknown jacobian method: {!r}".format(method))
+
+    _ORBIT_COLUMNS = ('x', 'px', 'y', 'py', 't', 'pt')
+
+    def _get_jacobian_analytic(self, columns, indices, errors, step):
+        """Compute the jacobian from the transfer maps where possible. See
+        :meth:`get_jacobian`."""
+        from .errors import Param, InitTwiss
+        jac = np.zeros((len(indices), len(columns), len(errors)))
+        if not all(col in self._ORBIT_COLUMNS for col in columns):
+            numeric = range(len(errors))
+        else:
+            cache = self.get_transfer_map_cache()
+            rows = [self._ORBIT_COLUMNS.index(col) for col in columns]
+            start = self.start.index
+            knobs = [k for k, e in enumerate(errors) if type(e) is Param]
+            kicks, numeric = self._get_knob_kicks(
+                [errors[k].name for k in knobs], step)
+            numeric = {knobs[k] for k in numeric} | {
+                k for k, e in enumerate(errors)
+                if type(e) not in (Param, InitTwiss)}
+            for k, elem_kicks in zip(knobs, kicks):
+                for j, axis, dkick in elem_kicks:
+                    j -= start
+                    if j < 0:
+                        continue
+                    # Integrate the distributed kick of a thick element as
+                    # in :meth:`_get_orm_analytic`:
+                    kick = np.zeros(7)
+                    kick[1+2*axis] = dkick
+                    kick = (kick + np.dot(cache.maps[j], kick)) / 2
+                    for m, i in enumerate(indices):
+                        if i - start >= j:
+                            jac[m, :, k] += np.dot(
+                                cache.product(j+1, i-start+1), kick)[rows]
+            for k, error in enumerate(errors):
+                if type(error) is InitTwiss:
+                    coord = self._ORBIT_COLUMNS.index(error.name)
+                    for m, i in enumerate(indices):
+                        jac[m, :, k] = cache.product(
+                            0, i-start+1)[rows, coord]
+        if numeric:
+            cols = sorted(numeric)
+            jac[:, :, cols] = self._get_jacobian_numeric(
+                columns, indices, [errors[k] for k in cols], step)
+        return jac
+
+    def _get_jacobian_numeric(self, columns, indices, errors, step):
+        """Compute the jacobian by varying the parameters. See
+        :meth:`get_jacobian`. The TWISS runs are distributed to the workers
+        of :attr:`pool` if available."""
+        response = partial(_get_twiss_response, columns=columns, step=step)
+        errors = [None] + list(errors)
+        if self._use_pool():
+            results = self.pool.map(response, errors)
+        else:
+            results = [response(self, error) for error in errors]
+        rows = np.array(indices, dtype=int) - self.start.index
+        y0 = results[0][:, rows].T
+        return np.stack([
+            (y1[:, rows].T - y0) / step
+            for y1 in results[1:]
+        ] or np.zeros((len(errors), len(rows), len(columns))), axis=-1)
+
+    # Element attributes whose derivative corresponds to a dipole kick, and
+    # the corresponding (axis, kick per unit attribute value per length):
+    _KICK_ATTRS = {
+        ('hkicker', 'kick'):    (0, 1, False),
+        ('vkicker', 'kick'):    (1, 1, False),
+        ('kicker', 'hkick'):    (0, 1, False),
+        ('kicker', 'vkick'):    (1, 1, False),
+        ('sbend', 'k0'):        (0, -1, True),
+    }
+
+    def _get_knob_kicks(self, knobs, step=2e-4):
+        """
+        Find the dipole kicks caused by the given knobs.
+
+        Returns a tuple ``(kicks, numeric)``, where ``kicks`` is a list with
+        one entry ``[(elem_index, axis, dkick/dknob)]`` per knob, and
+        ``numeric`` is the set of indices of knobs that also affect other
+        attributes and can therefore not be treated as pure kicks.
+        """
+        from .errors import apply_errors, Param
+        madx = self.madx
+        deps = self.knob_dependencies()
+        other = self._other_dependencies()
+        uses = defaultdict(list)
+        numeric = {k for k, knob in enumerate(knobs) if knob.lower() in other}
+        for k, knob in enumerate(knobs):
+            for i, attr in deps.get(knob.lower(), ()):
+                elem = self.elements[i]
+                kick_attr = self._KICK_ATTRS.get(
+                    (elem.base_name.lower(), attr))
+                if kick_attr is None:
+                    numeric.add(k)
+                else:
+                    uses[k].append(
+                        (i, elem.length, elem.cmdpar[attr].expr, kick_attr))
+
+        kicks = [[] for _ in knobs]
+        for k, knob_uses in uses.items():
+            if k in numeric:
+                continue
+            exprs = [expr for _, _, expr, _ in knob_uses]
+            old = [madx.eval(expr) for expr in exprs]
+            with apply_errors(self, [Param(knobs[k])], [step]):
+                new = [madx.eval(expr) for expr in exprs]
+            kicks[k] = [
+                (i, axis, sign * (b - a) / step * (length if thick else 1))
+                for (i, length, _, (axis, sign, thick)), a, b
+                in zip(knob_uses, old, new)
+            ]
+        return kicks, numeric
+
+    def _get_orm_numeric(self, monitors, knobs, errors=(), values=()):
+        """Compute the orbit response matrix by varying the knobs. See
+        :meth:`get_orbit_response_matrix`. The TWISS runs are distributed to
+        the workers of :attr:`pool` if available."""
+        step = 2e-4
+        idx = [self.elements.index(m) for m in monitors]
+        knobs = [None] + list(knobs)
+        orbit = partial(
+            _get_orm_orbit, errors=errors, values=values, step=step)
+        if self._use_pool():
+            orbits = self.pool.map(orbit, knobs)
+        else:
+            orbits = [orbit(self, knob) for knob in knobs]
+        (x0, y0), responses = orbits[0], orbits[1:]
+        return np.dstack([
+            np.vstack((
                 (x1 - x0)[idx],
                 (y1 - y0)[idx],
             )).T / step
-
-        return np.dstack([
-            get_knob_response(knob, 2e-4)
-            for knob in knobs
+            for x1, y1 in responses
         ])
 
     @memoize
     def survey(self):
         """Recalculate survey coordinates."""
-        return self.madx.survey()
+        return self._survey_pass()
+
+    @memoize_lru(maxsize=8, evict='_delete_tables')
+    def _survey_pass(self):
+        """Run SURVEY into a new table."""
+        return self.madx.survey(
+            table='survey_{}'.format(next(self._table_ids)))
+
+    def _delete_tables(self, tables):
+        """Delete MAD-X tables of results that were discarded from the
+        cache."""
+        tables = tables if isinstance(tables, tuple) else (tables,)
+        for table in tables:
+            if isinstance(table, InterpolatedTwissTable):
+                table = table.source
+            self.madx.command.delete(table=table._name)
 
     def ex(self):
         return self.summary.ex
@@ -554,47 +1161,131 @@ class Model:
     def ey(self):
         return self.summary.ey
 
-    @memoize
     def twiss(self, **kwargs):
-        """Recalculate TWISS parameters."""
-        self.madx.command.select(flag='interpolate', clear=True)
+        """
+        Recalculate TWISS parameters.
+
+        The sectormaps are computed during the same MAD-X pass, see
+        :meth:`sector`. Interpolation points are added afterwards by
+        :class:`InterpolatedTwissTable`, since MAD-X can not produce the
+        non-interpolated sectormaps and the interpolated twiss table at once,
+        see :meth:`set_interpolate_range`.
+
+        If arguments are passed, they override the twiss arguments of the
+        model for this call only, and the (non-interpolated) results are
+        returned without changing the current twiss table, sectormaps or
+        summary of the model.
+        """
+        if kwargs:
+            results, _ = self._twiss_pass(**kwargs)
+            return results
+        if '_twiss' not in self.__dict__:
+            results, _ = self._twiss_pass()
+            self._sector = results.maps
+            self._twiss = self._use_twiss(results)
+        return self._twiss
+
+    def _use_twiss(self, results):
+        """Add the interpolation points to a non-interpolated twiss table and
+        make it the current result."""
         if self.interpolate:
-            step = self.sequence.elements[-1].position/self.interpolate
-            self.madx.command.select(flag='interpolate', step=step)
-        results = self.madx.twiss(**self._get_twiss_args(**kwargs))
-        results = TwissTable(results._name, results._libmadx, _check=False)
+            results = InterpolatedTwissTable(
+                results, results.maps,
+                counts=self._interpolation_counts(results))
         self.summary = results.summary
-
-        # FIXME: this will fail if subsequent element have the same name.
-        # Safer alternatives:
-        # - do another twiss call without interpolate
-        # - change the behaviour of MAD-X' interpolate option itself to make
-        #   it clear in the table which rows are 'interpolated'
-        # - change MAD-X interpolate option to produce 2 tables
-        # - extract information via cpymad (table now has 'node' attribute)
-        groups = itertools.groupby(enumerate(results.name), lambda x: x[1])
-        self.indices = [
-            slice(l[0][0], l[-1][0])
-            for k, v in groups
-            for l in [list(v)]
-        ]
+        self.indices = results.indices
         assert len(self.indices) == len(self.elements)
+        results.prefetch(self.prefetch_columns)
         return results
 
+    def _set_twiss(self, key, results):
+        """Use a twiss table and sectormaps that were computed in the
+        background by the :attr:`twiss_worker` and emit ``updated``. Returns
+        ``False`` and discards the results if they do not correspond to the
+        current state.
+        """
+        if key != self.cache_key():
+            return False
+        if results is not None and '_twiss' not in self.__dict__:
+            self._sector = results.maps
+            self._twiss = self._use_twiss(results)
+        self.updated.emit()
+        return True
+
+    def set_interpolate(self, points):
+        """Set the number of interpolation points and recompute the twiss
+        table."""
+        self.interpolate = points
+        self._invalidate()
+
+    def set_interpolate_range(self, owner, xlim):
+        """
+        Set the range ``(s0, s1)`` that is currently visible in a view, or
+        remove the range of the view if ``xlim`` is None.
+
+        The ``interpolate`` points are distributed over the union of all
+        visible ranges, or over the whole sequence if there is none. Only
+        elements of the types in :attr:`INTERPOLATE_TYPES` that overlap with
+        one of the ranges are interpolated. The twiss table is updated
+        without another MAD-X pass if this changes the interpolation points.
+        """
+        if xlim is None:
+            self.interpolate_ranges.pop(owner, None)
+        else:
+            self.interpolate_ranges[owner] = tuple(xlim)
+        table = self.__dict__.get('_twiss')
+        if isinstance(table, InterpolatedTwissTable) and not np.array_equal(
+                table.counts, self._interpolation_counts(table.source)):
+            self._twiss = self._use_twiss(table.source)
+            self.updated.emit()
+
+    def _interpolation_counts(self, table):
+        """Return the number of interpolation points for each row of the
+        non-interpolated twiss table."""
+        lengths = np.array(table.l)
+        exits = np.array(table.s)
+        entries = exits - lengths
+        base_names = np.array(self.element_table().base_name[
+            self.start.index:self.stop.index+1])
+        thick = (lengths > 0) & np.isin(base_names, self.INTERPOLATE_TYPES)
+        ranges = list(self.interpolate_ranges.values()) or [
+            (0, self.sequence.elements[-1].position)]
+        counts = np.zeros(len(lengths), dtype=int)
+        for s0, s1 in ranges:
+            s0, s1 = min(s0, s1), max(s0, s1)
+            if s1 <= s0:
+                continue
+            step = (s1 - s0) / self.interpolate
+            rows = thick & (exits > s0) & (entries < s1)
+            counts[rows] = np.maximum(
+                counts[rows],
+                np.maximum(lengths[rows] / step + 1e-9, 1) - 1)
+        return counts
+
+    @memoize_lru(maxsize=8, evict='_delete_tables')
+    def _twiss_pass(self, **kwargs):
+        """Run TWISS with SECTORMAP into new tables. Returns the twiss and
+        sectormap tables."""
+        index = next(self._table_ids)
+        kwargs.setdefault('table', 'twiss_{}'.format(index))
+        sectortable = 'sectortable_{}'.format(index)
+        self.madx.command.select(flag='interpolate', clear=True)
+        maps = self.madx.sectormap((), **self._get_twiss_args(
+            sectortable=sectortable, **kwargs))
+        results = self.madx.table[kwargs['table']]
+        results = TwissTable(results._name, results._libmadx, _check=False)
+        results.indices = np.arange(len(maps))
+        results.maps = maps
+        return results, self.madx.table[sectortable]
+
     @memoize
     def sector(self):
-        """Compute sectormaps of all elements."""
-        # TODO: Ideally, we should compute sectormaps and twiss during the
-        # same MAD-X TWISS command. But, since we don't need interpolated
-        # sectormaps, this will require patching MAD-X first…
-        self.madx.command.select(flag='interpolate', clear=True)
-        # NOTE: we have to pass a different twiss table because madgui
-        # currently fetches twiss columns only demand. Therefore, using the
-        # same twiss table for both TWISS/SECTORMAP routines would lead to
-        # inconsistent table lengths (interpolate vs no-interpolate!).
-        self.madx.sectormap((), **self._get_twiss_args(
-            table='sectortwiss', sectortable='sectortable'))
-        return self.madx.table['sectortable']
+        """Compute sectormaps of all elements. Returns an `N×7×7` array
+        indexed by the rows of the (non-interpolated) twiss table."""
+        # The sectormaps are always computed along with the twiss table:
+        invalidate(self, 'twiss')
+        self.twiss()
+        return self._sector
 
     def track_one(self, x=0, px=0, y=0, py=0, range='#s/#e', **kwargs):
         """
@@ -609,16 +1300,14 @@ class Model:
         start, end = normalize_range_name(start), normalize_range_name(end)
         kwargs.setdefault('betx', 1)
         kwargs.setdefault('bety', 1)
-        if elems.index(end) < elems.index(start):
-            # TODO: we should use a separate madx process with inplace
-            # reversed sequence for backtracking in the future, this will
-            # simplify all the complications with element names etc.
-            flip = {'#s': '#e', '#e': '#s'}
-            start = flip.get(start, start + '_reversed')
-            end = flip.get(end, end + '_reversed')
+        i0, i1 = elems.index(start), elems.index(end)
+        if i1 < i0:
+            names = list(self.get_mirror().elements.names)
+            names[0], names[-1] = '#s', '#e'
+            last = len(names) - 1
             tw = self.backtrack(
                 x=-x, y=y, px=px, py=-py,
-                range=start+'/'+end, **kwargs)
+                range=names[last-i0]+'/'+names[last-i1], **kwargs)
             return AttrDict({
                 's': tw.s[-1] - tw.s,
                 'x': -tw.x, 'px': tw.px,
@@ -628,25 +1317,74 @@ class Model:
             x=x, px=px, y=y, py=py,
             range=range, **kwargs)
 
-    backseq = None
+    def track_many(self, coords, range='#s/#e'):
+        """
+        Track multiple particles through the given range by propagating their
+        coordinates through the cached transfer maps, see
+        :meth:`get_transfer_map_cache`. This is a first order approximation
+        around the reference orbit, which is exact for linear lattices.
+
+        :param coords: `N×6` array of initial coordinates
+        :param range: ``(start, end)`` elements or ``'start/end'`` string
+        :returns: `N×E×6` array of coordinates at the exit of each element
+            from ``start`` to ``end``. If ``end`` comes before ``start``, the
+            particles are tracked backwards from the exit of ``start``, and
+            the coordinates are given at the entry of each element.
+        """
+        start, end = range.split('/') if isinstance(range, str) else range
+        i0 = self.elements.index(start) - self.start.index
+        i1 = self.elements.index(end) - self.start.index
+        cache = self.get_transfer_map_cache()
+        if i0 <= i1:
+            maps = cache.maps[i0:i1+1]
+        else:
+            maps = cache.inverse_maps(i1, i0+1)[::-1]
+        coords = np.atleast_2d(coords)
+        states = np.hstack((coords, np.ones((len(coords), 1))))
+        tracks = np.empty((len(coords), len(maps), 7))
+        for k, tm in enumerate(maps):
+            states = tracks[:, k] = np.dot(states, tm.T)
+        return tracks[:, :, :6]
+
+    _mirror = None
+
+    def get_mirror(self):
+        """
+        Return a model of the direction reversed sequence that runs in a
+        separate MAD-X process. The mirror is started on first use and then
+        kept in sync with this model, see :class:`~madgui.model.pool.ModelPool`.
+
+        Note that the reversed sequence uses the same element names, but
+        repeated elements are counted from the other end, i.e. the element at
+        index ``i`` corresponds to index ``len(elements)-1-i`` in the mirror.
+        """
+        if self._mirror is None:
+            from .pool import ModelPool
+            self._mirror = ModelPool(self, 1, reverse=not self._reversed)
+        self._mirror.sync()
+        return self._mirror.workers[0]
 
     def backtrack(self, **twiss_init):
-        """Backtrack final orbit through the reversed sequence."""
-        if self.backseq is None:
-            with self.madx.batch():
-                self.backseq = self.seq_name + '_backseq'
-                reverse_sequence(self.madx, self.backseq, self.elements)
-        self.madx.command.select(flag='interpolate', clear=True)
+        """Backtrack final orbit through the reversed sequence, see
+        :meth:`get_mirror`. Element names in the ``range`` refer to the
+        reversed sequence."""
+        mirror = self.get_mirror()
+        madx = mirror.madx
+        madx.command.select(flag='interpolate', clear=True)
         twiss_init.setdefault('betx', 1)
         twiss_init.setdefault('bety', 1)
         twiss_init.setdefault('table', 'backtrack')
-        tw = self.madx.twiss(sequence=self.backseq, **twiss_init)
-        tw = self.madx.table.backtrack
-        self.invalidate()
-        return tw
+        madx.twiss(sequence=mirror.seq_name, **twiss_init)
+        return madx.table[twiss_init['table']]
 
     def reverse(self):
+        self._close_mirror()
         reverse_sequence_inplace(self.madx, self.seq_name)
+        self._reversed = not self._reversed
+        if self.twiss_worker is not None:
+            self.set_twiss_worker(**self.twiss_worker.madx_kwargs)
+        if self.pool is not None:
+            self.set_pool(self.pool.size, **self.pool.madx_kwargs)
         if self.undo_stack:
             self.undo_stack.clear()
         self._init_segment(
@@ -655,8 +1393,24 @@ class Model:
             beam=self.beam,
             twiss_args={'betx': 1, 'bety': 1},
         )
+        self._reset()
+
+    def match(self, vary, constraints, mirror_mode=True, method='madx',
+              **kwargs):
+        """
+        Vary the given global variables to satisfy the constraints, given as
+        list of ``(elem, pos, axis, value)``. Returns the new values.
 
-    def match(self, vary, constraints, mirror_mode=True, **kwargs):
+        With ``method='madx'``, MAD-X ``MATCH`` is used. With
+        ``method='linear'``, the problem is solved in NumPy, see
+        :meth:`match_linear`, and MAD-X is used as fallback for problems that
+        are not supported there.
+        """
+        if method == 'linear' and not kwargs:
+            new_values = self.match_linear(vary, constraints, mirror_mode)
+            if new_values is not None:
+                return new_values
+            logging.debug("Linear matching not applicable, using MAD-X.")
 
         # list intermediate positions
         # NOTE: need list instead of set, because quantity is unhashable:
@@ -687,18 +1441,7 @@ class Model:
             dict(range=name, iindex=pos, **c)
             for (name, pos), c in cons.items()]
 
-        # FIXME TODO: use position-dependent emittances…
-        # NOTE: Not sure we can measure or if there is a relevant
-        # emittance dilution in the HEBT
-        ex = self.ex()
-        ey = self.ey()
-        weights = {
-            'sig11': 1/ex, 'sig12': 1/ex, 'sig21': 1/ex, 'sig22': 1/ex,
-            'sig33': 1/ey, 'sig34': 1/ey, 'sig43': 1/ey, 'sig44': 1/ey,
-        }
-        weights.update(kwargs.pop('weight', {}))
-        used_cols = {axis.lower() for elem, pos, axis, val in constraints}
-        weights = {k: v for k, v in weights.items() if k in used_cols}
+        weights = self._match_weights(constraints, kwargs.pop('weight', {}))
         twiss_args = self.twiss_args.copy()
         twiss_args.update(kwargs)
 
@@ -728,16 +1471,150 @@ class Model:
         # return corrections
         return new_values
 
+    def _match_weights(self, constraints, weights):
+        """Return the weights of the constrained columns for matching."""
+        # FIXME TODO: use position-dependent emittances…
+        # NOTE: Not sure we can measure or if there is a relevant
+        # emittance dilution in the HEBT
+        ex = self.ex()
+        ey = self.ey()
+        weights = dict({
+            'sig11': 1/ex, 'sig12': 1/ex, 'sig21': 1/ex, 'sig22': 1/ex,
+            'sig33': 1/ey, 'sig34': 1/ey, 'sig43': 1/ey, 'sig44': 1/ey,
+        }, **weights)
+        used_cols = {axis.lower() for elem, pos, axis, val in constraints}
+        return {k: v for k, v in weights.items() if k in used_cols}
+
+    def match_linear(self, vary, constraints, mirror_mode=True,
+                     tolerance=1e-8, rounds=3):
+        """
+        Match like :meth:`match`, but solve the problem with
+        :class:`~madgui.model.linear.LinearMatch` on the cached transfer
+        maps. The current values of the constraints are taken from a MAD-X
+        TWISS, only their changes are computed from the maps. After each
+        solution, the linear optics are recreated from a new TWISS to verify
+        the result, and the problem is solved again from there if necessary
+        (at most ``rounds`` times), since the linearized maps neglect the
+        dependency of the maps on the orbit. Constraints inside elements are
+        evaluated on the maps only.
+
+        Returns ``None`` if the problem is not supported, i.e. if variables
+        are not plain numbers, the constraints are not on orbit or sigma
+        matrix, or the variables affect other attributes than the strengths
+        of (untilted, uncoupled) quadrupoles and kickers.
+        """
+        vary = list(vary)
+        constraints = list(constraints)
+        deps = self.knob_dependencies()
+        if any(v.lower() not in deps or self.globals.cmdpar[v].expr
+               for v in vary):
+            return None
+        if any(axis.lower() not in LinearMatch.columns
+               for elem, pos, axis, val in constraints):
+            return None
+        weights = self._match_weights(constraints, {})
+        old_values = {v: self.read_param(v) for v in vary}
+        values = dict(old_values)
+        # intermediate values of the refinement rounds should not be shown:
+        with self._hold_updates():
+            for attempt in range(rounds + 1):
+                if attempt > 0:
+                    # Otherwise, the updated linear optics would only confirm
+                    # their own solution:
+                    self._linear_optics = None
+                problem = self._get_linear_match(vary, constraints, weights)
+                if problem is None:
+                    if attempt > 0:
+                        self._update_globals(old_values)
+                    return None
+                twiss = self.twiss()
+                problem.correct([
+                    twiss[axis][self.indices[row + self.start.index]]
+                    if frac is None else None
+                    for row, frac, axis, *_ in problem.constraints
+                ])
+                chisq = problem.chisq(np.zeros(len(vary)))
+                if chisq < tolerance or attempt == rounds:
+                    break
+                scale = np.array([values[v] for v in vary])
+                delta = problem.solve(scale, tolerance)
+                values = {v: values[v] + d for v, d in zip(vary, delta)}
+                self._update_globals(values)
+            if mirror_mode and chisq >= 1e-6:
+                logging.warning('Fit Residual too high!!!')
+                self._update_globals(old_values)
+            else:
+                self._update(old_values, values,
+                             self._update_globals, "Match: {}")
+        return values
+
+    def _get_linear_match(self, vary, constraints, weights):
+        """Setup the :class:`~madgui.model.linear.LinearMatch` problem for
+        the current state, or return ``None`` if it is not supported."""
+        if any(v.lower() in self._other_dependencies() for v in vary):
+            return None
+        optics = self.linear_optics()
+        deps = self.knob_dependencies()
+        table = self.element_table()
+        start, stop = self.start.index, self.stop.index
+        # elements outside the range do not affect the constraints:
+        uses = {
+            v: [(i, attr) for i, attr in deps[v.lower()] if start <= i <= stop]
+            for v in vary
+        }
+        if any(attr not in MAP_ATTRS.get(table.base_name[i], ())
+               for v in vary for i, attr in uses[v]):
+            return None
+        elements = {
+            i - start: table.row(i)
+            for v in vary
+            for i, attr in uses[v]
+        }
+        if any(element_map(optics.cache.maps[i], e) is None
+               for i, e in elements.items()):
+            return None
+        slopes = []
+        # The probes bypass `self.globals` and are reverted immediately, so
+        # that they do not trigger any updates:
+        globals = self.madx.globals
+        for v in vary:
+            # probe the dependency of the element attributes:
+            value = globals[v]
+            step = 1e-3 * max(abs(value), 1e-3)
+            globals[v] = value + step
+            probe = [self.elements[i][attr] for i, attr in uses[v]]
+            globals[v] = value
+            slopes.append([
+                (i - start, attr, (new - table.row(i)[attr]) / step)
+                for (i, attr), new in zip(uses[v], probe)
+            ])
+        rows = []
+        for elem, pos, axis, val in constraints:
+            at, length = elem.position, elem.length
+            if pos is None or length == 0 or np.isclose(pos, at + length):
+                frac = None
+            else:
+                frac = float((pos - at) / length)
+            axis = axis.lower()
+            rows.append((elem.index - start, frac, axis, val,
+                         weights.get(axis, 1)))
+        try:
+            return LinearMatch(optics, elements, slopes, rows)
+        except ValueError:
+            return None
+
     def read_monitor(self, name):
         """Mitigates read access to a monitor."""
         # TODO: handle split h-/v-monitor
         index = self.elements.index(name)
         twiss = self.twiss()
+        # the twiss table may contain interpolation points:
+        row = self.indices[index]
         return {
-            'envx': twiss.envx[index],
-            'envy': twiss.envy[index],
-            'posx': twiss.x[index],
-            'posy': twiss.y[index],
+            'envx': twiss.envx[row],
+            'envy': twiss.envy[row],
+            'posx': twiss.x[row],
+            'posy': twiss.y[row],
         }
 
     def _get_knobs(self, elem, attr):
@@ -747,6 +1624,14 @@ class Model:
         except IndexError:
             return []
 
+    def _get_vars(self, elem, attr):
+        """Return list of all variable names (including deferred ones) that
+        the given attribute depends on."""
+        try:
+            return _get_expr_vars(self.madx, elem.cmdpar[attr].expr)
+        except IndexError:
+            return []
+
     def read_param(self, expr):
         """Read element attribute. Return numeric value."""
         return self.madx.eval(expr)
@@ -756,10 +1641,35 @@ class Model:
 
 class ElementList(ExpandedElementList):
 
-    def __init__(self, madx, seq_name):
+    """
+    Expanded element list with local name lookup.
+
+    Elements can be referred to by node name (``q1[2]``), by their name in
+    the twiss table (``q1:2``), or by plain name (first occurrence).
+    """
+
+    def __init__(self, madx, seq_name, names=None, positions=None):
         super().__init__(madx, seq_name)
-        self.names = madx._libmadx.get_expanded_element_names(seq_name)
-        self._indices = {k: i for i, k in enumerate(self.names)}
+        if names is None:
+            names = madx._libmadx.get_expanded_element_names(seq_name)
+            positions = madx._libmadx.get_expanded_element_positions(
+                seq_name)
+        self.names = names
+        self.positions = positions
+        self._indices = indices = {}
+        for i, name in enumerate(self.names):
+            base, _, count = name.partition('[')
+            count = count.rstrip(']') or '1'
+            indices.setdefault(name, i)
+            indices.setdefault('{}[{}]'.format(base, count), i)
+            indices.setdefault('{}:{}'.format(base, count), i)
+            indices.setdefault(base, i)
+        if self.names:
+            indices['#s'] = 0
+            indices['#e'] = len(self.names) - 1
+
+    def __len__(self):
+        return len(self.names)
 
     def __getitem__(self, key):
         index = self.index(key)
@@ -772,15 +1682,10 @@ class ElementList(ExpandedElementList):
         return elem
 
     def index(self, key):
-        if isinstance(key, int):
+        if isinstance(key, Integral):
+            key = int(key)
             return key + len(self) if key < 0 else key
         elif isinstance(key, str):
-            name = key.lower()
-            if len(self) != 0:
-                if name == '#s':
-                    return 0
-                elif name == '#e':
-                    return len(self) - 1
             try:
                 return self._indices[key.lower()]
             except KeyError as e:
@@ -791,6 +1696,95 @@ class ElementList(ExpandedElementList):
             "Unknown key: {!r} ({})".format(key, type(key)))
 
 
+class ElementTable:
+
+    """
+    Local mirror of frequently used element attributes as NumPy arrays with
+    one entry per element of an :class:`ElementList`, e.g. ``table.k1[i]``.
+    This avoids fetching all elements from MAD-X one by one in loops over
+    the sequence. Attributes that are not defined for an element are zero.
+
+    If ``data`` is given (as returned by :meth:`export`), the columns are
+    initialized from it rather than fetched from MAD-X.
+    """
+
+    columns = [
+        'name', 'node_name', 'base_name', 'index', 'position', 'length',
+        'angle', 'k0', 'k1', 'k1s', 'kick', 'hkick', 'vkick', 'tilt',
+    ]
+
+    _strings = ('name', 'node_name', 'base_name')
+
+    def __init__(self, elements, data=None):
+        self.elements = elements
+        count = len(elements)
+        self._data = {
+            column: np.empty(count, dtype=object if column in self._strings
+                             else int if column == 'index' else float)
+            for column in self.columns
+        }
+        self._data['node_name'][:] = elements.names
+        self._data['index'][:] = np.arange(count)
+        self._data['position'][:] = elements.positions
+        # All occurrences of an element share the same definition, so every
+        # definition has to be fetched only once:
+        self._occurrences = occurrences = {}
+        for index, name in enumerate(elements.names):
+            occurrences.setdefault(name.split('[')[0], []).append(index)
+        if data is not None:
+            for column, values in self._data.items():
+                values[:] = data[column]
+            return
+        for indices in occurrences.values():
+            self._fetch(indices)
+
+    # Columns that differ between occurrences of the same element:
+    _node_columns = ('node_name', 'index', 'position')
+
+    def update(self, index):
+        """Refetch the attributes of the element with the given index (and
+        all other occurrences of the same element)."""
+        name = self._data['node_name'][index].split('[')[0]
+        self._fetch(self._occurrences[name])
+
+    def _fetch(self, indices):
+        """Fetch the attributes of the element definition that is shared by
+        the elements with the given indices."""
+        elem = self.elements[indices[0]]
+        for column, data in self._data.items():
+            if column not in self._node_columns:
+                value = getattr(elem, column, 0)
+                data[indices] = (
+                    value.lower() if column == 'base_name' else value)
+
+    def __len__(self):
+        return len(self.elements)
+
+    def __getitem__(self, column):
+        return self._data[column]
+
+    def __getattr__(self, column):
+        if column.startswith('_'):
+            raise AttributeError(column)
+        try:
+            return self._data[column]
+        except KeyError:
+            raise AttributeError(column) from None
+
+    def row(self, index):
+        """Return the attributes of one element as dict."""
+        return AttrDict({k: v[index] for k, v in self._data.items()})
+
+    def export(self):
+        """Return the columns as dict of lists."""
+        return {k: v.tolist() for k, v in self._data.items()}
+
+    def select(self, base_names):
+        """Return the indices of all elements with the given (lowercase)
+        base names."""
+        return np.flatnonzero(np.isin(self.base_name, list(base_names)))
+
+
 # stuff for online control
 
 def _get_leaf_knobs(madx, exprs):
@@ -815,6 +1809,26 @@ def _get_leaf_knobs(madx, exprs):
     return vars
 
 
+def _get_expr_vars(madx, exprs):
+    """
+    Return names of all variables that the given expressions depend upon,
+    either directly or via deferred expressions.
+    """
+    cmdpar = madx.globals.cmdpar
+    exprs = exprs if isinstance(exprs, list) else [exprs]
+    exprs = [e for e in exprs if e]
+    seen = set()
+    vars = []
+    while exprs:
+        expr = exprs.pop(0)
+        new = set(madx.expr_vars(expr)) - seen
+        pars = [cmdpar[v] for v in new]
+        vars.extend([p.name for p in pars])
+        exprs.extend([p.expr for p in pars if p.var_type == VAR_TYPE_DEFERRED])
+        seen.update(new)
+    return vars
+
+
 def _is_property_defined(elem, attr):
     """Check if attribute of an element was defined."""
     while elem.parent is not elem:
@@ -896,22 +1910,33 @@ def reverse_sequence_inplace(madx, seq_name):
     cmd.reflect()
     cmd.endedit()
 
+    done = set()
     for elem in reversed(madx.sequence[seq_name].elements):
-        if elem.occ_cnt == 0 or '$' in elem.name:
+        if elem.occ_cnt == 0 or '$' in elem.name or elem.name in done:
             continue
-        overrides = {}
-        overrides.update({
-            attr: negate_expr(elem.defs[attr])
-            for attr in _INVERT_ATTRS.get(elem.base_name, ())
-        })
-        if elem.base_name == 'sbend':
-            overrides['e1'] = negate_expr(elem.defs.e2)
-            overrides['e2'] = negate_expr(elem.defs.e1)
-
+        # all occurences share the same definition, invert it only once:
+        done.add(elem.name)
+        overrides = reverse_element_attrs(elem.base_name, elem.defs)
         if overrides:
             elem(**overrides)
 
 
+def reverse_element_attrs(base_name, data):
+    """Return the attributes that must be changed in ``data`` to obtain the
+    element for the direction reversed sequence."""
+    overrides = {
+        attr: negate_expr(data[attr])
+        for attr in _INVERT_ATTRS.get(base_name, ())
+        if attr in data
+    }
+    if base_name == 'sbend':
+        if 'e2' in data:
+            overrides['e1'] = negate_expr(data['e2'])
+        if 'e1' in data:
+            overrides['e2'] = negate_expr(data['e1'])
+    return overrides
+
+
 def negate_expr(value):
     return "-({})".format(value) if isinstance(value, str) else -value
 
@@ -945,6 +1970,22 @@ class TwissTable(Table):
                             self.sig34 * self.sig43)**0.5,
     }
 
+    # columns needed to compute the transformed columns:
+    _requires = {
+        'alfx': ['sig12', 'ex'],
+        'alfy': ['sig34', 'ey'],
+        'betx': ['sig11', 'ex'],
+        'bety': ['sig33', 'ey'],
+        'gamx': ['sig22', 'ex'],
+        'gamy': ['sig44', 'ey'],
+        'envx': ['sig11'],
+        'envy': ['sig33'],
+        'posx': ['x'],
+        'posy': ['y'],
+        'ex': ['sig11', 'sig22', 'sig12', 'sig21'],
+        'ey': ['sig33', 'sig44', 'sig34', 'sig43'],
+    }
+
     def _query(self, column):
         """Retrieve the column data."""
         transform = self._transform.get(column)
@@ -953,6 +1994,283 @@ class TwissTable(Table):
         else:
             return transform(self)
 
+    @classmethod
+    def expand_columns(cls, columns):
+        """Return the given columns together with all columns that they are
+        computed from."""
+        result = set()
+        stack = [column.lower() for column in columns]
+        while stack:
+            column = stack.pop()
+            if column not in result:
+                result.add(column)
+                stack.extend(cls._requires.get(column, ()))
+        return result
+
+    def prefetch(self, columns):
+        """
+        Retrieve the given columns (and the columns they depend on) from
+        MAD-X right away, so that subsequent accesses are served from the
+        cache. Note that this still needs one MAD-X call per column, since
+        cpymad provides no way to fetch several columns at once. Unknown
+        columns are ignored.
+        """
+        columns = self.expand_columns(columns) - self._cache.keys()
+        columns = sorted(columns & set(self) - self._transform.keys())
+        for column in columns:
+            # Retrieves the column and stores it in the cache:
+            self[column]
+
+
+class ArrayTwissTable(Mapping):
+
+    """
+    Provides the same transformed columns as :class:`TwissTable` for twiss
+    results that are held in NumPy arrays, e.g. results that were fetched
+    from another MAD-X process, or interpolated in NumPy.
+    """
+
+    def __init__(self, columns, summary):
+        self._columns = columns
+        self._cache = {}
+        self.summary = summary
+
+    def __getitem__(self, column):
+        column = column.lower()
+        try:
+            return self._cache[column]
+        except KeyError:
+            pass
+        transform = TwissTable._transform.get(column)
+        if transform is None:
+            value = self._query(column)
+        else:
+            value = self._cache[column] = transform(self)
+        return value
+
+    def _query(self, column):
+        """Retrieve the column data."""
+        return self._columns[column]
+
+    def prefetch(self, columns):
+        """Does nothing, since all data is held locally."""
+
+    def __getattr__(self, column):
+        if column.startswith('_'):
+            raise AttributeError(column)
+        try:
+            return self[column]
+        except KeyError:
+            raise AttributeError(column) from None
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+    def row(self, index, columns='all'):
+        """Return row as dict."""
+        return AttrDict({k: self[k][index] for k in self})
+
+
+class InterpolatedTwissTable(ArrayTwissTable):
+
+    """
+    Adds interpolation points inside thick elements to a (non-interpolated)
+    :class:`TwissTable`, similar to the MAD-X ``SELECT, FLAG=INTERPOLATE``
+    option, but without another MAD-X pass.
+
+    The transfer map over a fraction ``f`` of an element is obtained as
+    ``exp(f·log(M))`` from the element map ``M``. This is exact for elements
+    with constant strength. For dipoles, the maps of the entry and exit edges
+    are split off first, i.e. ``exp(f·log(B))·E₁`` with ``M = E₂·B·E₁``.
+    Orbit and sigma matrix and phase advances are propagated through these
+    maps, all other numeric columns are interpolated linearly in ``s``.
+    Elements for which no valid generator ``log(M)`` exists (e.g. with a
+    phase advance above π) are interpolated linearly as well.
+
+    :ivar np.ndarray indices: row at the exit of each element
+    :ivar np.ndarray counts: number of interpolation points per element
+    :ivar TwissTable source: the underlying non-interpolated table
+    """
+
+    _orbit = ['x', 'px', 'y', 'py', 't', 'pt']
+    _sigma = ['sig{}{}'.format(i+1, j+1) for i in range(6) for j in range(6)]
+    _edges = ['keyword', 'angle', 'l', 'e1', 'e2', 'fint', 'fintx', 'hgap',
+              'tilt']
+
+    def __init__(self, table, maps, step=None, counts=None):
+        """
+        :param TwissTable table: non-interpolated twiss table
+        :param maps: `N×7×7` sectormaps of the table rows
+        :param float step: maximum distance between interpolation points
+        :param counts: number of interpolation points per row (overrides
+            ``step``)
+        """
+        super().__init__(table, table.summary)
+        self.source = table
+        lengths = np.array(table.l)
+        if counts is None:
+            counts = np.zeros(len(lengths), dtype=int)
+            thick = lengths > 0
+            counts[thick] = np.maximum(lengths[thick] / step + 1e-9, 1) - 1
+        counts = np.asarray(counts, dtype=int)
+        self.counts = counts
+        sizes = counts + 1
+        stops = np.cumsum(sizes) - 1
+        self.indices = stops
+        self._rows = np.repeat(np.arange(len(lengths)), sizes)
+        self._frac = (
+            np.arange(len(self._rows)) - np.repeat(stops - counts, sizes) + 1
+        ) / np.repeat(sizes, sizes)
+        self._inner = np.flatnonzero(self._frac < 1)
+        self._maps = np.full((len(self._inner), 7, 7), np.nan)
+        self._exact = np.zeros(len(self._inner), dtype=bool)
+        # the matrix logarithms are reused when the same table is
+        # interpolated again with different counts:
+        generators = table.__dict__.setdefault('_generators', {})
+        rows = np.flatnonzero(counts)
+        edges = _dipole_edges(table, [i for i in rows if i not in generators])
+        start = 0
+        for i in rows:
+            if i not in generators:
+                generators[i] = _map_generator(maps[i], *edges.get(i, ()))
+            entry, gen = generators[i]
+            if gen is not None:
+                self._exact[start:start+counts[i]] = True
+                for k in range(1, counts[i]+1):
+                    self._maps[start+k-1] = np.dot(
+                        expm(gen * k / sizes[i]), entry)
+            start += counts[i]
+
+    def _query(self, column):
+        """Retrieve the column data."""
+        table = self._columns
+        if column in self._orbit:
+            self._propagate(self._orbit, lambda tm, x: tm[:, :6, :] @ x)
+        elif column in self._sigma:
+            self._propagate(self._sigma, lambda tm, x: (
+                tm[:, :6, :6] @ x @ tm[:, :6, :6].transpose((0, 2, 1))))
+        elif column in ('mux', 'muy'):
+            i, ax = (0, 'x') if column == 'mux' else (2, 'y')
+            rows = self._rows[self._inner] - 1
+            beta = table['bet' + ax][rows]
+            alfa = table['alf' + ax][rows]
+            r11, r12 = self._maps[:, i, i], self._maps[:, i, i+1]
+            dmu = np.arctan2(r12, beta * r11 - alfa * r12) / (2 * np.pi)
+            value = self._interpolate(table[column])
+            exact = self._exact
+            value[self._inner[exact]] = (
+                table[column][rows] + np.mod(dmu, 1))[exact]
+            self._cache[column] = value
+        else:
+            data = table[column]
+            value = data[self._rows]
+            if value.dtype.kind in 'fiu':
+                value = self._interpolate(data)
+            self._cache[column] = value
+        return self._cache[column]
+
+    def _interpolate(self, data):
+        """Interpolate a numeric column linearly in ``s``."""
+        inner, rows = self._inner, self._rows[self._inner]
+        frac = self._frac[inner]
+        value = data[self._rows].astype(float)
+        value[inner] = (1-frac) * data[rows-1] + frac * data[rows]
+        return value
+
+    def _propagate(self, columns, transform):
+        """Compute the given columns at the interpolation points by
+        transforming the values at the element entries."""
+        table = self._columns
+        rows = self._rows[self._inner]
+        data = [table[col] for col in columns]
+        if columns is self._orbit:
+            init = np.array([d[rows-1] for d in data] + [np.ones(len(rows))])
+            init = init.T[:, :, None]
+            inner = transform(self._maps, init)[:, :, 0]
+        else:
+            init = np.array([d[rows-1] for d in data]).T.reshape((-1, 6, 6))
+            inner = transform(self._maps, init).reshape((-1, 36))
+        exact = self._exact
+        for i, (col, d) in enumerate(zip(columns, data)):
+            value = self._interpolate(d)
+            value[self._inner[exact]] = inner[exact, i]
+            self._cache[col] = value
+
+    def prefetch(self, columns):
+        """Prefetch the columns of the underlying :class:`TwissTable` that
+        are needed to compute the given columns."""
+        columns = TwissTable.expand_columns(columns)
+        if columns & set(self._orbit):
+            columns.update(self._orbit)
+        if columns & set(self._sigma):
+            columns.update(self._sigma)
+        if 'mux' in columns or 'muy' in columns:
+            columns.update(TwissTable.expand_columns([
+                'betx', 'alfx', 'bety', 'alfy']))
+        self._columns.prefetch(columns)
+
+    def row(self, index, columns='all'):
+        """Return row as dict."""
+        if self._frac[index] == 1:
+            return self._columns.row(int(self._rows[index]), columns)
+        return super().row(index, columns)
+
+
+def _dipole_edges(table, rows):
+    """Return a dict with the maps ``(E₁, E₂)`` of the entry and exit edges
+    for the dipoles among the given rows of a twiss table."""
+    keyword = np.array(table.keyword)
+    rows = [i for i in rows if keyword[i].lower() in ('sbend', 'rbend')]
+    if not rows:
+        return {}
+    attrs = {
+        col: np.array(table[col])[rows] if col in table else np.zeros(len(rows))
+        for col in InterpolatedTwissTable._edges[1:]
+    }
+    # MAD-X uses FINT also for the exit if FINTX is not given:
+    fintx = np.where(attrs['fintx'] < 0, attrs['fint'], attrs['fintx'])
+    h = attrs['angle'] / attrs['l']
+    edges = {}
+    for n, i in enumerate(rows):
+        rot = _tilt_map(attrs['tilt'][n])
+        entry = dipole_edge_map(
+            h[n], attrs['e1'][n], attrs['fint'][n], attrs['hgap'][n])
+        exit = dipole_edge_map(
+            h[n], attrs['e2'][n], fintx[n], attrs['hgap'][n])
+        edges[i] = (rot.T @ entry @ rot, rot.T @ exit @ rot)
+    return edges
+
+
+def _tilt_map(tilt):
+    """Return the 7×7 map for rotating the coordinates by ``tilt`` around
+    the longitudinal axis."""
+    c, s = np.cos(tilt), np.sin(tilt)
+    rot = np.eye(7)
+    rot[0, 0] = rot[1, 1] = rot[2, 2] = rot[3, 3] = c
+    rot[0, 2] = rot[1, 3] = s
+    rot[2, 0] = rot[3, 1] = -s
+    return rot
+
+
+def _map_generator(tm, entry=None, exit=None):
+    """
+    Return ``(entry, log(B))`` for the element map ``tm = exit·B·entry``,
+    or ``(entry, None)`` if the principal logarithm of ``B`` is not a valid
+    generator, i.e. if it is complex or corresponds to backward motion
+    (which happens for phase advances above π).
+    """
+    if entry is None:
+        entry = np.eye(7)
+    else:
+        tm = np.linalg.solve(exit, tm) @ np.linalg.inv(entry)
+    gen = logm(tm)
+    if np.iscomplexobj(gen) or gen[0, 1] <= 0 or gen[2, 3] <= 0:
+        return entry, None
+    return entry, gen
+
 
 def _load_params(data, name, path):
     """Load parameter dict from file if necessary."""
@@ -971,6 +2289,32 @@ def _call(madx, path, name):
     return vals
 
 
+def _get_twiss_response(model, error, columns, step):
+    """Return the given twiss columns as `C×N` array after varying the error
+    by ``step`` (or unmodified if ``error`` is ``None``)."""
+    from .errors import apply_errors
+    madx = model.madx
+    madx.command.select(flag='interpolate', clear=True)
+    errors = [] if error is None else [error]
+    with apply_errors(model, errors, [step] * len(errors)):
+        tw = madx.twiss(**model._get_twiss_args(table='jacobian_tmp'))
+        return np.array([tw[col] for col in columns])
+
+
+def _get_orm_orbit(model, knob, errors, values, step):
+    """Return the ``x`` and ``y`` columns of a TWISS with the knob varied by
+    ``step`` (or unmodified if ``knob`` is ``None``) and the given errors
+    applied."""
+    from .errors import apply_errors, Param
+    madx = model.madx
+    madx.command.select(flag='interpolate', clear=True)
+    knobs = [] if knob is None else [Param(knob)]
+    with apply_errors(model, knobs, [step] * len(knobs)):
+        with apply_errors(model, errors, values):
+            tw = madx.twiss(**model._get_twiss_args(table='orm_tmp'))
+    return tw.x, tw.y
+
+
 def _guess_main_sequence(madx):
     """Try to guess the 'main' sequence to be viewed."""
     sequence = madx.sequence()
@@ -10,11 +10,17 @@ __all__ = [
 ]
 
 import logging
+from bisect import bisect_left
 from collections import namedtuple
+from itertools import islice
+
+import numpy as np
 
 from madgui.util.signal import Signal
 from madgui.util.collections import List
 
+from .linear import LinearMatch
+
 
 Constraint = namedtuple('Constraint', ['elem', 'pos', 'axis', 'value'])
 
@@ -58,6 +64,10 @@ class Matcher:
         self.match_results = {}
         self.design_values = {}
         self.mirror_mode = rules.get('mirror', True)
+        self.method = rules.get('method', 'madx')
+        self.ranked = rules.get('ranked', False)
+        self._var_index = {}
+        self._var_state = None
 
     def match(self):
         """Match the :attr:`variables` to satisfy :attr:`constraints`."""
@@ -79,7 +89,8 @@ class Matcher:
             logging.warning(
                 "Aborted due to invalid number of constraints or variables.")
             return
-        match_results = self.model.match(variables, constraints, self.mirror_mode)
+        match_results = self.model.match(
+            variables, constraints, self.mirror_mode, self.method)
         self.match_results = {k.lower(): v for k, v in match_results.items()}
         self.variables.touch()
 
@@ -118,12 +129,24 @@ class Matcher:
     def next_best_variable(self):
         return self.knobs[0]
 
-    def detect_variables(self):
+    # number of upstream knobs to compare in ranked mode:
+    max_candidates = 8
+
+    def detect_variables(self, ranked=None):
         """
         Fill :attr:`variables` to the same length as :attr:`constraints`.
+
+        By default, the closest unused knob upstream of each constraint is
+        selected. With ``ranked=True``, the knob with the largest response at
+        the constraint among the :attr:`max_candidates` closest upstream knobs
+        is selected instead (if the response can be computed on the linear
+        optics, see :class:`~madgui.model.linear.LinearMatch`). ``ranked``
+        defaults to the ``ranked`` option of the matching rules.
         """
-        # The following uses the most naive, greedy and probably stupid
-        # algorithm to select all elements that can be used for varying.
+        # The following uses a greedy algorithm to select all elements that
+        # can be used for varying.
+        if ranked is None:
+            ranked = self.ranked
         variables = self.variables
         transform = MatchTransform()
         constraints = [
@@ -131,37 +154,83 @@ class Matcher:
             for c in self.constraints
             for tw in [self._get_tw_row(c.elem, c.pos)]
         ]
-        # Copy all needed variable lists (for later modification):
-        axes = {c.axis for c in constraints}
-        axes = {axis: self._allvars(axis)[:] for axis in axes}
         used = set()
         for c in sorted(constraints, key=lambda c: c.pos):
             # Stop as soon as we have enough variables:
             if len(variables) >= len(constraints):
                 break
-            try:
-                # TODO: just bisect this…
-                var = next(v for elem, v in reversed(axes[c.axis])
-                           if elem.position < c.pos and v not in used)
+            candidates = self._upstream_vars(c.axis, c.pos, used)
+            if ranked:
+                var = self._most_sensitive_var(
+                    c, list(islice(candidates, self.max_candidates)))
+            else:
+                var = next(candidates, None)
+            # No variable in range found! Ok?
+            if var is not None:
                 variables.insert(0, var)
                 used.add(var)
-            except StopIteration:
-                # No variable in range found! Ok?
-                pass
+
+    def _upstream_vars(self, axis, pos, used):
+        """Iterate over the unused knobs for the given axis that are located
+        before ``pos``, starting with the closest. Each knob is yielded only
+        once, even if it affects multiple elements."""
+        positions, knobs = self._allvars(axis)
+        seen = set(used)
+        for i in reversed(range(bisect_left(positions, pos))):
+            if knobs[i] not in seen:
+                seen.add(knobs[i])
+                yield knobs[i]
+
+    def _most_sensitive_var(self, constraint, knobs):
+        """Return the knob with the largest response at the constraint.
+        Knobs whose response can not be computed are ranked last, ties are
+        resolved in favor of the closest knob."""
+        if len(knobs) < 2:
+            return knobs[0] if knobs else None
+        if constraint.axis.lower() not in LinearMatch.columns:
+            return knobs[0]
+        model = self.model
+        deps = model.knob_dependencies()
+        response = np.zeros(len(knobs))
+        for i, knob in enumerate(knobs):
+            problem = knob.lower() in deps and model._get_linear_match(
+                [knob], [constraint], {})
+            if problem:
+                jac = problem.jacobian([0], [model.read_param(knob)])
+                response[i] = abs(jac[0, 0])
+        return knobs[int(np.argmax(response))]
 
     def _allvars(self, axis):
         """
-        Find all usable constraints for the given axis.
+        Find all usable variables for the given axis.
 
-        :returns: list of :class:`Variable`.
+        :returns: sorted list of element positions, and the list of
+            corresponding knobs. The lists are computed only once per axis,
+            and recomputed when the lattice or its knobs change.
         """
+        model = self.model
+        table = model.element_table()
+        deps = model.knob_dependencies()
+        state = self._var_state
+        if state is None or state[0] is not table or state[1] is not deps:
+            self._var_index = {}
+            self._var_state = (table, deps)
+        try:
+            return self._var_index[axis]
+        except KeyError:
+            pass
         elem_types = self.rules.get(axis, ())
-        return [
-            (elem, knob)
-            for elem in self.model.elements
-            if elem.base_name.lower() in elem_types
-            for knob in self.model.get_elem_knobs(elem)
-        ]
+        items = sorted(
+            (table.position[i], n, knob)
+            for n, (i, knob) in enumerate(
+                (i, knob)
+                for i in table.select(elem_types)
+                for knob in model.get_elem_knobs(model.elements[int(i)]))
+        )
+        index = self._var_index[axis] = (
+            [pos for pos, n, knob in items],
+            [knob for pos, n, knob in items])
+        return index
 
 
 class MatchTransform:
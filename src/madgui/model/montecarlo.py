@@ -0,0 +1,162 @@
+"""
+Monte-Carlo error studies: evaluate observables for many random samples of
+the errors defined in :mod:`madgui.model.errors`.
+"""
+
+__all__ = [
+    'MonteCarlo',
+    'gauss',
+    'uniform',
+    'twiss_columns',
+    'envelope_max',
+    'orbit_response',
+]
+
+from numbers import Number
+
+import numpy as np
+
+from .errors import apply_errors, parse_error
+
+
+def gauss(sigma, mean=0, cut=None):
+    """Return a normal distribution. If ``cut`` is given, values beyond
+    ``cut`` standard deviations are discarded and drawn again."""
+    def sample(rng):
+        while True:
+            value = rng.normal()
+            if cut is None or abs(value) <= cut:
+                return mean + sigma * value
+    return sample
+
+
+def uniform(low, high):
+    """Return a uniform distribution in ``[low, high)``."""
+    def sample(rng):
+        return rng.uniform(low, high)
+    return sample
+
+
+def twiss_columns(columns, elements):
+    """Observable for the given twiss columns at the exit of the given
+    elements. Returns a `columns × elements` array per sample."""
+    def observe(model, twiss):
+        rows = [model.elements.index(e) - model.start.index for e in elements]
+        return np.array([twiss[col][rows] for col in columns])
+    return observe
+
+
+def envelope_max(columns=('sig11', 'sig33')):
+    """Observable for the maximum of the beam envelope (square root of the
+    given sigma matrix elements) along the sequence."""
+    def observe(model, twiss):
+        return np.array([np.sqrt(twiss[col].max()) for col in columns])
+    return observe
+
+
+def orbit_response(monitors, knobs, method='numeric'):
+    """Observable for the `M×2×K` orbit response matrix, see
+    :meth:`~madgui.model.madx.Model.get_orbit_response_matrix`."""
+    def observe(model, twiss):
+        return model.get_orbit_response_matrix(
+            monitors, knobs, method=method)
+    return observe
+
+
+class MonteCarlo:
+
+    """
+    Evaluates observables for random samples of model errors, e.g.::
+
+        study = MonteCarlo(model, {
+            'g3mu1<dx>': gauss(1e-4, cut=3),
+            'δkl_q1': uniform(-1e-3, 1e-3),
+        }, {
+            'orbit': twiss_columns(['x', 'y'], monitors),
+            'envelope': envelope_max(),
+        }, seed=42)
+        results = study.run(1000)
+        results['orbit']        # 1000 × 2 × M array
+
+    Each observable is a function ``observe(model, twiss)`` that is called
+    with the errors applied and the table of a TWISS with these errors, and
+    returns a scalar or array.
+
+    The error values of sample ``i`` are drawn from a random generator that
+    is seeded with ``(seed, i)``. Results are therefore reproducible, also
+    when computing samples in parallel or in several chunks.
+
+    :ivar list errors: the errors as :class:`~madgui.model.errors.BaseError`
+    :ivar list distributions: functions that draw a value from a generator
+    :ivar dict observables: functions that compute the results per sample
+    """
+
+    def __init__(self, model, errors, observables, seed=0, pool=None):
+        """
+        :param Model model: model to use when no pool is given
+        :param dict errors: map of error name (or instance) to distribution.
+            Numbers are used as standard deviation of a normal distribution.
+        :param dict observables: map of names to observable functions
+        :param int seed: base seed for the random number generator
+        :param ModelPool pool: pool of workers to compute the samples
+        """
+        self.model = model
+        self.errors = [
+            parse_error(error) if isinstance(error, str) else error
+            for error in errors
+        ]
+        self.distributions = [
+            gauss(dist) if isinstance(dist, Number) else dist
+            for dist in errors.values()
+        ]
+        self.observables = observables
+        self.seed = seed
+        self.pool = pool
+
+    def sample(self, index):
+        """Return the error values of the sample with the given index."""
+        rng = np.random.default_rng(
+            np.random.SeedSequence(self.seed, spawn_key=(index,)))
+        return np.array([dist(rng) for dist in self.distributions])
+
+    def evaluate(self, model, index):
+        """Compute the observables for one sample on the given model and
+        return them as dict."""
+        values = self.sample(index)
+        with apply_errors(model, self.errors, values):
+            # Observables expect one row per element, so make sure that no
+            # interpolation points are left selected from other computations:
+            model.madx.command.select(flag='interpolate', clear=True)
+            twiss = model.madx.twiss(
+                **model._get_twiss_args(table='montecarlo'))
+            return {
+                name: observe(model, twiss)
+                for name, observe in self.observables.items()
+            }
+
+    def iter_results(self, samples):
+        """Compute the given samples (count or list of indices) and yield
+        ``(index, results)`` in order as soon as they are available."""
+        if isinstance(samples, int):
+            samples = range(samples)
+        samples = list(samples)
+        if self.pool is None:
+            results = (self.evaluate(self.model, i) for i in samples)
+        else:
+            results = self.pool.imap(self.evaluate, samples)
+        return zip(samples, results)
+
+    def run(self, samples):
+        """Compute the given samples (count or list of indices) and return a
+        dict with an array per observable, where the first axis corresponds
+        to the samples. The error values are included as ``'errors'``."""
+        if isinstance(samples, int):
+            samples = range(samples)
+        samples = list(samples)
+        results = [result for _, result in self.iter_results(samples)]
+        data = {
+            name: np.array([result[name] for result in results])
+            for name in self.observables
+        }
+        data['errors'] = np.array([self.sample(i) for i in samples])
+        return data
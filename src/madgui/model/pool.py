@@ -0,0 +1,265 @@
+"""
+Pool of MAD-X worker processes for evaluating independent computations on
+copies of a model concurrently.
+"""
+
+__all__ = [
+    'ModelPool',
+    'ObjectiveExecutor',
+]
+
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from cpymad.madx import Madx
+
+from .madx import Model, reverse_element_attrs, _call
+
+
+class ModelPool:
+
+    """
+    Replicates the state of a :class:`~madgui.model.madx.Model` into several
+    worker models, each with its own MAD-X process, and dispatches
+    independent evaluations to them, e.g.::
+
+        pool = ModelPool(model, 8)
+        orbits = pool.map(lambda m, knob: ..., knobs)
+
+    The workers are loaded from the same init files as the main model, and
+    replay the files that were loaded via ``Model.call``. The workers are
+    restarted when another file is loaded. Before each dispatch, they are
+    synchronized with the current state of the main model, i.e. its globals,
+    the values set via ``update_element``, the beam, the twiss initial
+    conditions and the interpolation setting. Changes to elements that were
+    made by other means are not replicated.
+
+    By default, the workers use the same direction as the main model. With
+    ``reverse`` set to the opposite of ``model._reversed``, the sequences of
+    the workers are reversed in-place relative to the main model, and element
+    attributes are transformed accordingly when synchronizing. This is used
+    for backtracking.
+
+    Each worker is used by only one task at a time. Tasks should restore the
+    worker state before returning (e.g. by using
+    :func:`~madgui.model.errors.apply_errors`), so that all tasks see the same
+    state and results do not depend on the task-to-worker assignment.
+
+    :ivar Model model: the main model
+    :ivar int size: number of worker processes
+    """
+
+    def __init__(self, model, size=None, reverse=None, **madx_kwargs):
+        """
+        :param Model model: main model to replicate
+        :param int size: number of workers, defaults to the number of CPUs
+        :param bool reverse: whether the sequence of the workers is reversed
+            (relative to the init files), defaults to ``model._reversed``
+        :param madx_kwargs: arguments for the worker :class:`Madx` instances
+        """
+        if model.filename is None:
+            raise ValueError("Can only replicate models loaded from a file!")
+        self.model = model
+        self.size = size or os.cpu_count() or 1
+        self.reverse = model._reversed if reverse is None else reverse
+        self.madx_kwargs = madx_kwargs
+        self.workers = []
+        self._idle = queue.Queue()
+        self._executor = ThreadPoolExecutor(self.size)
+        self._synced = None
+        self._generation = None
+        self._knob_state = {}
+        self._calls = None
+        self._closed = False
+
+    def __len__(self):
+        return self.size
+
+    def map(self, func, items):
+        """
+        Call ``func(worker, item)`` for each item using the next idle worker,
+        and return the list of results in the order of ``items``.
+        """
+        return list(self.imap(func, items))
+
+    def imap(self, func, items):
+        """Same as :meth:`map`, but return an iterator that yields the
+        results (in the order of ``items``) as soon as they are available."""
+        items = list(items)
+        self.sync()
+        return self._executor.map(self._run, [func] * len(items), items)
+
+    def sync(self):
+        """Start the workers if necessary, and replicate the current state of
+        the main model to all workers if it has changed since the last call.
+        """
+        if self._closed:
+            raise ValueError("ModelPool has been closed!")
+        model = self.model
+        if model._errors:
+            raise ValueError(
+                "Can not replicate temporary state, such as applied errors!")
+        key = model.cache_key()
+        if key == self._synced:
+            return
+        if self.workers and self._calls != model._calls:
+            self._stop_workers()
+        if not self.workers:
+            self._calls = list(model._calls)
+            self.workers = list(self._executor.map(
+                lambda i: self._spawn(), range(self.size)))
+            for worker in self.workers:
+                self._idle.put(worker)
+            self._generation = None
+        if model._generation != self._generation:
+            # unknown modifications, fall back to transfering all globals:
+            globals = {
+                k: p.definition
+                for k, p in model.globals.cmdpar.items()
+                if p.inform
+            }
+            self._knob_state = {}
+        else:
+            globals = {}
+        elements = _diff_knob_state(self._knob_state, model._knob_state,
+                                    globals)
+        state = (globals, elements, dict(model.beam),
+                 dict(model.twiss_args), model.interpolate,
+                 self.reverse != model._reversed)
+        list(self._executor.map(
+            lambda worker: _sync_worker(worker, *state), self.workers))
+        self._knob_state = dict(model._knob_state)
+        self._generation = model._generation
+        self._synced = key
+
+    def close(self):
+        """Stop all worker processes. The pool can not be used afterwards.
+        Calling this method more than once has no effect."""
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.shutdown()
+        self._stop_workers()
+
+    def _stop_workers(self):
+        for worker in self.workers:
+            worker.destroy()
+        self.workers = []
+        self._idle = queue.Queue()
+        self._synced = None
+
+    def _run(self, func, item):
+        """Execute a single task on the next idle worker."""
+        worker = self._idle.get()
+        try:
+            return func(worker, item)
+        finally:
+            self._idle.put(worker)
+
+    def _spawn(self):
+        """Start a new worker that is initialized like the main model."""
+        return _spawn_worker(
+            self.model, self.reverse, self.madx_kwargs, self._calls)
+
+
+class ObjectiveExecutor:
+
+    """
+    Evaluates objective functions of the main model of a :class:`ModelPool`
+    on its workers. Can be passed as ``executor`` to the functions in
+    :mod:`madgui.util.fit`, e.g.::
+
+        f = partial(objective, model)
+        fit(f, x0, algorithm='lstsq', delta=1e-4,
+            executor=ObjectiveExecutor(model.pool))
+
+    The objective must be a :func:`functools.partial` object (possibly
+    nested) that passes the main model as an argument. On the workers, the
+    main model is replaced by the worker model. Objectives must restore the
+    model state before returning, see :class:`ModelPool`.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def map(self, func, items):
+        """Evaluate ``func(item)`` for each item on the workers and return
+        the list of results in the order of ``items``."""
+        model = self.pool.model
+        if _rebind(func, model, None) is func:
+            raise ValueError(
+                "The objective must be a partial of the pool's model!")
+        return self.pool.map(
+            lambda worker, item: _rebind(func, model, worker)(item), items)
+
+
+def _rebind(func, model, worker):
+    """Return ``func`` with all references to ``model`` in the arguments of
+    (nested) :func:`functools.partial` objects replaced by ``worker``, or
+    ``func`` itself if there are no such references."""
+    if func is model:
+        return worker
+    if not isinstance(func, partial):
+        return func
+    parts = [func.func, *func.args, *func.keywords.values()]
+    bound = [_rebind(part, model, worker) for part in parts]
+    if all(new is old for new, old in zip(bound, parts)):
+        return func
+    args = bound[1:len(func.args)+1]
+    kwargs = dict(zip(func.keywords, bound[len(func.args)+1:]))
+    return partial(bound[0], *args, **kwargs)
+
+
+def _spawn_worker(model, reverse, madx_kwargs, calls=()):
+    """Start a new MAD-X process and initialize a worker model in it from the
+    init files of the given model, followed by the given ``Model.call``
+    files."""
+    data = model.model_data()
+    madx = Madx(**madx_kwargs)
+    madx.option(echo=False)
+    path = os.path.join(model.path, data.get('path', '.'))
+    for fname in data.get('init-files', []):
+        _call(madx, path, fname)
+    worker = Model(madx, data, filename=model.filename)
+    for fname in calls:
+        worker.call(fname)
+    if reverse:
+        worker.reverse()
+    return worker
+
+
+def _diff_knob_state(old, new, globals):
+    """Add the globals that differ between two ``Model._knob_state`` to the
+    ``globals`` dict and return the changed element attributes grouped by
+    element name."""
+    elements = {}
+    for k, v in new.items():
+        if k not in old or old[k] != v:
+            if isinstance(k, tuple):
+                elements.setdefault(k[0], {})[k[1]] = v
+            else:
+                globals[k] = v
+    return elements
+
+
+def _sync_worker(worker, globals, elements, beam, twiss_args, interpolate,
+                 reverse):
+    """Apply the given state to a worker model. ``reverse`` specifies
+    whether the worker runs in the opposite direction of the main model."""
+    if globals:
+        worker._update_globals(globals)
+    for name, data in elements.items():
+        index = worker.elements.index(name)
+        if reverse:
+            base_name = worker.elements[index].base_name
+            data = dict(data, **reverse_element_attrs(base_name, data))
+        worker._update_element(data, index)
+    if beam != worker.beam:
+        worker._update_beam(beam)
+    if twiss_args != worker.twiss_args:
+        worker._update_twiss_args(twiss_args)
+    if interpolate != worker.interpolate:
+        worker.interpolate = interpolate
+        worker._invalidate()
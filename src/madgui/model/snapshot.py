@@ -0,0 +1,145 @@
+"""
+On-disk snapshots of the MAD-X state after loading a model. Loading the
+snapshot replaces parsing all init files if none of them has changed.
+"""
+
+__all__ = [
+    'Snapshot',
+    'find_called_files',
+]
+
+import hashlib
+import logging
+import os
+import re
+from contextlib import suppress
+
+from madgui.util import yaml
+
+
+# Increase when changing the contents of the snapshot:
+FORMAT = 2
+
+_CALL = re.compile(
+    r'''\bcall\s*,\s*file\s*=\s*["']?([^"';,\s]+)''', re.IGNORECASE)
+
+
+def find_called_files(filename):
+    """
+    Return the list of absolute paths of ``filename`` and all files that are
+    loaded from it via ``CALL`` statements (recursively). Relative paths are
+    resolved with respect to the folder of the calling file. Files that do
+    not exist are included in the list as well.
+    """
+    files = []
+    pending = [os.path.abspath(filename)]
+    while pending:
+        name = pending.pop(0)
+        if name in files:
+            continue
+        files.append(name)
+        try:
+            with open(name, encoding='utf-8', errors='replace') as f:
+                text = f.read()
+        except OSError:
+            continue
+        text = re.sub(r'/\*.*?\*/', '', text, flags=re.DOTALL)
+        text = re.sub(r'(!|//).*', '', text)
+        folder = os.path.dirname(name)
+        pending.extend(
+            os.path.join(folder, path)
+            for path in _CALL.findall(text))
+    return files
+
+
+class Snapshot:
+
+    """
+    Snapshot of the MAD-X state after executing a list of init files, stored
+    in a cache folder under a key that is computed from:
+
+    - the contents of the model file, the init files and all files that are
+      loaded via ``CALL`` statements from within these files
+    - the MAD-X version and the snapshot format
+
+    The snapshot consists of two files:
+
+    - ``<key>.madx``: sequence, element and variable definitions as written
+      by MAD-X ``SAVE``
+    - ``<key>.yml``: the model data, the list of files, and the element table
+      of the model (see :class:`~madgui.model.madx.ElementTable`), so that
+      the element names, positions and attributes do not have to be fetched
+      from MAD-X after loading the snapshot
+
+    Note that ``SAVE`` stores only sequences, elements and variables. Models
+    that rely on other state, such as macros or tables defined in the init
+    files, should not use snapshots.
+
+    :ivar str key: hex digest that identifies the snapshot
+    :ivar list files: files whose content is included in the key
+    :ivar dict elements: element table data of the loaded snapshot
+    """
+
+    elements = None
+
+    def __init__(self, folder, madx, filenames):
+        """
+        :param str folder: cache folder
+        :param Madx madx: interpreter (only used to determine the version)
+        :param list filenames: model file and init files
+        """
+        self.folder = folder
+        self.files = list(dict.fromkeys(
+            path
+            for name in filenames
+            for path in find_called_files(name)
+        ))
+        digest = hashlib.sha256()
+        digest.update('{}\0{}\0{}\0'.format(
+            FORMAT, madx.version.release, madx.version.date).encode())
+        for name in self.files:
+            digest.update(name.encode('utf-8') + b'\0')
+            try:
+                with open(name, 'rb') as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+            except OSError:
+                digest.update(b'\0missing')
+        self.key = digest.hexdigest()
+        base = os.path.join(folder, self.key)
+        self.madx_file = base + '.madx'
+        self.data_file = base + '.yml'
+
+    def load(self, madx):
+        """Load the snapshot into ``madx`` and return the model data, or
+        return ``None`` if no valid snapshot is available."""
+        try:
+            info = yaml.load_file(self.data_file)
+        except (OSError, yaml.YAMLError):
+            return None
+        if not isinstance(info, dict) or info.get('key') != self.key \
+                or not os.path.isfile(self.madx_file):
+            return None
+        madx.call(self.madx_file)
+        self.elements = info.get('elements')
+        return info['data']
+
+    def save(self, madx, data, elements=None):
+        """Save the current state of ``madx``, the model data and the element
+        table data. Failures are logged but otherwise ignored."""
+        temp = '{}.{}.tmp'.format(self.madx_file, os.getpid())
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            madx.command.save(file=temp)
+            os.replace(temp, self.madx_file)
+            # the data file is written last, since it marks the snapshot as
+            # complete:
+            yaml.save_file(self.data_file, {
+                'key': self.key,
+                'files': self.files,
+                'data': data,
+                'elements': elements,
+            })
+        except (OSError, RuntimeError, yaml.YAMLError) as e:
+            logging.warning("Failed to save model snapshot: {}".format(e))
+            with suppress(OSError):
+                os.remove(temp)
@@ -0,0 +1,138 @@
+"""
+Fast access to the transfer maps between arbitrary elements of a sequence.
+"""
+
+__all__ = [
+    'TransferMapCache',
+]
+
+import numpy as np
+
+
+class TransferMapCache:
+
+    """
+    Cache for products of element transfer maps, i.e. the maps ``R(i,j)``
+    between arbitrary positions of the sequence.
+
+    The products are computed from cumulative (prefix) products of the
+    individual maps::
+
+        R(i,j) = M[j-1] … M[i] = P[j] · P[i]⁻¹
+
+    so that each interval costs only a single matrix multiplication. If the
+    prefix products become numerically ill-conditioned, a segment tree of
+    partial products is used instead, which requires ``O(log N)``
+    multiplications per interval.
+
+    :ivar table: the sectormap table from which the maps were obtained
+    :ivar np.ndarray maps: `N×7×7` element maps (including kicks)
+    """
+
+    def __init__(self, maps, table=None, max_cond=1e6):
+        """
+        :param maps: `N×7×7` sectormaps of the individual elements
+        :param table: object to remember as origin of the maps
+        :param float max_cond: maximum condition number for which the
+            prefix products are considered safe to invert
+        """
+        self.table = table
+        self.max_cond = max_cond
+        self.maps = maps = np.array(maps, dtype=float)
+        self.prefix = np.empty((len(maps) + 1, 7, 7))
+        self.prefix[0] = np.eye(7)
+        self.stable = np.ones(len(maps) + 1, dtype=bool)
+        self.inverse = np.empty_like(self.prefix)
+        self.inverse[0] = np.eye(7)
+        self._tree = None
+        self._update_prefix(0)
+
+    def __len__(self):
+        return len(self.maps)
+
+    def update(self, start, maps):
+        """Replace the element maps starting at index ``start`` and refresh
+        the downstream products."""
+        maps = np.asarray(maps, dtype=float)
+        stop = start + len(maps)
+        self.maps[start:stop] = maps
+        self._update_prefix(start)
+        tree = self._tree
+        if tree is not None:
+            size = len(tree) // 2
+            tree[size+start:size+stop] = maps
+            lo, hi = (size + start) // 2, (size + stop - 1) // 2 + 1
+            while lo > 0:
+                tree[lo:hi] = np.matmul(
+                    tree[2*lo+1:2*hi:2], tree[2*lo:2*hi:2])
+                lo, hi = lo // 2, (hi - 1) // 2 + 1
+
+    def _update_prefix(self, start):
+        """Recompute prefix products and their inverses after ``start``."""
+        if start >= len(self.maps):
+            return
+        prefix = self.prefix
+        for i in range(start, len(self.maps)):
+            prefix[i+1] = np.dot(self.maps[i], prefix[i])
+        stable = np.linalg.cond(prefix[start+1:]) < self.max_cond
+        self.stable[start+1:] = stable
+        self.inverse[start+1:][stable] = np.linalg.inv(
+            prefix[start+1:][stable])
+
+    def product(self, i, j):
+        """Return the product of the maps in the half-open interval ``[i,
+        j)``, i.e. the map from the entry of element ``i`` to the entry of
+        element ``j``. Returns the identity if the interval is empty."""
+        i = max(0, i)
+        j = min(j, len(self.maps))
+        if i >= j:
+            return np.eye(7)
+        if i == 0:
+            return self.prefix[j].copy()
+        if self.stable[i]:
+            return np.dot(self.prefix[j], self.inverse[i])
+        return self._tree_product(i, j)
+
+    def inverse_maps(self, i, j):
+        """Return the inverses of the element maps in the half-open interval
+        ``[i, j)``. They are obtained as ``M[k]⁻¹ = P[k] · P[k+1]⁻¹`` from the
+        prefix products where these are stable, and by explicit inversion
+        otherwise."""
+        maps = self.maps[i:j]
+        stable = self.stable[i+1:j+1]
+        result = np.empty_like(maps)
+        result[stable] = np.matmul(
+            self.prefix[i:j][stable], self.inverse[i+1:j+1][stable])
+        result[~stable] = np.linalg.inv(maps[~stable])
+        return result
+
+    def _tree_product(self, i, j):
+        """Compute the interval product from the segment tree."""
+        tree = self._get_tree()
+        size = len(tree) // 2
+        lo, hi = np.eye(7), np.eye(7)
+        i, j = i + size, j + size
+        while i < j:
+            if i & 1:
+                lo = np.dot(tree[i], lo)
+                i += 1
+            if j & 1:
+                j -= 1
+                hi = np.dot(hi, tree[j])
+            i //= 2
+            j //= 2
+        return np.dot(hi, lo)
+
+    def _get_tree(self):
+        """Build the segment tree of partial products on first use."""
+        if self._tree is None:
+            size = 1 << max(0, len(self.maps) - 1).bit_length()
+            tree = np.empty((2 * size, 7, 7))
+            tree[:] = np.eye(7)
+            tree[size:size+len(self.maps)] = self.maps
+            for level in reversed(range(size.bit_length() - 1)):
+                lo, hi = 1 << level, 2 << level
+                tree[lo:hi] = np.matmul(
+                    tree[2*lo+1:2*hi:2], tree[2*lo:2*hi:2])
+            self._tree = tree
+        return self._tree
@@ -0,0 +1,187 @@
+"""
+Background computation of the twiss table, so that the GUI stays responsive
+while MAD-X is busy.
+"""
+
+__all__ = [
+    'TwissWorker',
+]
+
+import logging
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from .madx import ArrayTwissTable, InterpolatedTwissTable, TwissTable
+from .pool import _diff_knob_state, _spawn_worker, _sync_worker
+
+
+_Request = namedtuple('_Request', [
+    'key', 'calls', 'globals', 'knob_state', 'beam', 'twiss_args', 'columns'])
+
+
+class TwissWorker:
+
+    """
+    Computes the twiss table of a :class:`~madgui.model.madx.Model` in a
+    background thread that owns a separate MAD-X process.
+
+    After each change, the model calls :meth:`request` instead of emitting
+    ``Model.updated``. The state of the model is then replicated to the
+    worker process (in the same way as for
+    :class:`~madgui.model.pool.ModelPool`, i.e. the worker is restarted
+    after ``Model.call``) and TWISS is computed there. The twiss table and
+    the sectormaps are handed to the model in the main thread, which emits
+    ``Model.updated`` if they still correspond to its current state. After
+    ``Model.invalidate`` the model no longer uses the worker, since other
+    modifications of the MAD-X state can not be replicated.
+
+    New requests supersede the pending one, i.e. a burst of changes results
+    in at most one computation for an intermediate state and one for the
+    final state. Results that were superseded while being computed are
+    discarded.
+
+    The synchronous API of the model is not affected: ``Model.twiss()``
+    computes the table in the main process if no current result is
+    available.
+
+    By default, requires a running Qt main loop to deliver the results.
+
+    :ivar Model model: the main model
+    :ivar bool reverse: whether the sequence of the worker is reversed
+    """
+
+    def __init__(self, model, reverse=False, schedule=None, **madx_kwargs):
+        """
+        :param Model model: main model
+        :param bool reverse: reverse the sequence of the worker process, must
+            be set if the main model was reversed
+        :param schedule: function that is called from the background thread
+            when a result is available, and must arrange for :meth:`_deliver`
+            to be called in the main thread. Defaults to a queued Qt trigger.
+        :param madx_kwargs: arguments for the worker :class:`Madx` instance
+        """
+        if model.filename is None:
+            raise ValueError("Can only replicate models loaded from a file!")
+        self.model = model
+        self.reverse = reverse
+        self.madx_kwargs = madx_kwargs
+        self._cond = threading.Condition()
+        self._request = None
+        self._result = None
+        self._closed = False
+        self._generation = None
+        if schedule is None:
+            from madgui.util.qt import Queued
+            schedule = Queued(self._deliver)
+        self._deliver_queued = schedule
+        # state of the worker process, only accessed by the worker thread:
+        self._worker = None
+        self._calls = None
+        self._knob_state = {}
+        self._thread = threading.Thread(target=self._main, daemon=True)
+        self._thread.start()
+
+    def request(self):
+        """Schedule the computation for the current state of the model,
+        superseding any request that has not been started yet."""
+        model = self.model
+        if model._generation != self._generation:
+            # unknown modifications, fall back to transfering all globals:
+            globals = {
+                k: p.definition
+                for k, p in model.globals.cmdpar.items()
+                if p.inform
+            }
+            self._generation = model._generation
+        else:
+            globals = None
+        columns = TwissTable.expand_columns(
+            model.prefetch_columns | {'s', 'l', 'name', 'mux', 'muy'} |
+            set(InterpolatedTwissTable._orbit) |
+            set(InterpolatedTwissTable._sigma) |
+            set(InterpolatedTwissTable._edges))
+        request = _Request(
+            model.cache_key(), list(model._calls), globals,
+            dict(model._knob_state),
+            dict(model.beam), dict(model.twiss_args), columns)
+        with self._cond:
+            pending = self._request
+            if pending is not None and globals is None:
+                request = request._replace(globals=pending.globals)
+            self._request = request
+            self._cond.notify()
+
+    def close(self):
+        """Stop the thread and the worker process. Pending requests are
+        discarded."""
+        with self._cond:
+            self._closed = True
+            self._request = None
+            self._cond.notify()
+
+    def _main(self):
+        """Main loop of the background thread."""
+        while True:
+            with self._cond:
+                while self._request is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    break
+                request, self._request = self._request, None
+            try:
+                table = self._compute(request)
+            except Exception as e:
+                logging.error("Background TWISS failed: {}".format(e))
+                # let the main thread compute (and report) it again:
+                table = None
+            with self._cond:
+                if self._request is not None or self._closed:
+                    continue        # superseded, never deliver stale results
+                self._result = (request.key, table)
+            self._deliver_queued()
+        if self._worker is not None:
+            self._worker.destroy()
+            self._worker = None
+
+    def _compute(self, request):
+        """Update the worker process to the requested state, run TWISS, and
+        return the non-interpolated table with the sectormaps."""
+        worker = self._worker
+        if worker is not None and self._calls != request.calls:
+            worker.destroy()
+            worker = self._worker = None
+        if worker is None:
+            worker = self._worker = _spawn_worker(
+                self.model, self.reverse, self.madx_kwargs, request.calls)
+            self._calls = request.calls
+            self._knob_state = {}
+        if request.globals is not None:
+            globals = dict(request.globals)
+            self._knob_state = {}
+        else:
+            globals = {}
+        elements = _diff_knob_state(
+            self._knob_state, request.knob_state, globals)
+        _sync_worker(worker, globals, elements, request.beam,
+                     request.twiss_args, 0, False)
+        self._knob_state = request.knob_state
+        results, _ = worker._twiss_pass()
+        results.prefetch(request.columns)
+        table = ArrayTwissTable({
+            column: results[column]
+            for column in request.columns & set(results)
+            if column not in TwissTable._transform
+        }, results.summary)
+        table.indices = np.arange(len(results.maps))
+        table.maps = results.maps
+        return table
+
+    def _deliver(self):
+        """Pass the latest result to the model (in the main thread)."""
+        with self._cond:
+            result, self._result = self._result, None
+        if result is not None and not self.model._set_twiss(*result):
+            # the model was changed by means that did not trigger a request:
+            self.request()
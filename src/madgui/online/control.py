@@ -87,12 +87,14 @@ class Control:
 
     def _on_model_changed(self, model=None):
         model = model or self.model()
-        elems = self.is_connected() and model and model.elements or ()
+        if not (self.is_connected() and model):
+            self.sampler.monitors = []
+            return
+        table = model.element_table()
         self.sampler.monitors = [
-            elem.name
-            for elem in elems
-            if elem.base_name.lower().endswith('monitor')
-            or elem.base_name.lower() == 'instrument'
+            name
+            for name, base_name in zip(table.name, table.base_name)
+            if base_name.endswith('monitor') or base_name == 'instrument'
         ]
 
     def export_settings(self):
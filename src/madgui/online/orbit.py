@@ -96,7 +96,7 @@ def fit_initial_orbit(records, rcond=1e-6):
 
 
 def fit_particle_orbit_opticVar(readouts, optics, optic_elements,
-                                model, monitor, targets):
+                                model, monitor, targets, tracking='linear'):
     """
     Compute initial beam position/momentum from multiple recorded monitor
     readouts. The tracking goes just to the begining of the first optic
@@ -109,6 +109,10 @@ def fit_particle_orbit_opticVar(readouts, optics, optic_elements,
       @param model is the MADX model
       @param monitor is the monitor at which it was measured
       @param targets are the elements in the beamline where we want to optimize
+      @param tracking selects how the fit orbit is tracked to the targets:
+             'linear' uses the transfer maps (see Model.track_many), which is
+             a first order approximation around the model orbit, 'madx'
+             tracks with MAD-X (one TWISS per target and optic)
 
     Returns:    { (element, axis) : fit orbit }
     Element is the target element, axis x or y
@@ -136,14 +140,21 @@ def fit_particle_orbit_opticVar(readouts, optics, optic_elements,
     measuredT = []
     for o in optics:
         model.write_params(o.items())
-        measuredT.append(
-            {t.elem: [track.x[-1], track.y[-1]]
-             for t in targets
-             for track in
-             [model.track_one(x=xFit[0], px=xFit[1],
-                              y=xFit[2], py=xFit[3],
-                              range='{}/{}'.format(initElem,
-                                                   t.elem))]})
+        if tracking == 'madx':
+            measuredT.append(
+                {t.elem: [track.x[-1], track.y[-1]]
+                 for t in targets
+                 for track in
+                 [model.track_one(x=xFit[0], px=xFit[1],
+                                  y=xFit[2], py=xFit[3],
+                                  range='{}/{}'.format(initElem,
+                                                       t.elem))]})
+        else:
+            measuredT.append(
+                {t.elem: [track[0], track[2]]
+                 for t in targets
+                 for track in
+                 [model.track_many([*xFit, 0, 0], (initElem, t.elem))[0, -1]]})
 
     measured = [
         {(t.elem.lower(), ax): val
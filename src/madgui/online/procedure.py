@@ -20,6 +20,7 @@ import numpy as np
 
 import madgui.util.yaml as yaml
 from madgui.util.collections import List, Boxed
+from madgui.util.fit import response_solver
 from madgui.util.history import History
 from madgui.util.misc import invalidate
 from madgui.util.signal import Signal
@@ -54,6 +55,7 @@ class Corrector(Matcher):
     """
 
     mode = 'xy'
+    orm_method = 'analytic'
     setup_changed = Signal()
 
     def __init__(self, session, direct=True):
@@ -103,7 +105,9 @@ class Corrector(Matcher):
         last_mon = max(map(elements.index, monitors), default=0)
 
         knob_elems = {}
-        for elem in elements:
+        table = self.model.element_table()
+        for i in table.select(self.model.ELEM_KNOBS):
+            elem = elements[int(i)]
             for knob in self.model.get_elem_knobs(elem):
                 knob_elems.setdefault(knob.lower(), []).append(elem)
 
@@ -357,15 +361,15 @@ class Corrector(Matcher):
                                                                'xy'))
                     if (elem.lower(), axis) in targets
                 ]
-                dvar = np.linalg.lstsq(orm[S, :], deltas, rcond=1e-10)[0]
+                dvar = response_solver(orm, rows=S, rcond=1e-10).solve(deltas)
             # Optic variation method
             # TODO: Just works if two Optics were given
             # Extend to user defined number of optics
             else:
                 mons, axs, deltas = zip(*self._get_objective_deltas())
                 targets = set(zip(mons, axs))
-                ormOptVar = np.vstack((orm[0], orm[1]))
-                dvar = np.linalg.lstsq(ormOptVar, deltas, rcond=1e-10)[0]
+                dvar = response_solver(
+                    [orm[0], orm[1]], rcond=1e-10).solve(deltas)
 
             globals_ = self.model.globals
             return {
@@ -431,7 +435,8 @@ class Corrector(Matcher):
             return self._compute_orm_varOpt(targets)
 
         return self.model.get_orbit_response_matrix(
-            self.monitors, self.variables).reshape((-1, len(self.variables)))
+            self.monitors, self.variables, method=self.orm_method,
+        ).reshape((-1, len(self.variables)))
 
     def _compute_orm_varOpt(self, targets):
         # Computes ORM for different optics for the given targets
@@ -441,7 +446,7 @@ class Corrector(Matcher):
             self.model.write_params(o.items())
             orm.append(
                 self.model.get_orbit_response_matrix(
-                    targets, self.variables).
+                    targets, self.variables, method=self.orm_method).
                 reshape((-1, len(self.variables)))
             )
         self.model.write_params(self.optics[0].items())
@@ -12,15 +12,24 @@ __all__ = [
     'fit_svd',
     'fit_lstsq',
     'fit_lstsq_oneshot',
+    'fit_broyden',
+    'fit_least_squares',
+    'jacobian',
     'jac_twopoint',
+    'relative_delta',
+    'ResponseSolver',
+    'response_solver',
 ]
 
 from itertools import count
 from functools import partial
 
 import numpy as np
+import scipy.linalg
 import scipy.optimize as sciopt
 
+from madgui.util.misc import LRUCache
+
 
 def reduced_chisq(residuals, ddof=0):
     """Compute reduced chi-squared."""
@@ -65,7 +74,7 @@ def fit_minimize(f, x0, iterations=None, **kwargs):
 
 def _scipy_minimize(
         minimizer, f, x0,
-        delta=None, jac=None,
+        delta=None, jac=None, scheme='twopoint', executor=None,
         callback=None, **kwargs):
     state = sciopt.OptimizeResult(
         x=x0, fun=None, chisq=None, nit=0,
@@ -79,11 +88,11 @@ def _scipy_minimize(
         state.chisq = reduced_chisq(state.fun)
         callback(state)
 
-    def obj_fun(x):
-        return reduced_chisq(f(x))
+    obj_fun = partial(_chisq, f)
 
     if jac is None and delta is not None:
-        jac = partial(jac_twopoint, obj_fun, delta=delta)
+        jac = partial(
+            jacobian, obj_fun, delta=delta, scheme=scheme, executor=executor)
 
     result = minimizer(
         obj_fun, x0, jac=jac,
@@ -94,20 +103,29 @@ def _scipy_minimize(
     return result
 
 
+def _chisq(f, x):
+    """Objective function for the scalar minimizers (module level, so that
+    it can be sent to process pools)."""
+    return reduced_chisq(f(x))
+
+
 def fit_svd(f, x0, jac=None, tol=1e-8, delta=None,
-            iterations=None, callback=None, rcond=1e-2):
+            iterations=None, callback=None, rcond=1e-2,
+            scheme='twopoint', executor=None):
     """Fit objective function ``f(x) = y`` using a naive repeated linear
     least-squares fit using the svd-based pseudo inverse."""
     return fit_lstsq(
         f, x0, jac=jac, tol=tol, delta=delta,
         iterations=iterations, callback=callback, rcond=rcond,
-        lstsq=_lstsq_svd)
+        lstsq=_lstsq_svd, scheme=scheme, executor=executor)
 
 
 def fit_lstsq(f, x0, jac=None, tol=1e-8, delta=None,
-              iterations=None, callback=None, rcond=1e-2, lstsq=None):
+              iterations=None, callback=None, rcond=1e-2, lstsq=None,
+              scheme='twopoint', executor=None):
     """Fit objective function ``f(x) = y`` using a naive repeated linear
-    least-squares fit."""
+    least-squares fit. See :func:`jacobian` for ``delta``, ``scheme`` and
+    ``executor``."""
     dx = 0
     for nit in count():
         y0 = f(x0)
@@ -125,7 +143,8 @@ def fit_lstsq(f, x0, jac=None, tol=1e-8, delta=None,
             success = False
             break
         dx, dy = fit_lstsq_oneshot(
-            lstsq, f, x0, y0=y0, jac=jac, delta=delta, rcond=rcond)
+            lstsq, f, x0, y0=y0, jac=jac, delta=delta, rcond=rcond,
+            scheme=scheme, executor=executor)
         x0 += dx
     chisq = reduced_chisq(y0)
     return sciopt.OptimizeResult(
@@ -133,14 +152,16 @@ def fit_lstsq(f, x0, jac=None, tol=1e-8, delta=None,
         success=success, message=message)
 
 
-def fit_lstsq_oneshot(lstsq, f, x0, y0=None, delta=None, jac=None, rcond=1e-8):
+def fit_lstsq_oneshot(lstsq, f, x0, y0=None, delta=None, jac=None, rcond=1e-8,
+                      scheme='twopoint', executor=None):
     """Single least squares fit for ``f(x) = y`` around ``x0``.
     Returns ``(Δx, Δy)``, where ``Δy`` is the linear hypothesis for how much
     ``y`` will change due to change in ``x``."""
     if y0 is None:
         y0 = f(x0)
     if jac is None:
-        jac = partial(jac_twopoint, f, y0=y0, delta=delta)
+        jac = partial(jacobian, f, y0=y0, delta=delta, scheme=scheme,
+                      executor=executor)
     A = jac(x0)
     Y = -y0
     n = Y.size
@@ -150,27 +171,319 @@ def fit_lstsq_oneshot(lstsq, f, x0, y0=None, delta=None, jac=None, rcond=1e-8):
     return X.flatten(), np.dot(A, X).reshape(y0.shape)
 
 
+def fit_broyden(f, x0, jac=None, tol=1e-8, delta=None,
+                iterations=None, callback=None, rcond=1e-2, lstsq=None,
+                scheme='twopoint', executor=None, stall=0.1):
+    """
+    Fit objective function ``f(x) = y`` like :func:`fit_lstsq`, but compute
+    the full jacobian only initially, and otherwise apply Broyden rank-one
+    updates after each step. The jacobian is recomputed if a step is
+    rejected (i.e. does not decrease ``chisq``) or stalls, i.e. achieves
+    less than the fraction ``stall`` of the decrease predicted by the
+    linear model.
+
+    The result reports the number of evaluations of ``f`` (``nfev``,
+    including finite differences) and of full jacobians (``njev``).
+    """
+    lstsq = lstsq or np.linalg.lstsq
+    x0 = np.array(x0, dtype=float)
+    y0 = f(x0)
+    chisq = reduced_chisq(y0)
+    state = sciopt.OptimizeResult(nfev=1, njev=0)
+
+    def full_jacobian(x, y):
+        state.njev += 1
+        if jac is not None:
+            A = jac(x)
+        else:
+            A = jacobian(f, x, y0=y, delta=delta, scheme=scheme,
+                         executor=executor)
+            state.nfev += len(x) * (2 if scheme == 'central' else 1)
+        return A.reshape((len(x), -1)).T
+
+    A = full_jacobian(x0, y0)
+    fresh = True
+    dx = 0
+    for nit in count():
+        if callback is not None:
+            callback(sciopt.OptimizeResult(
+                x=x0, fun=y0, chisq=chisq, nit=nit, dx=dx,
+                success=False, message="In progress."))
+        if iterations is not None and nit > iterations:
+            message = "Reached max number of iterations"
+            success = False
+            break
+        dx = lstsq(A, -y0.reshape((-1, 1)), rcond=rcond)[0].flatten()
+        if np.allclose(dx, 0, atol=tol):
+            message = "Reached convergence"
+            success = True
+            break
+        x1 = x0 + dx
+        y1 = f(x1)
+        state.nfev += 1
+        chisq1 = reduced_chisq(y1)
+        if chisq1 < chisq:
+            dy = (y1 - y0).flatten()
+            predicted = reduced_chisq(y0 + np.dot(A, dx).reshape(y0.shape))
+            stalled = chisq - chisq1 < stall * (chisq - predicted)
+            A = A + np.outer(dy - np.dot(A, dx), dx) / np.dot(dx, dx)
+            x0, y0, chisq = x1, y1, chisq1
+            fresh = False
+        elif fresh:
+            message = "No further improvement"
+            success = False
+            break
+        else:
+            stalled = True
+        if stalled:
+            A = full_jacobian(x0, y0)
+            fresh = True
+    state.update(
+        x=x0, fun=y0, chisq=chisq, nit=nit,
+        success=success, message=message)
+    return state
+
+
+def fit_least_squares(f, x0, jac=None, tol=1e-8, delta=None,
+                      iterations=None, callback=None, method='trf',
+                      bounds=None, x_scale=None,
+                      scheme='twopoint', executor=None, **kwargs):
+    """
+    Fit objective function ``f(x) = y`` using the trust region algorithms of
+    :func:`scipy.optimize.least_squares` on the residual vector ``y``.
+    ``NaN`` residuals are ignored (as in :func:`reduced_chisq`).
+
+    :param jac: analytic jacobian ``jac(x)`` with the same layout as
+        :func:`jacobian`, e.g. computed from the transfer maps of the model.
+        By default, finite differences are used, see :func:`jacobian` for
+        ``delta`` (default ``'relative'``), ``scheme`` and ``executor``.
+    :param str method: ``'trf'``, ``'dogbox'`` or ``'lm'``
+    :param bounds: list of ``(lower, upper)`` for each parameter
+    :param x_scale: characteristic scale of each parameter, or ``'jac'``
+    :param int iterations: maximum number of evaluations of ``f`` (not
+        counting finite differences)
+
+    The result reports the number of evaluations of ``f`` (``nfev``,
+    including finite differences) and of the jacobian (``njev``).
+    """
+    x0 = np.array(x0, dtype=float)
+    state = sciopt.OptimizeResult(
+        x=x0, fun=None, chisq=None, nit=0, dx=0, nfev=0,
+        success=False, message="In progress.")
+
+    def residuals(x):
+        y = f(x)
+        state.nfev += 1
+        state.dx = x - state.x
+        state.x, state.fun = x.copy(), y
+        if callback is not None:
+            state.chisq = reduced_chisq(y)
+            callback(state)
+            state.nit += 1
+        return np.nan_to_num(np.ravel(y))
+
+    def jac_wrapper(x):
+        if jac is not None:
+            A = jac(x)
+        else:
+            # the residuals are always evaluated before the jacobian:
+            y0 = state.fun if np.array_equal(x, state.x) else None
+            A = jacobian(f, x, y0=y0, delta=delta or 'relative', scheme=scheme,
+                         executor=executor)
+            state.nfev += len(x) * (2 if scheme == 'central' else 1)
+            if y0 is None and scheme != 'central':
+                state.nfev += 1     # `jacobian` evaluates f(x) itself
+        return np.nan_to_num(np.reshape(A, (len(x), -1)).T)
+
+    if bounds is not None:
+        bounds = tuple(np.array(bounds, dtype=float).T)
+    else:
+        bounds = (-np.inf, np.inf)
+    if x_scale is not None:
+        kwargs['x_scale'] = x_scale
+    result = sciopt.least_squares(
+        residuals, x0, jac=jac_wrapper, bounds=bounds, method=method,
+        ftol=tol, xtol=tol, gtol=tol, max_nfev=iterations, **kwargs)
+    y = state.fun if np.array_equal(result.x, state.x) else f(result.x)
+    return sciopt.OptimizeResult(
+        x=result.x, fun=y, chisq=reduced_chisq(y), nit=result.njev,
+        nfev=state.nfev, njev=result.njev, status=result.status,
+        success=result.success, message=result.message)
+
+
 def _lstsq_svd(A, Y, rcond=1e-3):
-    u, s, v = np.linalg.svd(A, full_matrices=False)
-    cutoff = s.max() * rcond
-    s_inv = np.array([1/c if c >= cutoff else 0 for c in s])
-    X = np.dot(v.T, np.dot(s_inv[:, None] * u.T, Y))
+    X = ResponseSolver(A, rcond=rcond).solve(Y)
     return X, reduced_chisq(Y - np.dot(A, X))
 
 
-def jac_twopoint(f, x0, y0=None, delta=1e-3):
+class ResponseSolver:
+
+    """
+    Least-squares solver for ``A x = y`` with a fixed response matrix ``A``
+    and many right-hand sides ``y``. The decomposition of ``A`` is computed
+    once, subsequent solves cost only a matrix-vector product.
+
+    With ``method='svd'``, singular values below ``rcond`` times the largest
+    singular value are discarded, and optionally only the ``rank`` largest
+    ones are kept. A ``tikhonov`` parameter λ > 0 damps the remaining ones,
+    i.e. minimizes ``|A x - y|² + λ² |x|²``.
+
+    With ``method='qr'``, ``A`` must have full column rank and is solved via
+    its QR decomposition without regularization.
+
+    :ivar np.ndarray singular_values: singular values of ``A`` (SVD only)
+    :ivar int rank: number of singular values in use
+    """
+
+    def __init__(self, matrix, method='svd', rcond=1e-10, rank=None,
+                 tikhonov=0):
+        A = np.asarray(matrix, dtype=float)
+        self.shape = A.shape
+        self.method = method
+        if method == 'svd':
+            u, s, vt = np.linalg.svd(A, full_matrices=False)
+            keep = s > (s[0] * rcond if len(s) else 0)
+            if rank is not None:
+                keep[rank:] = False
+            inv = np.zeros_like(s)
+            inv[keep] = s[keep] / (s[keep]**2 + tikhonov**2)
+            self.singular_values = s
+            self.rank = int(keep.sum())
+            self._pinv = np.dot(vt[keep].T * inv[keep], u[:, keep].T)
+        elif method == 'qr':
+            if A.shape[0] < A.shape[1]:
+                raise np.linalg.LinAlgError(
+                    "QR requires at least as many rows as columns!")
+            self._q, self._r = np.linalg.qr(A)
+            self.rank = A.shape[1]
+        else:
+            raise ValueError("Unknown method: {!r}".format(method))
+
+    def solve(self, y):
+        """Return the least-squares solution ``x`` for a vector ``y``, or a
+        matrix of solutions for a matrix whose columns are right-hand
+        sides."""
+        y = np.asarray(y, dtype=float)
+        if self.method == 'svd':
+            return np.dot(self._pinv, y)
+        return scipy.linalg.solve_triangular(self._r, np.dot(self._q.T, y))
+
+
+_solvers = LRUCache(16)
+
+
+def response_solver(matrix, rows=None, **options):
+    """
+    Return a :class:`ResponseSolver` for ``matrix[rows]``, reusing a cached
+    one if the same matrix object was passed before with equal ``rows`` and
+    ``options``. ``matrix`` may also be a list of matrices that are stacked
+    vertically, in which case each of them is matched by identity.
+
+    Arrays are identified by their underlying buffer, shape and strides, so
+    that repeated views of the same (memoized) array also hit the cache.
+    Arrays must therefore not be modified in-place after being passed here.
+    """
+    matrices = matrix if isinstance(matrix, (list, tuple)) else [matrix]
+    key = (
+        tuple(map(_array_identity, matrices)),
+        None if rows is None else tuple(rows),
+        tuple(sorted(options.items())),
+    )
+    try:
+        solver = _solvers[key]
+    except KeyError:
+        A = np.vstack(matrices)
+        if rows is not None:
+            A = A[list(rows), :]
+        solver = ResponseSolver(A, **options)
+        # keep the inputs alive so their ids can not be reused:
+        solver.sources = matrices
+        _solvers[key] = solver
+    return solver
+
+
+def _array_identity(a):
+    base = a
+    while isinstance(base, np.ndarray) and base.base is not None:
+        base = base.base
+    if isinstance(a, np.ndarray):
+        return (id(base), a.__array_interface__['data'][0], a.shape,
+                a.strides, a.dtype.str)
+    return (id(a),)
+
+
+def jacobian(f, x0, y0=None, delta=1e-3, scheme='twopoint', executor=None):
+    """
+    Compute jacobian ``df/dx_i`` by finite differencing.
+
+    :param delta: step size (scalar or one per parameter), or
+        ``'relative'`` for steps relative to ``x0``, see
+        :func:`relative_delta`
+    :param str scheme: ``'twopoint'`` (forward) or ``'central'`` differences
+    :param executor: object with a ``map(func, items)`` method that returns
+        the results in order, such as :class:`concurrent.futures.Executor`,
+        for evaluating ``f`` concurrently. The result is the same as for the
+        serial evaluation. Process pools require a picklable ``f``. Thread
+        pools must not be used for objectives that use a model, since they
+        would share its MAD-X process. Use
+        :class:`~madgui.model.pool.ObjectiveExecutor` for these instead.
+    """
+    x0 = np.asarray(x0, dtype=float)
+    if isinstance(delta, str):
+        if delta != 'relative':
+            raise ValueError("Unknown delta: {!r}".format(delta))
+        delta = relative_delta(x0, scheme)
+    steps = np.eye(len(x0)) * delta
+    # Divide by the actual differences of the evaluation points, which may
+    # differ from the nominal steps due to rounding:
+    if scheme == 'twopoint':
+        if y0 is None:
+            y0 = f(x0)
+        xs = [x0 + dx for dx in steps]
+        ys = _map(executor, f, xs)
+        return np.array([
+            (y - y0) / (x[i] - x0[i])
+            for i, (x, y) in enumerate(zip(xs, ys))
+        ])
+    if scheme == 'central':
+        xs = [x for dx in steps for x in (x0 + dx, x0 - dx)]
+        ys = _map(executor, f, xs)
+        return np.array([
+            (ys[2*i] - ys[2*i+1]) / (xs[2*i][i] - xs[2*i+1][i])
+            for i in range(len(x0))
+        ])
+    raise ValueError("Unknown scheme: {!r}".format(scheme))
+
+
+def jac_twopoint(f, x0, y0=None, delta=1e-3, executor=None):
     """Compute jacobian ``df/dx_i`` using two point-finite differencing."""
-    if y0 is None:
-        y0 = f(x0)
-    return np.array([
-        (f(x0 + dx) - y0) / np.linalg.norm(dx)
-        for dx in np.eye(len(x0)) * delta
-    ])
+    return jacobian(f, x0, y0=y0, delta=delta, executor=executor)
+
+
+def relative_delta(x0, scheme='twopoint'):
+    """Return finite difference steps relative to the magnitude of ``x0``
+    (but at least relative to 1) that balance truncation and rounding
+    errors for the given scheme. The steps are exactly representable as
+    differences ``(x0 + h) - x0``."""
+    eps = np.finfo(float).eps
+    rel = eps ** (1/3 if scheme == 'central' else 1/2)
+    h = rel * np.maximum(np.abs(x0), 1)
+    return (x0 + h) - x0
+
+
+def _map(executor, func, items):
+    """Evaluate ``func`` for all items, concurrently if an executor is
+    given, and return the list of results."""
+    if executor is None:
+        return [func(item) for item in items]
+    return list(executor.map(func, items))
 
 
 supported_optimizers = {
     'svd': fit_svd,
     'lstsq': fit_lstsq,
+    'broyden': fit_broyden,
+    'least_squares': fit_least_squares,
     'minimize': fit_minimize,
     'basinhopping': fit_basinhopping,
     'diffevo': fit_diffevo,
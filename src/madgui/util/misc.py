@@ -4,7 +4,10 @@ Misc programming toolbox.
 
 __all__ = [
     'memoize',
+    'memoize_lru',
     'invalidate',
+    'LRUCache',
+    'freeze',
     'cachedproperty',
     'ranges',
     'strip_suffix',
@@ -14,6 +17,10 @@ __all__ = [
 
 import os
 import functools
+from collections import OrderedDict
+from collections.abc import Mapping, Set
+
+import numpy as np
 
 
 # class utils
@@ -57,12 +64,49 @@ def memoize(func):
                 return getattr(self, key)
             except AttributeError:
                 pass
-        val = func(self)
+        val = func(self, *args, **kwargs)
         setattr(self, key, val)
         return val
     return get
 
 
+def memoize_lru(maxsize=8, evict=None):
+    """
+    Decorator for methods whose result depends on the arguments and on the
+    state of the object, as returned by its ``cache_key()`` method. The most
+    recently used results are kept in an :class:`LRUCache` that is stored in
+    the attribute ``'_' + name + '_cache'``.
+
+    Arguments must be hashable after conversion by :func:`freeze`. Returned
+    NumPy arrays are shared between all callers and are therefore made
+    read-only.
+
+    :param int maxsize: maximum number of results to keep
+    :param str evict: name of a method to be called with results that are
+        discarded from the cache
+    """
+    def decorator(func):
+        attr = '_' + func.__name__ + '_cache'
+
+        @functools.wraps(func)
+        def get(self, *args, **kwargs):
+            cache = self.__dict__.get(attr)
+            if cache is None:
+                cache = LRUCache(maxsize, evict and getattr(self, evict))
+                setattr(self, attr, cache)
+            key = (freeze(args), freeze(kwargs), self.cache_key())
+            try:
+                return cache[key]
+            except KeyError:
+                val = func(self, *args, **kwargs)
+                if isinstance(val, np.ndarray):
+                    val.flags.writeable = False
+                cache[key] = val
+                return val
+        return get
+    return decorator
+
+
 def invalidate(obj, func):
     """Invalidate cache for memoized function."""
     key = '_' + func
@@ -107,6 +151,82 @@ def cachedproperty(func):
     return property(get_, set_, del_)
 
 
+class LRUCache:
+
+    """
+    Dict-like cache of bounded size that discards the least recently used
+    entries. Counts the number of hits and misses of lookups.
+
+        >>> cache = LRUCache(2)
+        >>> cache['a'] = 1
+        >>> cache['b'] = 2
+        >>> cache['a']
+        1
+        >>> cache['c'] = 3
+        >>> 'b' in cache
+        False
+        >>> cache.hits, cache.misses
+        (1, 0)
+    """
+
+    def __init__(self, maxsize=8, evict=None):
+        """
+        :param int maxsize: maximum number of entries
+        :param evict: function to be called with discarded values
+        """
+        self.maxsize = maxsize
+        self.evict = evict
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        try:
+            val = self._data[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self._data.move_to_end(key)
+        return val
+
+    def __setitem__(self, key, val):
+        self._data[key] = val
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._discard(self._data.popitem(last=False)[1])
+
+    def clear(self):
+        """Discard all entries."""
+        while self._data:
+            self._discard(self._data.popitem(last=False)[1])
+
+    def _discard(self, val):
+        if self.evict is not None:
+            self.evict(val)
+
+
+def freeze(obj):
+    """Convert (nested) dicts, lists, sets and arrays to hashable tuples,
+    so that they can be used as cache keys."""
+    if isinstance(obj, Mapping):
+        return tuple(sorted(
+            ((k, freeze(v)) for k, v in obj.items()), key=repr))
+    if isinstance(obj, (list, tuple)):
+        return tuple(map(freeze, obj))
+    if isinstance(obj, Set):
+        return frozenset(map(freeze, obj))
+    if isinstance(obj, np.ndarray):
+        return (obj.shape, tuple(obj.ravel().tolist()))
+    return obj
+
+
 # dictionary utils
 
 def ranges(nums):
@@ -18,7 +18,7 @@ __all__ = [
 import functools
 from importlib_resources import path as resource_filename, open_binary
 
-from PyQt5.QtCore import QEvent, QObject, QTimer
+from PyQt5.QtCore import QEvent, QMetaObject, QObject, QTimer
 from PyQt5.QtGui import QFont, QFontDatabase, QIcon, QPixmap
 from PyQt5 import uic
 
@@ -239,6 +239,8 @@ class Queued:
     invocation!
 
     This can only be used with at least a ``QCoreApplication`` instanciated.
+    The trigger can be called from any thread, the handler is always invoked
+    in the thread that created the trigger.
     """
 
     def __init__(self, func):
@@ -248,7 +250,8 @@ class Queued:
 
     def __call__(self):
         """Schedule the handler invocation for another mainloop iteration."""
-        self.timer.start()
+        # QTimer.start() must be called in the thread of the timer:
+        QMetaObject.invokeMethod(self.timer, 'start')
 
     @classmethod
     def method(cls, func):
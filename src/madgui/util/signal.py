@@ -98,7 +98,7 @@ class BoundSignal:
 
     def is_queued(self):
         """Return whether the signal operates in *queued mode*."""
-        return self._trigger is self._invoke
+        return self._trigger is not self._invoke
 
 
 def invoke_handlers(handlers, *args):
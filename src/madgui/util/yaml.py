@@ -100,7 +100,7 @@ def safe_dump(data, stream=None, Dumper=SafeDumper, **kwds):
             yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG,
             data.items())
     OrderedDumper.add_representer(OrderedDict, _dict_representer)
-    OrderedDumper.add_representer(np.bool, Dumper.represent_bool)
+    OrderedDumper.add_representer(np.bool_, Dumper.represent_bool)
     OrderedDumper.add_representer(np.int32, Dumper.represent_int)
     OrderedDumper.add_representer(np.int64, Dumper.represent_int)
     OrderedDumper.add_representer(np.float32, Dumper.represent_float)
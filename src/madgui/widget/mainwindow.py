@@ -426,7 +426,6 @@ class MainWindow(QMainWindow):
         """Reverse sequence from back to front. Experimental feature. Not
         implemented for all element types."""
         self.model().reverse()
-        self.model().invalidate()
 
     @SingleWindow.factory
     def editInitialConditions(self):
@@ -553,7 +552,8 @@ class MainWindow(QMainWindow):
             stdout=self.dataReceived.emit,
             stderr=subprocess.STDOUT,
             undo_stack=self.undo_stack,
-            interpolate=self.config.interpolate)
+            interpolate=self.config.interpolate,
+            snapshot_dir=self.config.snapshot_dir)
 
     def _on_model_changed(self, old_model, model):
 
@@ -567,6 +567,10 @@ class MainWindow(QMainWindow):
             return
 
         model.updated.set_queued(True)
+        if self.config.background_twiss and model.filename:
+            model.set_twiss_worker(stdout=False)
+        if self.config.worker_processes and model.filename:
+            model.set_pool(self.config.worker_processes, stdout=False)
 
         self.session.folder = os.path.split(model.filename)[0]
         logging.info('Loading {}'.format(model.filename))
@@ -280,6 +280,12 @@ class TwissFigure:
             return
         self.graph_info = self.get_graph_info(graph_name, self.xlim)
         self.graph_name = self.graph_info.name
+        self.model.prefetch_columns.update(
+            column
+            for curve in self.graph_info.curves
+            if curve.table == 'twiss'
+            for column in (curve.xname, curve.name)
+        )
         self.reset()
         self.graph_changed.emit()
 
@@ -327,6 +333,14 @@ class TwissFigure:
             # near-constant quantities in a weird way, see #32:
             ax.axhline(alpha=0)
             ax.set_autoscale_on(False)
+        # the axes share their x range:
+        figure.axes[0].callbacks.connect('xlim_changed', self.on_xlim_changed)
+        self.on_xlim_changed(figure.axes[0])
+
+    def on_xlim_changed(self, ax):
+        """Concentrate the interpolation points in the visible range."""
+        self.xlim = tuple(from_ui(self.x_name, x) for x in ax.get_xlim())
+        self.model.set_interpolate_range(self, self.xlim)
 
     def draw_idle(self):
         """Draw the figure on its canvas."""
@@ -335,6 +349,7 @@ class TwissFigure:
             canvas.draw_idle()
 
     def destroy(self):
+        self.model.set_interpolate_range(self, None)
         self.model.updated.disconnect(self.on_model_updated)
         self.session.control.sampler.updated.disconnect(self.on_readouts_updated)
         self.scene_graph.destroy()
@@ -391,10 +406,10 @@ class TwissFigure:
             self.draw_idle()
 
     def _layout_elems(self):
+        table = self.model.element_table()
         return [
-            indicator_params(elem)
-            for elem in self.model.elements
-            if elem.base_name in self.element_style
+            indicator_params(table.row(i))
+            for i in table.select(self.element_style)
         ]
 
     def get_curve_by_name(self, name):
@@ -404,7 +419,6 @@ class TwissFigure:
 
     def get_graph_info(self, name, xlim):
         """Get the data for a particular graph."""
-        # TODO: use xlim for interpolate
         conf = self.config['graphs'][name]
         return PlotInfo(
             name=name,
@@ -0,0 +1,67 @@
+import pytest
+
+from madgui.model.madx import Model
+
+
+# Small lattice with knobs for all supported kinds of elements. Used by tests
+# that need a MAD-X model but should not depend on hit_models:
+LATTICE = """
+kqf = 1.1;
+kqd = -1.3;
+kh = 0;
+kv = 0;
+kb = 0;
+kh2 = 0;
+kv2 = 0;
+ks = 0;
+ab = 0.05;
+qf: quadrupole, l=0.4, k1:=kqf;
+qd: quadrupole, l=0.4, k1:=kqd;
+m1: marker;
+hk: hkicker, l=0.2, kick:=kh;
+vk: vkicker, kick:=kv;
+mon: monitor;
+b1: sbend, l=1, angle:=ab, e1:=ab/2, e2:=ab/2, k0:=(ab+kb)/1;
+kk: kicker, l=0.3, hkick:=kh2, vkick:=kv2;
+qs: quadrupole, l=0.3, k1s:=ks;
+seq: sequence, l=15, refer=entry;
+qf, at=1;
+m1, at=2;
+qd, at=3;
+qf, at=5;
+m1, at=6;
+qd, at=7.5;
+hk, at=8.2;
+vk, at=8.6;
+mon, at=9;
+b1, at=10;
+kk, at=11.5;
+mon, at=12.5;
+qs, at=13;
+mon, at=14;
+endsequence;
+"""
+
+MODEL = """
+sequence: seq
+range: ['#s', '#e']
+beam: {particle: proton, energy: 2}
+twiss: {betx: 4, bety: 6, alfx: 0.5, alfy: -0.3, x: 0.001, py: -0.0002}
+init-files: [lattice.madx]
+"""
+
+
+@pytest.fixture
+def fodo_file(tmp_path):
+    """Write the model files to a temporary folder and return the path of
+    the model file."""
+    (tmp_path / 'lattice.madx').write_text(LATTICE)
+    (tmp_path / 'model.yml').write_text(MODEL)
+    return tmp_path / 'model.yml'
+
+
+@pytest.fixture
+def fodo(fodo_file):
+    model = Model.load_file(str(fodo_file), stdout=False)
+    yield model
+    model.destroy()
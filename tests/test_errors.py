@@ -0,0 +1,82 @@
+import pytest
+
+from madgui.model.errors import (
+    apply_errors, parse_error, Ealign, Efcomp, Param)
+
+
+def align(model, name):
+    return model.elements[name].align_errors
+
+
+def dkn(model, name):
+    errors = model.elements[name].field_errors
+    return errors and list(errors.dkn[:3])
+
+
+def user_errors(model, name, **kwargs):
+    cmd = model.madx.command
+    cmd.select(flag='error', clear=True)
+    cmd.select(flag='error', range=name)
+    cmd.ealign(**kwargs)
+
+
+@pytest.mark.parametrize('add', [False, True])
+def test_ealign_restore(fodo, add):
+    fodo.madx.command.eoption(add=add)
+    user_errors(fodo, 'qd', dy=2e-3)
+    with apply_errors(fodo, [parse_error('qd<dx>')], [1e-3]):
+        assert align(fodo, 'qd').dx == 1e-3
+        assert align(fodo, 'qd').dy == 2e-3
+    assert align(fodo, 'qd').dx == 0
+    assert align(fodo, 'qd').dy == 2e-3
+    # the EOPTION setting of the user is not changed:
+    user_errors(fodo, 'qd', dy=1e-3)
+    assert align(fodo, 'qd').dy == pytest.approx(3e-3 if add else 1e-3)
+
+
+def test_ealign_twiss(fodo):
+    x = list(fodo.twiss().x)
+    errors = [Ealign({'range': 'qd'}, 'dx'), Param('kh')]
+    with apply_errors(fodo, errors, [1e-3, 1e-4]):
+        x1 = list(fodo.madx.twiss(**fodo._get_twiss_args()).x)
+    with apply_errors(fodo, errors, [1e-3, 1e-4]):
+        x2 = list(fodo.madx.twiss(**fodo._get_twiss_args()).x)
+    assert x1 == x2
+    assert x1 != x
+    assert list(fodo.madx.twiss(**fodo._get_twiss_args()).x) == x
+
+
+def test_ealign_shared(fodo):
+    errors = [
+        Ealign({'range': 'qd'}, 'dx'),
+        Ealign({'range': 'qd[2]'}, 'dx'),
+        Ealign({'range': 'qd[2]'}, 'dy'),
+        Ealign({'range': 'qf[2]'}, 'dx'),
+    ]
+    with apply_errors(fodo, errors, [1e-3, 1e-3, 2e-3, 1e-3]):
+        assert align(fodo, 'qd').dx == 1e-3
+        assert align(fodo, 'qd').dy == 0
+        assert align(fodo, 'qd[2]').dx == 1e-3
+        assert align(fodo, 'qd[2]').dy == 2e-3
+        assert align(fodo, 'qf[2]').dx == 1e-3
+        assert align(fodo, 'qf') is None
+    for name in ('qd', 'qd[2]', 'qf[2]'):
+        assert align(fodo, name).dx == align(fodo, name).dy == 0
+
+
+@pytest.mark.parametrize('add', [False, True])
+def test_efcomp_restore(fodo, add):
+    fodo.madx.command.eoption(add=add)
+    cmd = fodo.madx.command
+    cmd.select(flag='error', clear=True)
+    cmd.select(flag='error', range='qf')
+    cmd.efcomp(dkn=[1e-4])
+    error = Efcomp({'range': 'qf'}, 'dkn', [0, 1e-3])
+    with apply_errors(fodo, [error], [2]):
+        assert dkn(fodo, 'qf') == pytest.approx([1e-4, 2e-3, 0])
+    assert dkn(fodo, 'qf') == pytest.approx([1e-4, 0, 0])
+
+
+def test_efcomp_relative():
+    with pytest.raises(ValueError):
+        Efcomp({'range': 'qf'}, 'dknr', [0, 1e-3])
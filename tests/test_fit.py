@@ -0,0 +1,224 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+import pytest
+
+from madgui.model.pool import ModelPool, ObjectiveExecutor
+from madgui.util.fit import (
+    fit, fit_broyden, fit_least_squares, jacobian, ResponseSolver,
+    response_solver)
+
+
+class Counted:
+
+    """Objective function that counts its evaluations."""
+
+    def __init__(self, func):
+        self.func = func
+        self.calls = 0
+
+    def __call__(self, x):
+        self.calls += 1
+        return self.func(np.asarray(x))
+
+
+def linear_problem(seed=0):
+    """Return ``(A, b, x_opt)`` of the overdetermined least squares problem
+    ``A x ≈ b``, i.e. of the quadratic ``χ²(x) = |A x - b|²``."""
+    rng = np.random.default_rng(seed)
+    A = rng.normal(size=(8, 3))
+    b = rng.normal(size=8)
+    x_opt = np.linalg.lstsq(A, b, rcond=None)[0]
+    return A, b, x_opt
+
+
+def exponential(x):
+    t = np.linspace(0, 2, 10)
+    return x[0] * np.exp(-x[1] * t) - 2 * np.exp(-0.7 * t)
+
+
+@pytest.mark.parametrize('scheme', ['twopoint', 'central'])
+def test_broyden_quadratic(scheme):
+    A, b, x_opt = linear_problem()
+    f = Counted(lambda x: A @ x - b)
+    result = fit_broyden(
+        f, np.zeros(3), delta=1e-4, rcond=None, scheme=scheme)
+    assert result.success
+    np.testing.assert_allclose(result.x, x_opt, atol=1e-8)
+    np.testing.assert_allclose(result.fun, A @ x_opt - b, atol=1e-8)
+    assert result.nfev == f.calls
+    assert result.njev == 1
+
+
+def test_broyden_nonlinear():
+    f = Counted(exponential)
+    result = fit(f, [1.5, 0.5], algorithm='broyden', delta=1e-6,
+                 rcond=None, iterations=100)
+    assert result.success
+    np.testing.assert_allclose(result.x, [2, 0.7], atol=1e-6)
+    assert result.nfev == f.calls
+    assert result.njev < result.nfev
+
+
+def test_broyden_analytic_jacobian():
+    A, b, x_opt = linear_problem(1)
+    f = Counted(lambda x: A @ x - b)
+    result = fit_broyden(f, np.ones(3), jac=lambda x: A.T, rcond=None)
+    np.testing.assert_allclose(result.x, x_opt, atol=1e-10)
+    # the second step is found to be zero without evaluating f:
+    assert f.calls == result.nfev == 2
+
+
+@pytest.mark.parametrize('method', ['trf', 'dogbox', 'lm'])
+@pytest.mark.parametrize('scheme', ['twopoint', 'central'])
+def test_least_squares_quadratic(method, scheme):
+    A, b, x_opt = linear_problem()
+    f = Counted(lambda x: A @ x - b)
+    result = fit_least_squares(
+        f, np.zeros(3), delta=1e-4, method=method, scheme=scheme)
+    assert result.success
+    np.testing.assert_allclose(result.x, x_opt, atol=1e-6)
+    assert result.chisq == pytest.approx(np.mean((A @ x_opt - b)**2))
+    assert result.nfev == f.calls
+
+
+def test_least_squares_nonlinear():
+    f = Counted(exponential)
+    result = fit(f, [1.0, 0.1], algorithm='least_squares')
+    assert result.success
+    np.testing.assert_allclose(result.x, [2, 0.7], atol=1e-6)
+    assert result.nfev == f.calls
+
+
+def test_least_squares_bounds():
+    A, b, x_opt = linear_problem()
+    f = Counted(lambda x: A @ x - b)
+    upper = x_opt[2] / 2
+    bounds = [(-np.inf, np.inf), (-np.inf, np.inf), (-np.inf, upper)]
+    result = fit_least_squares(f, np.zeros(3), bounds=bounds)
+    assert result.x[2] == pytest.approx(upper)
+    assert result.chisq > np.mean((A @ x_opt - b)**2)
+
+
+def test_least_squares_analytic_jacobian():
+    A, b, x_opt = linear_problem(1)
+    f = Counted(lambda x: A @ x - b)
+    result = fit_least_squares(f, np.ones(3), jac=lambda x: A.T)
+    np.testing.assert_allclose(result.x, x_opt, atol=1e-8)
+    assert result.nfev == f.calls
+
+
+@pytest.mark.parametrize('method', ['svd', 'qr'])
+def test_response_solver(method):
+    A, b, x_opt = linear_problem()
+    solver = ResponseSolver(A, method=method)
+    assert solver.rank == 3
+    np.testing.assert_allclose(solver.solve(b), x_opt, atol=1e-12)
+    Y = np.random.default_rng(1).normal(size=(8, 4))
+    np.testing.assert_allclose(
+        solver.solve(Y), np.linalg.lstsq(A, Y, rcond=None)[0], atol=1e-12)
+
+
+def test_response_solver_underdetermined():
+    A, b, x_opt = linear_problem()
+    solver = ResponseSolver(A.T)
+    y = b[:3]
+    # minimum norm solution:
+    np.testing.assert_allclose(
+        solver.solve(y), np.linalg.lstsq(A.T, y, rcond=None)[0],
+        atol=1e-12)
+    with pytest.raises(np.linalg.LinAlgError):
+        ResponseSolver(A.T, method='qr')
+
+
+def test_response_solver_cutoff():
+    A, b, x_opt = linear_problem()
+    s = np.linalg.svd(A, compute_uv=False)
+    rcond = (s[1] + s[2]) / 2 / s[0]
+    solver = ResponseSolver(A, rcond=rcond)
+    assert solver.rank == 2
+    np.testing.assert_allclose(
+        solver.solve(b), np.linalg.lstsq(A, b, rcond=rcond)[0], atol=1e-12)
+    assert ResponseSolver(A, rank=1).rank == 1
+
+
+def test_response_solver_tikhonov():
+    A, b, x_opt = linear_problem()
+    lam = 0.5
+    # augmented least squares problem for |A x - y|² + λ² |x|²:
+    A_aug = np.vstack((A, lam * np.eye(3)))
+    b_aug = np.hstack((b, np.zeros(3)))
+    np.testing.assert_allclose(
+        ResponseSolver(A, tikhonov=lam).solve(b),
+        np.linalg.lstsq(A_aug, b_aug, rcond=None)[0], atol=1e-12)
+
+
+def test_response_solver_cache():
+    A, b, x_opt = linear_problem()
+    solver = response_solver(A, rows=[0, 2, 3, 5, 7])
+    assert response_solver(A, rows=[0, 2, 3, 5, 7]) is solver
+    assert response_solver(A[:], rows=[0, 2, 3, 5, 7]) is solver
+    assert response_solver(A.copy(), rows=[0, 2, 3, 5, 7]) is not solver
+    assert response_solver(A, rows=[0, 2, 3, 5]) is not solver
+    assert response_solver(A, rows=[0, 2, 3, 5, 7], rcond=1e-3) \
+        is not solver
+    rows = [0, 2, 3, 5, 7]
+    np.testing.assert_allclose(
+        solver.solve(b[rows]),
+        np.linalg.lstsq(A[rows], b[rows], rcond=None)[0], atol=1e-12)
+    stacked = response_solver([A[:4], A[4:]])
+    np.testing.assert_allclose(stacked.solve(b), x_opt, atol=1e-12)
+
+
+def exponential_jacobian(x):
+    t = np.linspace(0, 2, 10)
+    return np.array([np.exp(-x[1] * t), -t * x[0] * np.exp(-x[1] * t)])
+
+
+@pytest.mark.parametrize('scheme', ['twopoint', 'central'])
+def test_jacobian_accuracy(scheme):
+    x0 = np.array([1.5, 0.3])
+    jac = jacobian(exponential, x0, delta='relative', scheme=scheme)
+    np.testing.assert_allclose(
+        jac, exponential_jacobian(x0),
+        atol=1e-7 if scheme == 'twopoint' else 1e-9)
+
+
+@pytest.mark.parametrize('scheme', ['twopoint', 'central'])
+def test_jacobian_thread_pool(scheme):
+    x0 = np.array([1.5, 0.3])
+    serial = jacobian(exponential, x0, delta=1e-4, scheme=scheme)
+    with ThreadPoolExecutor(2) as executor:
+        parallel = jacobian(
+            exponential, x0, delta=1e-4, scheme=scheme, executor=executor)
+    assert np.array_equal(parallel, serial)
+
+
+def orbit_at_monitor(model, x):
+    """Return the orbit at the last monitor for the given kicker strengths,
+    and restore the kicker strengths."""
+    old = {'kh': model.globals.kh, 'kv': model.globals.kv}
+    model.update_globals({'kh': x[0], 'kv': x[1]})
+    try:
+        twiss = model.twiss()
+        i = model.indices[model.elements.index('mon[3]')]
+        return np.array([twiss.x[i], twiss.y[i]])
+    finally:
+        model.update_globals(old)
+
+
+@pytest.mark.parametrize('scheme', ['twopoint', 'central'])
+def test_jacobian_objective_executor(fodo, scheme):
+    f = partial(orbit_at_monitor, fodo)
+    x0 = np.array([1e-4, -2e-4])
+    serial = jacobian(f, x0, delta=1e-5, scheme=scheme)
+    pool = ModelPool(fodo, 2)
+    try:
+        parallel = jacobian(
+            f, x0, delta=1e-5, scheme=scheme,
+            executor=ObjectiveExecutor(pool))
+    finally:
+        pool.close()
+    assert np.array_equal(parallel, serial)
+    assert np.any(serial)
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from madgui.model.linear import LinearOptics
+
+
+ORBIT = ['x', 'px', 'y', 'py']
+SIGMA = ['sig11', 'sig12', 'sig22', 'sig33', 'sig34', 'sig44']
+
+
+def assert_columns_equal(result, twiss, columns, rtol):
+    for col in columns:
+        scale = np.abs(twiss[col]).max()
+        np.testing.assert_allclose(
+            result[col], twiss[col], rtol=0, atol=rtol * scale,
+            err_msg=col)
+
+
+def test_initial_state(fodo):
+    optics = fodo.linear_optics()
+    assert isinstance(optics, LinearOptics)
+    twiss = fodo.twiss()
+    result = optics.twiss()
+    assert_columns_equal(result, twiss, SIGMA, 1e-12)
+    # MAD-X computes the orbit to second order in the sbend:
+    assert_columns_equal(result, twiss, ORBIT, 1e-4)
+
+
+def test_update_quadrupoles(fodo):
+    fodo.update_twiss_args({'x': 0, 'py': 0})
+    optics = fodo.linear_optics()
+    fodo.update_globals({'kqf': 1.25, 'kqd': -1.2})
+    assert fodo.linear_optics() is optics
+    assert optics.synced
+    assert_columns_equal(optics.twiss(), fodo.twiss(), SIGMA, 1e-12)
+
+
+def test_update_kickers(fodo):
+    fodo.update_twiss_args({'x': 0, 'py': 0})
+    optics = fodo.linear_optics()
+    fodo.update_globals({'kh': 2e-5, 'kv': 1e-5, 'kh2': -1e-5, 'kv2': 3e-5})
+    assert fodo.linear_optics() is optics
+    result = optics.twiss()
+    assert np.abs(result['x']).max() > 1e-5
+    assert_columns_equal(result, fodo.twiss(), ORBIT, 1e-5)
+
+
+def test_update_unsupported(fodo):
+    optics = fodo.linear_optics()
+    fodo.update_globals({'ks': 0.1})
+    # skew quadrupoles are not supported, so the engine is recreated:
+    assert not optics.synced
+    optics = fodo.linear_optics()
+    assert optics.synced
+    assert_columns_equal(optics.twiss(), fodo.twiss(), SIGMA, 1e-12)
+
+
+def match_both(model, vary, constraints, **kwargs):
+    """Return the results of linear and MAD-X matching, both started from
+    the current state."""
+    old = {v: model.globals[v] for v in vary}
+    linear = model.match_linear(vary, constraints, **kwargs)
+    assert linear is not None
+    model.update_globals(old)
+    madx = model.match(vary, constraints, method='madx')
+    return linear, madx
+
+
+def targets(model, values, constraints):
+    """Return the constraints with the values for the given knob values."""
+    old = {k: model.globals[k] for k in values}
+    model.update_globals(values)
+    twiss = model.twiss()
+    result = [
+        (elem, pos, axis, twiss[axis][model.indices[elem.index]])
+        for elem, pos, axis in constraints
+    ]
+    model.update_globals(old)
+    return result
+
+
+def test_match_kickers(fodo):
+    mon = fodo.elements['mon[3]']
+    constraints = targets(fodo, {'kh': 2e-4, 'kv2': -1e-4}, [
+        (mon, None, 'x'), (mon, None, 'y')])
+    # the orbit constraints are small compared to the default tolerance:
+    linear, madx = match_both(
+        fodo, ['kh', 'kv2'], constraints, tolerance=1e-20)
+    assert linear['kh'] == pytest.approx(madx['kh'], rel=1e-6)
+    assert linear['kv2'] == pytest.approx(madx['kv2'], rel=1e-6)
+    assert linear['kh'] == pytest.approx(2e-4, rel=1e-6)
+
+
+def test_match_quadrupoles(fodo):
+    mon = fodo.elements['mon']
+    constraints = targets(fodo, {'kqf': 1.15, 'kqd': -1.25}, [
+        (mon, None, 'sig11'), (mon, None, 'sig33')])
+    linear, madx = match_both(fodo, ['kqf', 'kqd'], constraints)
+    assert linear['kqf'] == pytest.approx(madx['kqf'], rel=1e-6)
+    assert linear['kqd'] == pytest.approx(madx['kqd'], rel=1e-6)
+
+
+def test_match_unsupported(fodo):
+    fodo.twiss()
+    mon = fodo.elements['mon[3]']
+    constraints = [(mon, None, 'x', 0)]
+    # coupled quadrupole:
+    assert fodo.match_linear(['ks'], constraints) is None
+    # variable that also determines the dipole pole face angles:
+    assert fodo.match_linear(['ab'], constraints) is None
+
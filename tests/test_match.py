@@ -0,0 +1,47 @@
+import pytest
+
+from madgui.model.match import Matcher, Constraint
+
+
+@pytest.fixture
+def matcher(fodo):
+    fodo.twiss()
+    return Matcher(fodo)
+
+
+def test_allvars(matcher):
+    positions, knobs = matcher._allvars('sig11')
+    assert positions == [1, 3, 5, 7.5, 13]
+    assert knobs == ['kqf', 'kqd', 'kqf', 'kqd', 'ks']
+    assert matcher._allvars('sig11') == (positions, knobs)
+    assert matcher._allvars('sig11')[0] is positions
+
+
+def test_upstream_vars(matcher):
+    knobs = list(matcher._upstream_vars('x', 14, set()))
+    # the order of knobs at the same position is unspecified:
+    assert knobs[0] == 'ks'
+    assert set(knobs[1:3]) == {'kh2', 'kv2'}
+    assert set(knobs[3:5]) == {'kb', 'ab'}
+    assert knobs[5:] == ['kh', 'kqd', 'kqf']
+    assert list(matcher._upstream_vars('y', 10, {'kqd'})) == ['kv', 'kqf']
+    # knobs at the constraint position are not upstream:
+    assert list(matcher._upstream_vars('x', 8.2, set())) == ['kqd', 'kqf']
+    assert next(matcher._upstream_vars('x', 8.2 + 1e-9, set())) == 'kh'
+    assert list(matcher._upstream_vars('x', 1, set())) == []
+
+
+def test_most_sensitive_var(fodo, matcher):
+    mon = fodo.elements['mon[3]']
+    orbit = Constraint(mon, mon.position, 'x', 0)
+    candidates = list(matcher._upstream_vars('x', mon.position, set()))
+    # knobs with unsupported elements (`ks`, `ab`) and without effect on
+    # the constraint (`kv2`) are ranked last:
+    assert matcher._most_sensitive_var(orbit, candidates) == 'kh'
+    assert matcher._most_sensitive_var(orbit, candidates[:3]) == 'kh2'
+    assert matcher._most_sensitive_var(orbit, ['ks', 'ab']) == 'ks'
+    assert matcher._most_sensitive_var(orbit, ['kv2']) == 'kv2'
+    assert matcher._most_sensitive_var(orbit, []) is None
+    # axis not supported by the linear optics:
+    beta = Constraint(mon, mon.position, 'betx', 0)
+    assert matcher._most_sensitive_var(beta, candidates) == 'ks'
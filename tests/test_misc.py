@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from madgui.util.misc import LRUCache, freeze, memoize_lru
+
+
+def test_freeze():
+    a = freeze({'b': [1, 2], 'a': {'c': {3, 4}}})
+    b = freeze({'a': {'c': {4, 3}}, 'b': [1, 2]})
+    assert a == b
+    assert hash(a) == hash(b)
+    assert freeze({'b': (1, 2)}) == freeze({'b': [1, 2]})
+    assert freeze({'b': [2, 1]}) != freeze({'b': [1, 2]})
+
+
+def test_freeze_array():
+    x = np.arange(6.0)
+    assert freeze(x) == freeze(x.copy())
+    assert freeze(x) != freeze(x.reshape((2, 3)))
+    hash(freeze({'x': x}))
+
+
+def test_lru_cache_eviction():
+    evicted = []
+    cache = LRUCache(2, evicted.append)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache['a'] == 1
+    cache['c'] = 3
+    assert evicted == [2]
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    assert len(cache) == 2
+    cache.clear()
+    assert evicted == [2, 1, 3]
+    assert len(cache) == 0
+
+
+def test_lru_cache_stats():
+    cache = LRUCache(2)
+    cache['a'] = 1
+    assert cache['a'] == 1
+    with pytest.raises(KeyError):
+        cache['b']
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+class Model:
+
+    def __init__(self):
+        self.state = 0
+        self.calls = 0
+        self.evicted = []
+
+    def cache_key(self):
+        return self.state
+
+    @memoize_lru(maxsize=2, evict='_evict')
+    def compute(self, values, scale=1):
+        self.calls += 1
+        return np.array(values) * scale + self.state
+
+    def _evict(self, value):
+        self.evicted.append(value)
+
+
+def test_memoize_lru():
+    model = Model()
+    a = model.compute([1, 2])
+    assert model.compute([1, 2]) is a
+    assert model.compute((1, 2)) is a
+    assert model.calls == 1
+    model.compute([1, 2], scale=2)
+    assert model.calls == 2
+    model.state = 1
+    b = model.compute([1, 2])
+    assert model.calls == 3
+    np.testing.assert_array_equal(b, [2, 3])
+    # the least recently used result was discarded:
+    assert len(model.evicted) == 1
+    assert model.evicted[0] is a
+    model.state = 0
+    model.compute([1, 2])
+    assert model.calls == 4
+    assert model._compute_cache.misses == 4
+    assert model._compute_cache.hits == 2
+
+
+def test_memoize_lru_readonly():
+    model = Model()
+    a = model.compute([1, 2])
+    with pytest.raises(ValueError):
+        a[0] = 0
+    assert model.compute([1, 2]) is a
+    np.testing.assert_array_equal(a, [1, 2])
@@ -1,8 +1,13 @@
-# This test requires that you have cloned hit_models to the root directory!
+# The sample model tests require that you have cloned hit_models to the root
+# directory!
 
 from unittest import mock
 
-from madgui.model.madx import Model
+import numpy as np
+import pytest
+
+from madgui.model.errors import Ealign, Param
+from madgui.model.madx import Model, InterpolatedTwissTable
 
 
 def test_load_model():
@@ -17,3 +22,237 @@ def test_load_model_without_def():
         'sample_model/sample.cpymad.yml',
         undo_stack=mock.Mock())
     assert model.seq_name == 'beamline1'
+
+
+def test_element_list_names(fodo):
+    elements = fodo.elements
+    names = list(elements.names)
+    assert len(elements) == len(names)
+    qf1, qf2 = [i for i, name in enumerate(names)
+                if name.split('[')[0] == 'qf']
+    # plain name refers to the first occurrence:
+    assert elements.index('qf') == qf1
+    # node names:
+    assert elements.index('qf[1]') == qf1
+    assert elements.index('qf[2]') == qf2
+    # twiss table names:
+    assert elements.index('qf:1') == qf1
+    assert elements.index('qf:2') == qf2
+    assert elements.index('QF:2') == qf2
+    # implicit drifts:
+    drift = names.index('drift_0[0]')
+    assert elements.index('drift_0[0]') == drift
+    # range markers and integer indices:
+    assert elements.index('#s') == 0
+    assert elements.index('#e') == len(names) - 1
+    assert elements.index(-1) == len(names) - 1
+    assert elements.index(np.int64(qf2)) == qf2
+    assert elements.index(elements[qf2]) == qf2
+    assert elements['qf:2'].index == qf2
+    assert elements['m1[2]'].position == 6
+    with pytest.raises(ValueError):
+        elements.index('qf[3]')
+    with pytest.raises(TypeError):
+        elements.index(1.5)
+
+
+@pytest.mark.parametrize('slices', [2, 5])
+def test_interpolated_twiss_quadrupoles(fodo, slices):
+    results, _ = fodo._twiss_pass()
+    counts = np.zeros(len(results.s), dtype=int)
+    quads = (results.keyword == 'quadrupole') & (results.l > 0)
+    counts[quads] = slices - 1
+    table = InterpolatedTwissTable(results, results.maps, counts=counts)
+    madx = fodo.madx
+    madx.command.select(flag='interpolate', clear=True)
+    madx.command.select(flag='interpolate', class_='quadrupole', slice=slices)
+    try:
+        ref = madx.twiss(**fodo._get_twiss_args(table='interpolated'))
+    finally:
+        madx.command.select(flag='interpolate', clear=True)
+    assert len(table.s) == len(ref.s) == len(results.s) + counts.sum()
+    for col in ['s', 'x', 'px', 'y', 'py', 'mux', 'muy',
+                'sig11', 'sig12', 'sig22', 'sig33', 'sig34', 'sig44']:
+        np.testing.assert_allclose(table[col], ref[col], atol=1e-10)
+
+
+def test_orbit_response_analytic(fodo, caplog):
+    monitors = ['mon', 'mon[2]', 'mon[3]']
+    # kickers, thick and thin, a sbend and a quadrupole (numeric fallback):
+    knobs = ['kh', 'kv', 'kh2', 'kv2', 'kb', 'kqf']
+    numeric = fodo.get_orbit_response_matrix(
+        monitors, knobs, method='numeric')
+    analytic = fodo.get_orbit_response_matrix(
+        monitors, knobs, method='analytic')
+    assert analytic.shape == numeric.shape == (3, 2, 6)
+    scale = np.abs(numeric).max()
+    # dipole kicks of kickers are integrated accurately:
+    np.testing.assert_allclose(
+        analytic[:, :, :4], numeric[:, :, :4], rtol=0, atol=1e-5 * scale)
+    # in the sbend, the kick is slightly affected by the edge focusing:
+    np.testing.assert_allclose(
+        analytic, numeric, rtol=0, atol=1e-3 * scale)
+    # response of the thin kicker at the first monitor (a drift):
+    assert analytic[0, 1, 1] == pytest.approx(0.4)
+    fodo.get_orbit_response_matrix(monitors, knobs, method='verify')
+    assert not caplog.records
+
+
+def test_invalidate_knob(fodo):
+    survey = fodo.survey()
+    table = fodo.element_table()
+    optics = fodo.linear_optics()
+    twiss = fodo.twiss()
+    deps = fodo.knob_dependencies()
+    qf = fodo.elements.index('qf')
+    fodo.update_globals({'kqf': 1.2})
+    # strength changes are patched into the element table and linear optics:
+    assert fodo.element_table() is table
+    assert table.k1[qf] == 1.2
+    assert fodo.linear_optics() is optics
+    assert fodo.knob_dependencies() is deps
+    assert fodo.survey() is survey
+    changed = fodo.twiss()
+    assert changed is not twiss
+    # results for previous states are kept:
+    fodo.update_globals({'kqf': 1.3})
+    fodo.update_globals({'kqf': 1.2})
+    assert fodo.twiss() is changed
+    # the survey depends on the bending angle, but not on k0:
+    fodo.update_globals({'kb': 0.01})
+    assert fodo.survey() is survey
+    assert fodo.element_table() is table
+
+
+def test_invalidate_other(fodo):
+    survey = fodo.survey()
+    table = fodo.element_table()
+    optics = fodo.linear_optics()
+    fodo.twiss()
+    # `ab` also determines the pole face angles:
+    fodo.update_globals({'ab': 0.06})
+    assert fodo.element_table() is not table
+    assert fodo.linear_optics() is not optics
+    assert fodo.survey() is not survey
+    # variables that are not used by any element:
+    table = fodo.element_table()
+    fodo.madx.globals['unused'] = 0
+    fodo.update_globals({'unused': 1})
+    assert fodo.element_table() is not table
+
+
+def test_twiss_arguments(fodo):
+    twiss = fodo.twiss()
+    sector = fodo.sector()
+    summary = fodo.summary
+    other = fodo.twiss(betx=5)
+    assert other.betx[0] == pytest.approx(5)
+    # the current state of the model is not affected:
+    assert fodo.twiss() is twiss
+    assert fodo.sector() is sector
+    assert fodo.summary is summary
+    assert twiss.betx[0] == pytest.approx(4)
+    assert fodo.twiss(betx=5) is other
+
+
+def test_orbit_response_cache(fodo):
+    monitors = ['mon', 'mon[2]']
+    knobs = ['kh', 'kv']
+
+    def get_orm():
+        errors = [Param('kqf'), Ealign({'range': 'qd'}, 'dx')]
+        return fodo.get_orbit_response_matrix(
+            monitors, knobs, errors, [0.01, 1e-4])
+
+    orm = get_orm()
+    # equal errors are recognized, even if they are different objects:
+    assert get_orm() is orm
+    assert fodo.get_orbit_response_matrix(monitors, knobs) is not orm
+
+
+@pytest.mark.parametrize('range', ['qf/mon', 'mon/qf[2]'])
+def test_track_many(fodo, range):
+    fodo.update_globals({'kh': 1e-4, 'kv': -2e-4})
+    init = [1e-3, -2e-4, 5e-4, 1e-4]
+    tracks = fodo.track_many([*init, 0, 0], range)
+    twiss = fodo.track_one(*init, range=range)
+    assert tracks.shape == (1, len(twiss['x']), 6)
+    for i, col in enumerate(['x', 'px', 'y', 'py']):
+        np.testing.assert_allclose(
+            tracks[0, :, i], twiss[col], rtol=0, atol=1e-10, err_msg=col)
+
+
+def base_names(names):
+    """Return the element names without occurrence count, and without the
+    (automatically named) drifts and the start/end markers."""
+    return [
+        'drift' if name.startswith('drift_') else name.split('[')[0]
+        for name in names[1:-1]
+    ]
+
+
+def test_mirror(fodo):
+    fodo.update_globals({'kh': 1e-4, 'kv': -2e-4, 'kb': 0.01})
+    mirror = fodo.get_mirror()
+    names = fodo.elements.names
+    last = len(names) - 1
+    # repeated elements are counted from the other end in the mirror:
+    assert mirror.elements.names[last - names.index('qf')] == 'qf[2]'
+    assert mirror.elements.names[last - names.index('mon[3]')] == 'mon'
+    assert base_names(mirror.elements.names) == base_names(names)[::-1]
+    # backtracking from the end reproduces the forward twiss at the entry of
+    # each element, i.e. at the exit of the preceding element:
+    twiss = fodo.twiss()
+    back = fodo.backtrack(
+        x=-twiss.x[-1], px=twiss.px[-1], y=twiss.y[-1], py=-twiss.py[-1],
+        betx=twiss.betx[-1], alfx=-twiss.alfx[-1],
+        bety=twiss.bety[-1], alfy=-twiss.alfy[-1])
+    assert len(back.s) == last + 1
+    forward = {
+        col: np.array(twiss[col][:last][::-1])
+        for col in ['x', 'px', 'y', 'py', 'betx', 'bety']
+    }
+    np.testing.assert_allclose(back.x[:last], -forward['x'], atol=1e-8)
+    np.testing.assert_allclose(back.px[:last], forward['px'], atol=1e-8)
+    np.testing.assert_allclose(back.y[:last], forward['y'], atol=1e-8)
+    np.testing.assert_allclose(back.py[:last], -forward['py'], atol=1e-8)
+    np.testing.assert_allclose(back.betx[:last], forward['betx'], rtol=1e-5)
+    np.testing.assert_allclose(back.bety[:last], forward['bety'], rtol=1e-5)
+
+
+def test_interpolate_range(fodo):
+    fodo.set_interpolate(150)
+    twiss = fodo.twiss()
+    source = twiss.source
+    names = list(source.name)
+
+    def counts():
+        table = fodo.twiss()
+        assert table.source is source
+        assert len(table.s) == len(source.s) + table.counts.sum()
+        return {
+            name: count
+            for name, count in zip(names, table.counts)
+            if count > 0
+        }
+
+    # 0.1 m steps, only quadrupoles and dipoles are interpolated:
+    assert counts() == {
+        'qf:1': 3, 'qd:1': 3, 'qf:2': 3, 'qd:2': 3, 'b1:1': 9, 'qs:1': 2}
+    # only elements within the visible range:
+    fodo.set_interpolate_range('a', (4, 0))
+    assert counts() == {'qf:1': 14, 'qd:1': 14}
+    # union of multiple ranges, each with its own step:
+    fodo.set_interpolate_range('b', (12.9, 13.4))
+    assert counts() == {'qf:1': 14, 'qd:1': 14, 'qs:1': 89}
+    fodo.set_interpolate_range('a', None)
+    assert counts() == {'qs:1': 89}
+    fodo.set_interpolate_range('b', None)
+    assert counts() == {
+        'qf:1': 3, 'qd:1': 3, 'qf:2': 3, 'qd:2': 3, 'b1:1': 9, 'qs:1': 2}
+
+
+def test_prefetch(fodo):
+    fodo.prefetch_columns.update(['betx', 'x', 'unknown'])
+    twiss = fodo.twiss()
+    assert set(twiss._cache) == {'x', 'sig11', 'sig12', 'sig21', 'sig22'}
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from madgui.model.montecarlo import (
+    MonteCarlo, gauss, uniform, twiss_columns, envelope_max)
+from madgui.model.pool import ModelPool
+
+
+def draw(dist, count=20000):
+    rng = np.random.default_rng(0)
+    return np.array([dist(rng) for _ in range(count)])
+
+
+def test_gauss():
+    values = draw(gauss(2, mean=1))
+    assert values.mean() == pytest.approx(1, abs=0.05)
+    assert values.std() == pytest.approx(2, rel=0.02)
+
+
+def test_gauss_cut():
+    values = draw(gauss(2, mean=1, cut=1))
+    assert np.abs(values - 1).max() <= 2
+    assert values.mean() == pytest.approx(1, abs=0.02)
+    # standard deviation of a normal distribution truncated at ±1σ:
+    assert values.std() == pytest.approx(2 * 0.5377, rel=0.02)
+
+
+def test_uniform():
+    values = draw(uniform(-1, 3))
+    assert values.min() >= -1
+    assert values.max() < 3
+    assert values.mean() == pytest.approx(1, abs=0.03)
+    assert values.std() == pytest.approx(4 / 12**0.5, rel=0.02)
+
+
+def make_study(model, pool=None):
+    return MonteCarlo(model, {
+        'kh': 1e-4,
+        'δkqd': uniform(-0.01, 0.01),
+        'qf<dx>': gauss(1e-4, cut=2),
+    }, {
+        'orbit': twiss_columns(['x', 'y'], ['mon', 'mon[2]']),
+        'envelope': envelope_max(),
+    }, seed=7, pool=pool)
+
+
+def test_samples(fodo):
+    study = make_study(fodo)
+    assert np.array_equal(study.sample(3), make_study(fodo).sample(3))
+    assert not np.array_equal(study.sample(3), study.sample(4))
+
+
+def test_pool_results(fodo):
+    serial = make_study(fodo).run(4)
+    assert serial['orbit'].shape == (4, 2, 2)
+    assert serial['envelope'].shape == (4, 2)
+    assert serial['errors'].shape == (4, 3)
+    assert not np.array_equal(serial['orbit'][0], serial['orbit'][1])
+    pool = ModelPool(fodo, 2)
+    try:
+        parallel = make_study(fodo, pool).run(4)
+        chunk = make_study(fodo, pool).run([2, 3])
+    finally:
+        pool.close()
+    for name in serial:
+        assert np.array_equal(parallel[name], serial[name])
+        assert np.array_equal(chunk[name], serial[name][2:])
@@ -0,0 +1,64 @@
+import time
+
+import numpy as np
+import pytest
+
+from madgui.model.pool import ModelPool
+
+
+COLUMNS = ['x', 'px', 'y', 'py', 'betx', 'bety']
+
+
+@pytest.fixture
+def pool(fodo):
+    pool = ModelPool(fodo, 2)
+    yield pool
+    pool.close()
+
+
+def get_twiss(model, item=None):
+    twiss = model.twiss()
+    return np.array([twiss[col] for col in COLUMNS])
+
+
+def assert_synced(pool):
+    for result in pool.map(get_twiss, range(len(pool))):
+        np.testing.assert_allclose(result, get_twiss(pool.model), rtol=1e-12)
+
+
+def test_sync_knob_state(fodo, pool):
+    assert_synced(pool)
+    fodo.update_globals({'kqf': 1.2, 'kh': 1e-3})
+    fodo.update_element({'kick': 2e-4}, fodo.elements.index('vk'))
+    assert_synced(pool)
+    # only the changes since the last sync are transferred:
+    fodo.update_globals({'kqf': 1.1})
+    assert_synced(pool)
+    assert pool.workers[0].globals.kqf == 1.1
+
+
+def test_sync_generation(fodo, pool):
+    assert_synced(pool)
+    workers = list(pool.workers)
+    # unknown modifications, all globals are transferred to the workers:
+    fodo.madx.globals.kqd = -1.2
+    fodo.invalidate()
+    assert_synced(pool)
+    assert pool.workers == workers
+    assert pool.workers[0].globals.kqd == -1.2
+
+
+def test_imap_order(pool):
+    def task(worker, item):
+        time.sleep(0.02 * (4 - item))
+        return item
+    assert list(pool.imap(task, range(5))) == list(range(5))
+
+
+def test_close(pool):
+    pool.map(get_twiss, [0])
+    pool.close()
+    assert pool.workers == []
+    pool.close()
+    with pytest.raises(ValueError):
+        pool.map(get_twiss, [0])
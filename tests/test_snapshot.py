@@ -0,0 +1,59 @@
+import os
+from unittest import mock
+
+import numpy as np
+
+from madgui.model.madx import Model, ElementTable
+from madgui.model.snapshot import find_called_files
+
+
+def load(fodo_file, folder):
+    return Model.load_file(
+        str(fodo_file), snapshot_dir=str(folder), stdout=False)
+
+
+def test_find_called_files(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'main.madx').write_text(
+        '! call, file="ignored.madx";\n'
+        'CALL, FILE="sub/a.madx";\n')
+    (tmp_path / 'sub' / 'a.madx').write_text("call, file='b.madx';")
+    files = find_called_files(str(tmp_path / 'main.madx'))
+    assert files == [
+        str(tmp_path / 'main.madx'),
+        str(tmp_path / 'sub' / 'a.madx'),
+        str(tmp_path / 'sub' / 'b.madx'),
+    ]
+
+
+def test_snapshot_restore(fodo_file, tmp_path):
+    folder = tmp_path / 'snapshots'
+    model = load(fodo_file, folder)
+    table = model.element_table().export()
+    betx = np.array(model.twiss().betx)
+    model.destroy()
+    assert len(os.listdir(str(folder))) == 2
+    # the element table is restored from the snapshot:
+    with mock.patch.object(ElementTable, '_fetch') as fetch:
+        model = load(fodo_file, folder)
+        assert model.element_table().export() == table
+        assert model.positions == table['position']
+        np.testing.assert_allclose(model.twiss().betx, betx, rtol=1e-12)
+        fetch.assert_not_called()
+    model.destroy()
+
+
+def test_snapshot_called_file(fodo_file, tmp_path):
+    folder = tmp_path / 'snapshots'
+    with (tmp_path / 'lattice.madx').open('a') as f:
+        f.write('call, file="knobs.madx";\n')
+    (tmp_path / 'knobs.madx').write_text('kqf = 1.2;\n')
+    model = load(fodo_file, folder)
+    assert model.globals.kqf == 1.2
+    model.destroy()
+    # changing a CALLed file invalidates the snapshot:
+    (tmp_path / 'knobs.madx').write_text('kqf = 1.3;\n')
+    model = load(fodo_file, folder)
+    assert model.globals.kqf == 1.3
+    model.destroy()
+    assert len(os.listdir(str(folder))) == 4
@@ -0,0 +1,105 @@
+from functools import reduce
+
+import numpy as np
+import pytest
+
+from madgui.model.transfer import TransferMapCache
+
+
+def random_maps(count, seed=0):
+    """Return random `N×7×7` maps that are well-conditioned and have the
+    layout of MAD-X sectormaps (kicks in the last column)."""
+    rng = np.random.default_rng(seed)
+    maps = np.tile(np.eye(7), (count, 1, 1))
+    maps[:, :6, :] += rng.normal(scale=0.3, size=(count, 6, 7))
+    return maps
+
+
+def direct_product(maps, i, j):
+    """Multiply the maps in ``[i, j)`` one by one."""
+    return reduce(lambda acc, m: np.dot(m, acc), maps[i:j], np.eye(7))
+
+
+def all_intervals(count):
+    return [(i, j) for i in range(count + 1) for j in range(i, count + 1)]
+
+
+def test_prefix_products():
+    maps = random_maps(9)
+    cache = TransferMapCache(maps)
+    assert len(cache) == 9
+    for j in range(10):
+        np.testing.assert_allclose(
+            cache.prefix[j], direct_product(maps, 0, j), atol=1e-12)
+
+
+def test_inverse_products():
+    maps = random_maps(9)
+    cache = TransferMapCache(maps)
+    assert cache.stable.all()
+    for j in range(10):
+        np.testing.assert_allclose(
+            np.dot(cache.inverse[j], cache.prefix[j]), np.eye(7),
+            atol=1e-10)
+
+
+@pytest.mark.parametrize('max_cond', [1e6, 1e3, 1])
+def test_inverse_maps(max_cond):
+    maps = random_maps(9)
+    cache = TransferMapCache(maps, max_cond=max_cond)
+    for i, j in all_intervals(9):
+        np.testing.assert_allclose(
+            cache.inverse_maps(i, j), np.linalg.inv(maps[i:j]), atol=1e-10)
+
+
+@pytest.mark.parametrize('count', [1, 5, 8, 13])
+def test_product(count):
+    maps = random_maps(count)
+    cache = TransferMapCache(maps)
+    for i, j in all_intervals(count):
+        np.testing.assert_allclose(
+            cache.product(i, j), direct_product(maps, i, j), atol=1e-10)
+
+
+@pytest.mark.parametrize('count', [1, 5, 8, 13])
+def test_tree_product(count):
+    maps = random_maps(count)
+    cache = TransferMapCache(maps)
+    for i, j in all_intervals(count):
+        np.testing.assert_allclose(
+            cache._tree_product(i, j), direct_product(maps, i, j),
+            atol=1e-10)
+
+
+def test_unstable_prefix_uses_tree():
+    maps = random_maps(6)
+    cache = TransferMapCache(maps, max_cond=1)
+    assert not cache.stable[1:].any()
+    for i, j in all_intervals(6):
+        np.testing.assert_allclose(
+            cache.product(i, j), direct_product(maps, i, j), atol=1e-10)
+    assert cache._tree is not None
+
+
+def test_product_clips_interval():
+    maps = random_maps(4)
+    cache = TransferMapCache(maps)
+    np.testing.assert_allclose(
+        cache.product(-2, 10), direct_product(maps, 0, 4), atol=1e-12)
+    np.testing.assert_array_equal(cache.product(3, 1), np.eye(7))
+
+
+def test_update():
+    maps = random_maps(11)
+    cache = TransferMapCache(maps, max_cond=1e3)
+    cache._get_tree()
+    new_maps = random_maps(3, seed=1)
+    cache.update(4, new_maps)
+    maps[4:7] = new_maps
+    np.testing.assert_array_equal(cache.maps, maps)
+    for i, j in all_intervals(11):
+        expected = direct_product(maps, i, j)
+        np.testing.assert_allclose(
+            cache.product(i, j), expected, atol=1e-10)
+        np.testing.assert_allclose(
+            cache._tree_product(i, j), expected, atol=1e-10)
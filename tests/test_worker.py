@@ -0,0 +1,81 @@
+import threading
+
+import numpy as np
+import pytest
+
+from madgui.model.worker import TwissWorker
+
+
+@pytest.fixture
+def worker(fodo):
+    # Results are delivered by calling `_deliver` from the test rather than
+    # from a Qt main loop:
+    ready = threading.Event()
+    worker = TwissWorker(fodo, schedule=ready.set)
+    worker.ready = ready
+    yield worker
+    worker.close()
+    worker._thread.join(30)
+
+
+def wait(worker):
+    assert worker.ready.wait(30)
+    worker.ready.clear()
+
+
+def test_deliver(fodo, worker):
+    sig11 = np.array(fodo.twiss().sig11)
+    fodo.update_globals({'kqf': 1.2, 'kh': 1e-4})
+    worker.request()
+    wait(worker)
+    worker._deliver()
+    assert '_twiss' in fodo.__dict__
+    twiss = fodo.twiss()
+    assert not np.allclose(twiss.sig11, sig11)
+    fodo.invalidate()
+    for col in ['x', 'px', 'sig11', 'sig33']:
+        np.testing.assert_allclose(
+            twiss[col], fodo.twiss()[col], rtol=1e-12, err_msg=col)
+
+
+def test_stale_result(fodo, worker):
+    worker.request()
+    wait(worker)
+    key = fodo.cache_key()
+    fodo.update_globals({'kqf': 1.2})
+    assert not fodo._set_twiss(key, None)
+    # delivering the stale result triggers a new request:
+    worker._deliver()
+    assert '_twiss' not in fodo.__dict__
+    wait(worker)
+    worker._deliver()
+    assert '_twiss' in fodo.__dict__
+
+
+def test_coalesce_requests(fodo, worker):
+    computed = []
+    started = threading.Event()
+    proceed = threading.Event()
+
+    def compute(request):
+        computed.append(request.key)
+        started.set()
+        proceed.wait(30)
+        return None
+
+    worker._compute = compute
+    worker.request()
+    assert started.wait(30)
+    # changes while busy replace the pending request:
+    fodo.update_globals({'kqf': 1.2})
+    worker.request()
+    fodo.update_globals({'kqf': 1.3})
+    worker.request()
+    key = fodo.cache_key()
+    assert worker._request.key == key
+    proceed.set()
+    wait(worker)
+    # the superseded result of the first request is never delivered:
+    assert worker._result == (key, None)
+    assert len(computed) == 2
+    assert computed[1] == key